@@ -1 +0,0 @@
-nul 
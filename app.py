@@ -1,9 +1,13 @@
+import time
+_import_start = time.perf_counter()
 from dash import Dash
 import os
 import argparse
 import warnings
 from layout.layout import create_layout, get_style_sheets
-# from data.db import initial_setup
+from layout.routes import register_routes
+from data.loader import start_data_load, record_timing
+record_timing('import', time.perf_counter() - _import_start)
 warnings.filterwarnings('ignore', category=FutureWarning)
 PROD = True
 DEPRECATED = False
@@ -11,13 +15,18 @@ DEPRECATED = False
 # Initialize the app
 dash_app = Dash(__name__, external_stylesheets=get_style_sheets())
 # server = dash_app.server  # Needed for deployment
+register_routes(dash_app.server)
 
 # Ensure a valid port is assigned
 PORT = int(os.environ.get("PORT", 8050))
 
 
-# Layout
-dash_app.layout = create_layout()
+# Layout, built per page load; the dataset loads in the background
+_layout_start = time.perf_counter()
+dash_app.layout = create_layout
+create_layout()  # built once here for the startup report
+record_timing('layout', time.perf_counter() - _layout_start)
+start_data_load()
 
 
 def parse_args():
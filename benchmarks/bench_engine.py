@@ -0,0 +1,59 @@
+'''
+Compare a new engine per call (the old get_engine behaviour) with the
+shared pooled engine.
+
+Run from the repository root:
+    python -m benchmarks.bench_engine -n 500 -t 8
+'''
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, text
+from data import config
+from data.db import get_engine, dispose_engine
+
+query = text("SELECT count(*) FROM grocery")
+
+
+def per_call_engine():
+    engine = create_engine(f'sqlite:///{config.DB_PATH}')
+    with engine.connect() as conn:
+        conn.execute(query).fetchall()
+    engine.dispose()
+
+
+def pooled_engine():
+    with get_engine().connect() as conn:
+        conn.execute(query).fetchall()
+
+
+def run(fn, n, threads):
+    '''
+    Call fn n times over a thread pool, return elapsed seconds
+    '''
+    start = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(lambda _: fn(), range(n)))
+    else:
+        for _ in range(n):
+            fn()
+    return time.perf_counter() - start
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=500)
+    parser.add_argument('-t', '--threads', type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # warm the pool so connection setup is not counted against it
+    pooled_engine()
+    for name, fn in [('per-call engine', per_call_engine), ('pooled engine', pooled_engine)]:
+        elapsed = run(fn, args.number, args.threads)
+        print(f"{name:>16}: {elapsed:.3f}s total, {elapsed / args.number * 1e3:.3f} ms/query, "
+              f"{args.number / elapsed:,.0f} queries/s")
+    dispose_engine()
@@ -0,0 +1,96 @@
+'''
+Benchmark the ingest transform (convert_data_types + add_fields) against
+the original list-comprehension implementation and check both agree.
+
+Run from the repository root:
+    python -m benchmarks.bench_ingest -n 1000000
+    python -m benchmarks.bench_ingest --path grocery.csv
+'''
+import argparse
+import re
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from data.data import convert_data_types, add_fields, read_dataset
+from benchmarks.synthetic import make_raw_frame
+
+
+def legacy_convert_data_types(df):
+    '''
+    convert_data_types before vectorization, kept as the reference output
+    '''
+    df = df.rename(columns={'Catagory':'Category'})
+    date_cols = [c for c in df.columns if 'date' in c.lower()]
+    for c in date_cols:
+        df[c] = pd.to_datetime(df[c])
+    df['Unit_Price'] = [float(re.sub(r'[\$,]', '',v)) for v in df['Unit_Price'].values]
+    df['percentage'] = [float(re.sub(r'[\%,]', '',v)) / 100 for v in df['percentage'].values]
+    return df
+
+
+def legacy_add_fields(df):
+    '''
+    add_fields before vectorization, kept as the reference output
+    '''
+    df['Revenue'] = (df['Sales_Volume'] * df['Unit_Price']).round(2)
+    df['Inventory Value'] = df['Unit_Price'] * df['Stock_Quantity']
+    df['Discontinued'] = df['Status'] == 'Discontinued'
+    df['Low Stock'] = df['Stock_Quantity'] < df['Reorder_Level']
+    df['Expired'] = df['Expiration_Date'] <= datetime.today()
+    df['Restock'] = ((df['Low Stock'] == True) | (df['Expired'] == True)) & (df['Status'] == 'Active')
+    return df
+
+
+def measure(transform, raw):
+    '''
+    Run transform on copies of raw, return (output, seconds, peak bytes).
+    Timing and tracemalloc run separately since tracing slows allocation heavy code.
+    '''
+    df = raw.copy()
+    start = time.perf_counter()
+    out = transform(df)
+    elapsed = time.perf_counter() - start
+    df = raw.copy()
+    tracemalloc.start()
+    transform(df)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+
+def compare(expected, actual):
+    '''
+    Column-by-column check that the outputs hold the same values
+    '''
+    assert list(expected.columns) == list(actual.columns), 'column order differs'
+    for c in expected.columns:
+        left, right = expected[c], actual[c]
+        if pd.api.types.is_numeric_dtype(left) and not pd.api.types.is_bool_dtype(left):
+            np.testing.assert_allclose(left.to_numpy(dtype='float64', na_value=np.nan),
+                                       right.to_numpy(dtype='float64', na_value=np.nan),
+                                       rtol=1e-6, equal_nan=True, err_msg=c)
+        else:
+            assert (left.astype(object).fillna('') == right.astype(object).fillna('')).all(), c
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--rows', type=int, default=200000)
+    parser.add_argument('--path', help='raw CSV/XLSX/JSON file to use instead of synthetic rows')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    raw = read_dataset(args.path) if args.path else make_raw_frame(args.rows)
+    results = {}
+    for name, transform in [('legacy', lambda df: legacy_add_fields(legacy_convert_data_types(df))),
+                            ('vectorized', lambda df: add_fields(convert_data_types(df)))]:
+        out, elapsed, peak = measure(transform, raw)
+        results[name] = out
+        print(f"{name:>10}: {len(raw) / elapsed:,.0f} rows/s, {elapsed:.3f}s, "
+              f"peak {peak / 2**20:,.1f} MiB, frame {out.memory_usage(deep=True).sum() / 2**20:,.1f} MiB")
+    compare(results['legacy'], results['vectorized'])
+    print("outputs match")
@@ -0,0 +1,64 @@
+'''
+Benchmark the ingest, storage and dashboard functions on synthetic rows and
+write the timings as JSON so runs can be compared across releases.
+
+The suite rewrites the grocery table, so point it at a scratch database.
+Run from the repository root:
+    GROCERY_DB_PATH=/tmp/bench.db python -m benchmarks.bench_suite -n 1000000 --output bench.json
+'''
+import argparse
+import os
+from data import config
+from data.data import convert_data_types, add_fields, rename_for_layout
+from data.db import create_db, get_all_data, get_date_bounds, get_distinct_values
+from layout.layout import filter_data, generate_kpis, generate_charts, data_table_filters
+from benchmarks.synthetic import make_raw_frame
+from benchmarks.common import summarize, time_calls, environment, write_results, filter_scenarios
+
+
+def run_suite(rows, repeat, seed=0):
+    '''
+    {'environment', 'rows', 'benchmarks': {name: summary}}
+    '''
+    results = {}
+    raw = make_raw_frame(rows, seed=seed)
+    converted, samples = time_calls(lambda: convert_data_types(raw.copy()), repeat)
+    results['convert_data_types'] = summarize(samples, rows)
+    df, samples = time_calls(lambda: add_fields(converted.copy()), repeat)
+    results['add_fields'] = summarize(samples, rows)
+    # at most a few runs, each one rewrites the table and rollup
+    _, samples = time_calls(lambda: create_db(df, override=True), min(repeat, 3))
+    results['create_db'] = summarize(samples, rows)
+    all_rows, samples = time_calls(get_all_data, repeat)
+    results['get_all_data'] = summarize(samples, rows)
+
+    scenarios = filter_scenarios(get_date_bounds(), get_distinct_values('Category'),
+                                 get_distinct_values('Product_Name'), get_distinct_values('Status'), seed)
+    for name, filters in scenarios.items():
+        filtered, samples = time_calls(filter_data, repeat, *filters)
+        results[f'filter_data.{name}'] = summarize(samples, len(filtered))
+        _, samples = time_calls(generate_kpis, repeat, filtered)
+        results[f'generate_kpis.{name}'] = summarize(samples, len(filtered))
+        _, samples = time_calls(generate_charts, repeat, filtered)
+        results[f'generate_charts.{name}'] = summarize(samples, len(filtered))
+
+    layout_rows = rename_for_layout(all_rows)
+    _, samples = time_calls(data_table_filters, repeat, layout_rows)
+    results['data_table_filters'] = summarize(samples, rows)
+    return {'environment': environment(), 'rows': rows, 'repeat': repeat, 'benchmarks': results}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--rows', type=int, default=10000)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='JSON file for the results')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if config.DB_PATH == os.path.join(config.root, 'data.db'):
+        raise SystemExit("Set GROCERY_DB_PATH to a scratch database, the suite rewrites the grocery table")
+    write_results(run_suite(args.rows, args.repeat, args.seed), args.output)
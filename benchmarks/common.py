@@ -0,0 +1,120 @@
+'''
+Shared helpers for the benchmark scripts: timing summaries, filter scenarios
+and machine-readable results.
+'''
+import json
+import os
+import platform
+import subprocess
+import time
+import numpy as np
+import pandas as pd
+
+
+def summarize(samples, rows=None):
+    '''
+    Latency summary in seconds for a list of samples, plus rows/s when rows is given
+    '''
+    values = np.asarray(samples, dtype='float64')
+    summary = {'n': len(values), 'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)),
+               'p95': float(np.percentile(values, 95)), 'min': float(values.min()), 'max': float(values.max())}
+    if rows is not None:
+        summary['rows'] = int(rows)
+        summary['rows_per_sec'] = rows / summary['p50'] if summary['p50'] else None
+    return summary
+
+
+def time_calls(fn, repeat, *args):
+    '''
+    Call fn(*args) repeat times, return (last result, seconds per call)
+    '''
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        samples.append(time.perf_counter() - start)
+    return result, samples
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    '''
+    Run metadata recorded next to the results so releases can be compared
+    '''
+    return {'revision': git_revision(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'pandas': pd.__version__, 'machine': platform.machine(),
+            'cpus': os.cpu_count()}
+
+
+def write_results(results, path=None):
+    '''
+    Print a one line summary per benchmark and write the full results as JSON to path
+    '''
+    for name, summary in results['benchmarks'].items():
+        line = f"{name:>32}: p50 {summary['p50'] * 1e3:9.2f} ms, p95 {summary['p95'] * 1e3:9.2f} ms"
+        if summary.get('rows_per_sec'):
+            line += f", {summary['rows_per_sec']:,.0f} rows/s"
+        if summary.get('requests_per_sec'):
+            line += f", {summary['requests_per_sec']:,.1f} req/s"
+        print(line)
+    if path:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {path}")
+
+
+def filter_scenarios(bounds, categories, products, statuses, seed=0):
+    '''
+    Named dashboard filter tuples (7 values, the update_dashboard argument order)
+    covering the common interactions
+    '''
+    rng = np.random.default_rng(seed)
+    rec_start, rec_end = [pd.Timestamp(d) for d in bounds['Date_Received']]
+    order_start, order_end = [pd.Timestamp(d) for d in bounds['Last_Order_Date']]
+    day = lambda ts: ts.strftime('%Y-%m-%d')
+    quarter = rec_start + (rec_end - rec_start) / 4
+    return {
+        'all': (day(rec_start), day(rec_end), day(order_start), day(order_end), None, None, None),
+        'received_quarter': (day(rec_start), day(quarter), day(order_start), day(order_end), None, None, None),
+        'two_categories': (day(rec_start), day(rec_end), day(order_start), day(order_end),
+                           list(rng.choice(categories, 2, replace=False)), None, None),
+        'products': (day(rec_start), day(rec_end), day(order_start), day(order_end), None,
+                     list(rng.choice(products, min(5, len(products)), replace=False)), None),
+        'active_status': (day(rec_start), day(rec_end), day(order_start), day(order_end), None, None,
+                          [s for s in statuses if s == 'Active'] or statuses[:1]),
+        'combined': (day(quarter), day(rec_end), day(order_start), day(order_end),
+                     list(rng.choice(categories, 3, replace=False)), None, statuses[:2]),
+    }
+
+
+def filter_session(bounds, categories, products, statuses, steps=8, seed=0):
+    '''
+    A plausible sequence of filter states from one user: narrowing dates a few
+    days at a time as if dragging, then picking categories, products and statuses
+    '''
+    rng = np.random.default_rng(seed)
+    rec_start, rec_end = [pd.Timestamp(d) for d in bounds['Date_Received']]
+    order_start, order_end = [pd.Timestamp(d) for d in bounds['Last_Order_Date']]
+    day = lambda ts: ts.strftime('%Y-%m-%d')
+    state = [day(rec_start), day(rec_end), day(order_start), day(order_end), None, None, None]
+    sequence = [tuple(state)]
+    for i in range(steps):
+        action = rng.integers(0, 4)
+        if action == 0:
+            state[1] = day(pd.Timestamp(state[1]) - pd.Timedelta(days=int(rng.integers(1, 15))))
+        elif action == 1:
+            state[4] = list(rng.choice(categories, int(rng.integers(1, 3)), replace=False))
+        elif action == 2:
+            state[5] = list(rng.choice(products, int(rng.integers(1, 4)), replace=False))
+        else:
+            state[6] = list(rng.choice(statuses, int(rng.integers(1, len(statuses) + 1)), replace=False))
+        sequence.append(tuple(state))
+    return sequence
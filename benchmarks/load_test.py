@@ -0,0 +1,150 @@
+'''
+Replay filter sessions against the dashboard callbacks through the Flask
+test client, from several simulated users at once, and report throughput
+and latency percentiles as JSON.
+
+Every filter change posts the update_dashboard and update_data_table
+callbacks the browser would send. Run from the repository root, against a
+loaded database (see benchmarks.synthetic):
+    GROCERY_DB_PATH=/tmp/bench.db python -m benchmarks.load_test -u 8 -s 20 --output load.json
+    GROCERY_CACHE_BACKEND=none GROCERY_DB_PATH=/tmp/bench.db python -m benchmarks.load_test
+
+With --burst each user posts all of its dashboard updates at once, as a
+drag across a date picker does, to measure coalescing and stale skipping
+(counted under "coalescing" in the results).
+'''
+import argparse
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.common import summarize, environment, write_results, filter_session
+
+filter_inputs = [('date-received', 'start_date'), ('date-received', 'end_date'),
+                 ('date-last-order', 'start_date'), ('date-last-order', 'end_date'),
+                 ('category-dropdown', 'value'), ('product-dropdown', 'value'), ('checklist-status', 'value'),
+                 ('warehouse-dropdown', 'value')]
+dashboard_outputs = [('total-sales', 'children'), ('total-inventory', 'children'), ('avg-turn', 'children'),
+                     ('sales-category', 'figure'), ('top-products', 'figure'), ('dashboard-digest', 'data')]
+table_outputs = [('data-table', 'data'), ('data-table', 'page_count'), ('data-table', 'page_current')]
+table_inputs = [('data-table', 'page_current', 0), ('data-table', 'page_size', 10),
+                ('data-table', 'sort_by', []), ('data-table', 'filter_query', '')]
+
+
+def dash_request(outputs, inputs, changed, state=()):
+    '''
+    Body of a /_dash-update-component request, inputs and state are (id, property, value)
+    '''
+    output = '..' + '...'.join(f'{i}.{p}' for i, p in outputs) + '..' if len(outputs) > 1 \
+        else f'{outputs[0][0]}.{outputs[0][1]}'
+    return {'output': output,
+            'outputs': [{'id': i, 'property': p} for i, p in outputs] if len(outputs) > 1
+            else {'id': outputs[0][0], 'property': outputs[0][1]},
+            'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+            'changedPropIds': changed, 'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state]}
+
+
+def filter_requests(filters, previous, version, digests=None, session=None):
+    '''
+    (name, body) for the callbacks fired by moving from the previous filters to filters,
+    digests is the dashboard-digest store the page holds and session its session-id store.
+    Filters left off the end, e.g. the warehouses, are unset
+    '''
+    filters = tuple(filters) + (None,) * (len(filter_inputs) - len(filters))
+    previous = previous and tuple(previous) + (None,) * (len(filter_inputs) - len(previous))
+    changed = [f'{i}.{p}' for (i, p), new, old in zip(filter_inputs, filters, previous or [None] * len(filter_inputs))
+               if previous is None or new != old]
+    inputs = [(i, p, v) for (i, p), v in zip(filter_inputs, filters)] + [('data-version', 'data', version)]
+    return [('update_dashboard', dash_request(dashboard_outputs, inputs, changed,
+                                              [('dashboard-digest', 'data', digests),
+                                               ('session-id', 'data', session)])),
+            ('update_data_table', dash_request(table_outputs, table_inputs + inputs, changed))]
+
+
+def run_session(server, sequence, version):
+    '''
+    Post one user's filter sequence, return [(callback, seconds, bytes, status)]
+    '''
+    client = server.test_client()
+    session = uuid.uuid4().hex
+    samples = []
+    previous = digests = None
+    for filters in sequence:
+        for name, body in filter_requests(filters, previous, version, digests, session):
+            start = time.perf_counter()
+            response = client.post('/_dash-update-component', json=body)
+            samples.append((name, time.perf_counter() - start, len(response.data), response.status_code))
+            if name == 'update_dashboard' and response.status_code == 200:
+                digests = response.get_json()['response'].get('dashboard-digest', {}).get('data', digests)
+        previous = filters
+    return samples
+
+
+def run_burst(server, sequence, version):
+    '''
+    Post one user's dashboard updates all at once from one page, return [(callback, seconds, bytes, status)]
+    '''
+    session = uuid.uuid4().hex
+    bodies = [filter_requests(filters, None, version, session=session)[0][1] for filters in sequence]
+
+    def post(body):
+        start = time.perf_counter()
+        response = server.test_client().post('/_dash-update-component', json=body)
+        return 'update_dashboard', time.perf_counter() - start, len(response.data), response.status_code
+
+    with ThreadPoolExecutor(len(bodies)) as pool:
+        futures = []
+        for body in bodies:
+            futures.append(pool.submit(post, body))
+            # requests leave the browser in order, a few milliseconds apart
+            time.sleep(0.002)
+        return [f.result() for f in futures]
+
+
+def run_load(server, sessions, users, steps, seed=0, burst=False):
+    '''
+    Run sessions user sessions over users threads, return the results dict
+    '''
+    from data.db import get_date_bounds, get_distinct_values, get_data_version
+    options = (get_date_bounds(), get_distinct_values('Category'), get_distinct_values('Product_Name'),
+               get_distinct_values('Status'))
+    sequences = [filter_session(*options, steps=steps, seed=seed + i) for i in range(sessions)]
+    version = get_data_version()
+    # the page load finishes Dash's callback setup before the users start
+    server.test_client().get('/')
+    start = time.perf_counter()
+    with ThreadPoolExecutor(users) as pool:
+        run = run_burst if burst else run_session
+        samples = [s for session in pool.map(lambda seq: run(server, seq, version), sequences)
+                   for s in session]
+    elapsed = time.perf_counter() - start
+    results = {}
+    for name in sorted({s[0] for s in samples}) + ['all']:
+        picked = [s for s in samples if name in ('all', s[0])]
+        summary = summarize([s[1] for s in picked])
+        summary['requests_per_sec'] = len(picked) / elapsed
+        summary['mean_bytes'] = sum(s[2] for s in picked) / len(picked)
+        summary['errors'] = sum(s[3] >= 400 for s in picked)
+        results[name] = summary
+    from data.cache import dashboard_flights, dashboard_requests
+    return {'environment': environment(), 'users': users, 'sessions': sessions, 'steps': steps, 'burst': burst,
+            'seconds': elapsed, 'coalescing': {**dashboard_flights.stats(), **dashboard_requests.stats()},
+            'benchmarks': results}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--users', type=int, default=4, help='concurrent simulated users')
+    parser.add_argument('-s', '--sessions', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=8, help='filter changes per session')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--burst', action='store_true', help="post each session's dashboard updates at once")
+    parser.add_argument('-o', '--output', help='JSON file for the results')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    from app import dash_app
+    from data.loader import data_ready
+    data_ready.wait()
+    write_results(run_load(dash_app.server, args.sessions, args.users, args.steps, args.seed, args.burst), args.output)
@@ -0,0 +1,107 @@
+'''
+Synthetic grocery inventory shaped like the raw Kaggle file, for benchmarks
+and load tests at sizes the real dataset doesn't reach.
+
+Run from the repository root:
+    python -m benchmarks.synthetic -n 1000000 --csv /tmp/grocery_1m.csv
+    GROCERY_DB_PATH=/tmp/bench.db python -m benchmarks.synthetic -n 10000000 --load
+'''
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+categories = ['Fruits & Vegetables', 'Dairy', 'Beverages', 'Bakery', 'Oils & Fats', 'Grains & Pulses', 'Seafood']
+statuses = ['Active', 'Discontinued', 'Backordered']
+
+
+def make_raw_frame(rows, seed=0, start=0, products=5000, suppliers=200, warehouses=50):
+    '''
+    Synthetic frame shaped like the raw Kaggle file, with formatted prices and percentages.
+    Product_IDs run from start so chunks can be generated independently
+    '''
+    rng = np.random.default_rng(seed)
+    category_values = np.array(categories)
+    status_values = np.array(statuses)
+    supplier_values = np.array([f'Supplier {i}' for i in range(suppliers)])
+    base = np.datetime64('2024-01-01')
+
+    def dates(low, high):
+        days = base + rng.integers(low, high, rows).astype('timedelta64[D]')
+        return pd.Series(days).dt.strftime('%m/%d/%Y').str.lstrip('0').str.replace('/0', '/', regex=False)
+
+    prices = rng.integers(50, 500000, rows) / 100
+    return pd.DataFrame({
+        'Product_Name': np.char.add('Product ', rng.integers(0, products, rows).astype(str)),
+        'Catagory': category_values[rng.integers(0, len(category_values), rows)],
+        'Supplier_Name': supplier_values[rng.integers(0, len(supplier_values), rows)],
+        'Warehouse_Location': np.char.add('Warehouse ', rng.integers(0, warehouses, rows).astype(str)),
+        'Status': status_values[rng.integers(0, len(status_values), rows)],
+        'Product_ID': np.arange(start, start + rows).astype(str),
+        'Supplier_ID': rng.integers(0, suppliers, rows).astype(str),
+        'Date_Received': dates(0, 365),
+        'Last_Order_Date': dates(0, 420),
+        'Expiration_Date': dates(0, 600),
+        'Stock_Quantity': rng.integers(0, 100, rows),
+        'Reorder_Level': rng.integers(0, 100, rows),
+        'Reorder_Quantity': rng.integers(0, 100, rows),
+        'Unit_Price': ['${:,.2f}'.format(p) for p in prices],
+        'Sales_Volume': rng.integers(0, 100, rows),
+        'Inventory_Turnover_Rate': rng.integers(0, 100, rows),
+        'percentage': [f'{p:.2f}%' for p in rng.integers(0, 500, rows) / 100],
+    })
+
+
+def iter_raw_chunks(rows, chunksize=500000, seed=0, **kwargs):
+    '''
+    Yield raw frames totalling rows, each at most chunksize rows
+    '''
+    for i, start in enumerate(range(0, rows, chunksize)):
+        yield make_raw_frame(min(chunksize, rows - start), seed=seed + i, start=start, **kwargs)
+
+
+def make_grocery_frame(rows, seed=0, **kwargs):
+    '''
+    Synthetic rows after the ingest transform, with the grocery table's column names
+    '''
+    from data.stream import prepare_chunk
+    return prepare_chunk(make_raw_frame(rows, seed=seed, **kwargs))
+
+
+def write_raw_csv(path, rows, chunksize=500000, seed=0, **kwargs):
+    '''
+    Write a raw CSV of rows synthetic products without holding them all in memory
+    '''
+    for i, chunk in enumerate(iter_raw_chunks(rows, chunksize, seed, **kwargs)):
+        chunk.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    return path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--rows', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--csv', help='raw CSV to write, a temporary file when only loading')
+    parser.add_argument('--load', action='store_true',
+                        help='stream the rows into the grocery table of GROCERY_DB_PATH')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    path = args.csv or os.path.join(tempfile.gettempdir(), f'grocery_synthetic_{args.rows}.csv')
+    start = time.perf_counter()
+    write_raw_csv(path, args.rows, seed=args.seed, products=args.products)
+    print(f"Wrote {args.rows:,} rows to {path} in {time.perf_counter() - start:.1f}s")
+    if args.load:
+        from data import config
+        from data.stream import stream_ingest
+        if config.DB_PATH == os.path.join(config.root, 'data.db'):
+            raise SystemExit("Set GROCERY_DB_PATH to a scratch database before loading synthetic rows")
+        stats = stream_ingest(path)
+        print(f"Loaded into {config.DB_PATH}: {stats['rows']:,} rows, {stats['rows_per_sec']:,.0f} rows/s")
+        if not args.csv:
+            os.remove(path)
@@ -0,0 +1,165 @@
+import threading
+import numpy as np
+import pandas as pd
+from . import config
+from .db import get_data_version, dashboard_columns
+from .shared import shared_dataset, read_shared_source
+
+# In-memory filter engine: packed bitmaps for low cardinality columns, sorted row ids
+# (posting lists) per product and sorted date indexes, built once per data generation
+
+bitmap_columns = ['Category', 'Status']
+posting_columns = ['Product_Name']
+date_columns = ['Date_Received', 'Last_Order_Date']
+# Below this fraction of the rows, candidates from posting lists are checked row by row
+candidate_fraction = 1 / 64
+
+
+def pack(mask):
+    return np.packbits(mask)
+
+
+def pack_ids(ids, n):
+    '''
+    Packed bitmap with the bits of row ids set
+    '''
+    mask = np.zeros(n, dtype=bool)
+    mask[ids] = True
+    return np.packbits(mask)
+
+
+class FilterIndex:
+    '''
+    Indexes over one frame of dashboard rows, answers the dashboard filters
+    with bitmap intersections and binary searches
+    '''
+
+    def __init__(self, df):
+        self.df = df
+        self.n = len(df)
+        self.base = pack(df['Category'].notna().to_numpy())
+        self.codes = {}
+        self.lookup = {}
+        self.bitmaps = {}
+        self.postings = {}
+        for c in bitmap_columns + posting_columns:
+            values = pd.Categorical(df[c])
+            codes = values.codes
+            self.codes[c] = codes
+            self.lookup[c] = {v: i for i, v in enumerate(values.categories)}
+            if c in bitmap_columns:
+                self.bitmaps[c] = [pack(codes == i) for i in range(len(values.categories))]
+            else:
+                order = np.argsort(codes, kind='stable').astype('int32')
+                bounds = np.concatenate([[0], np.cumsum(np.bincount(codes[codes >= 0],
+                                                                    minlength=len(values.categories)))])
+                # rows with a missing value sort first, skip past them
+                order = order[np.count_nonzero(codes < 0):]
+                self.postings[c] = [order[bounds[i]:bounds[i + 1]] for i in range(len(values.categories))]
+        self.dates = {}
+        for c in date_columns:
+            values = df[c].to_numpy(dtype='datetime64[ns]')
+            present = np.flatnonzero(~np.isnat(values)).astype('int32')
+            order = present[np.argsort(values[present], kind='stable')]
+            self.dates[c] = (values, values[order], order)
+
+    def date_ids(self, column, start, end):
+        '''
+        Row ids with start <= column <= end, by binary search over the sorted dates
+        '''
+        _, ordered, order = self.dates[column]
+        low = np.searchsorted(ordered, np.datetime64(pd.Timestamp(start), 'ns'), 'left') if start else 0
+        high = np.searchsorted(ordered, np.datetime64(pd.Timestamp(end), 'ns'), 'right')
+        return order[low:high]
+
+    def value_bitmap(self, column, values):
+        codes = [self.lookup[column][v] for v in values if v in self.lookup[column]]
+        if not codes:
+            return np.zeros_like(self.base)
+        return np.bitwise_or.reduce([self.bitmaps[column][i] for i in codes])
+
+    def value_ids(self, column, values):
+        lists = [self.postings[column][self.lookup[column][v]] for v in values if v in self.lookup[column]]
+        return np.sort(np.concatenate(lists)) if lists else np.empty(0, dtype='int32')
+
+    def check_ids(self, ids, date_filters, value_filters):
+        '''
+        Keep the candidate rows that pass every filter, looked up row by row
+        '''
+        keep = self.codes['Category'][ids] >= 0
+        for column, start, end in date_filters:
+            values = self.dates[column][0][ids]
+            keep &= values <= np.datetime64(pd.Timestamp(end), 'ns')
+            if start:
+                keep &= values >= np.datetime64(pd.Timestamp(start), 'ns')
+        for column, values in value_filters:
+            codes = [self.lookup[column][v] for v in values if v in self.lookup[column]]
+            keep &= np.isin(self.codes[column][ids], codes)
+        return ids[keep]
+
+    def row_ids(self, rec_start_date=None, rec_end_date=None, order_start_date=None, order_end_date=None,
+                categories=None, products=None, statuses=None):
+        '''
+        Sorted ids of the rows db.query_filtered would return, an empty array when nothing matches
+        '''
+        date_filters = [(c, start, end) for c, start, end in [('Date_Received', rec_start_date, rec_end_date),
+                                                               ('Last_Order_Date', order_start_date, order_end_date)]
+                        if end]
+        value_filters = [(c, v) for c, v in [('Category', categories), ('Status', statuses)] if v]
+        if products:
+            candidates = self.value_ids('Product_Name', products)
+            if len(candidates) <= self.n * candidate_fraction:
+                return self.check_ids(candidates, date_filters, value_filters)
+            mask = self.base & pack_ids(candidates, self.n)
+        else:
+            mask = self.base.copy()
+        for column, values in value_filters:
+            mask &= self.value_bitmap(column, values)
+        for column, start, end in date_filters:
+            mask &= pack_ids(self.date_ids(column, start, end), self.n)
+        return np.flatnonzero(np.unpackbits(mask, count=self.n))
+
+    def query(self, *filters, columns=None):
+        '''
+        Materialize only the surviving rows
+        '''
+        return self.df[columns or dashboard_columns].take(self.row_ids(*filters))
+
+
+class FilterEngine:
+    '''
+    FilterIndex for the current data generation, rebuilt when the data changes
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.key = None
+        self.index = None
+
+    def current_key(self):
+        # the shared generation until it catches up with a write, see shared.schedule_publish
+        if config.SHARED_DATASET and shared_dataset.current_frame() is not None:
+            return ('shared', shared_dataset.generation)
+        return ('db', get_data_version())
+
+    def source(self):
+        if config.SHARED_DATASET:
+            df = shared_dataset.current_frame()
+            if df is not None:
+                return df
+        return read_shared_source()
+
+    def get_index(self):
+        key = self.current_key()
+        if key != self.key:
+            with self.lock:
+                if key != self.key:
+                    self.index = FilterIndex(self.source())
+                    self.key = key
+        return self.index
+
+    def query(self, *filters, columns=None):
+        return self.get_index().query(*filters, columns=columns)
+
+
+filter_engine = FilterEngine()
@@ -0,0 +1,346 @@
+from collections import OrderedDict
+import pickle
+import sqlite3
+import threading
+import time
+import pandas as pd
+from . import config
+from .db import add_change_listener, get_data_version
+from .metrics import registry
+
+# Memoization of dashboard results keyed by normalized filter state
+
+
+def normalize_date(value):
+    '''
+    Canonical string for a date picker value, None when unset
+    '''
+    if not value:
+        return None
+    return pd.Timestamp(value).isoformat()
+
+
+def normalize_selection(values):
+    '''
+    Sorted tuple for a multi-select value, None when nothing is selected
+    '''
+    if not values:
+        return None
+    if isinstance(values, str):
+        values = [values]
+    return tuple(sorted(set(values)))
+
+
+def normalize_filters(rec_start_date, rec_end_date, order_start_date, order_end_date,
+                      selected_categories, selected_products, checklist_status, selected_warehouses=None):
+    '''
+    Hashable cache key for the dashboard filters
+    '''
+    return (normalize_date(rec_start_date), normalize_date(rec_end_date),
+            normalize_date(order_start_date), normalize_date(order_end_date),
+            normalize_selection(selected_categories), normalize_selection(selected_products),
+            normalize_selection(checklist_status), normalize_selection(selected_warehouses))
+
+
+class MemoryBackend:
+    '''
+    In-process LRU bounded by entry count and TTL
+    '''
+
+    def __init__(self, max_entries=config.CACHE_MAX_ENTRIES, ttl=config.CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            created, value = entry
+            if time.monotonic() - created > self.ttl:
+                del self.entries[key]
+                self.evictions += 1
+                return False, None
+            self.entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SqliteBackend:
+    '''
+    LRU stored in a SQLite file so several waitress processes share results
+    '''
+
+    def __init__(self, path=config.CACHE_PATH, max_entries=config.CACHE_MAX_ENTRIES, ttl=config.CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.local = threading.local()
+        self.evictions = 0
+        with self.connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, '
+                         'created REAL, accessed REAL)')
+
+    def connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self.connect()
+        row = conn.execute('SELECT value, created FROM cache WHERE key = ?', (repr(key),)).fetchone()
+        if row is None:
+            return False, None
+        if time.time() - row[1] > self.ttl:
+            with conn:
+                conn.execute('DELETE FROM cache WHERE key = ?', (repr(key),))
+            self.evictions += 1
+            return False, None
+        with conn:
+            conn.execute('UPDATE cache SET accessed = ? WHERE key = ?', (time.time(), repr(key)))
+        return True, pickle.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                         (repr(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now, now))
+            expired = conn.execute('DELETE FROM cache WHERE created < ?', (now - self.ttl,)).rowcount
+            excess = conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed DESC '
+                                  'LIMIT -1 OFFSET ?)', (self.max_entries,)).rowcount
+        self.evictions += expired + excess
+
+    def clear(self):
+        conn = self.connect()
+        with conn:
+            conn.execute('DELETE FROM cache')
+
+    def __len__(self):
+        return self.connect().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+class Flight:
+    '''
+    One running computation and the callers waiting on it
+    '''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    '''
+    Run one compute per key at a time, callers asking for a key that is already being
+    computed wait for that result instead of starting their own
+    '''
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, compute, *args):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = compute(*args)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def stats(self):
+        return {'leaders': self.leaders, 'followers': self.followers, 'running': len(self.flights)}
+
+
+class LatestRequests:
+    '''
+    Number of the newest request per session, so a request can tell that a later one
+    from the same page superseded it. Sessions are kept in LRU order up to max_sessions
+    '''
+
+    def __init__(self, max_sessions=4096):
+        self.max_sessions = max_sessions
+        self.latest = OrderedDict()
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.skipped = 0
+
+    def begin(self, session):
+        '''
+        Ticket of a new request from session, None when the session is unknown
+        '''
+        if session is None:
+            return None
+        with self.lock:
+            self.counter += 1
+            self.latest[session] = self.counter
+            self.latest.move_to_end(session)
+            while len(self.latest) > self.max_sessions:
+                self.latest.popitem(last=False)
+            return self.counter
+
+    def superseded(self, session, ticket):
+        '''
+        True, and counted as skipped, once a newer request from session has begun
+        '''
+        if ticket is None:
+            return False
+        with self.lock:
+            stale = self.latest.get(session, ticket) != ticket
+            self.skipped += stale
+            return stale
+
+    def stats(self):
+        return {'sessions': len(self.latest), 'skipped': self.skipped}
+
+
+class ResultCache:
+    '''
+    Memoize compute(*args) by key and the current data version, concurrent misses
+    of one key share a single computation
+    '''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.flights = SingleFlight()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, found):
+        with self.lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def lookup(self, key):
+        '''
+        (found, value) of key for the current data version, only hits are counted
+        '''
+        found, value = self.backend.get((get_data_version(), key))
+        if found:
+            self.count(found)
+        return found, value
+
+    def get_or_compute(self, key, compute, *args):
+        found, value = self.lookup(key)
+        if found:
+            return value
+        return self.compute(key, compute, *args)
+
+    def compute(self, key, compute, *args):
+        '''
+        compute(*args) for key once lookup(key) has missed, shared with any identical computation running
+        '''
+        key = (get_data_version(), key)
+        return self.flights.do(key, self.compute_missing, key, compute, *args)
+
+    def compute_missing(self, key, compute, *args):
+        # a flight for key may have finished between the caller's lookup and this one starting
+        found, value = self.backend.get(key)
+        self.count(found)
+        if found:
+            return value
+        value = compute(*args)
+        self.backend.set(key, value)
+        return value
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        return {'hits': hits, 'misses': misses, 'evictions': self.backend.evictions,
+                'entries': len(self.backend), 'coalesced': self.flights.followers}
+
+
+def create_cache(backend=config.CACHE_BACKEND):
+    '''
+    ResultCache for the configured backend, None when caching is off
+    '''
+    if backend == 'none':
+        return None
+    if backend == 'sqlite':
+        return ResultCache(SqliteBackend())
+    return ResultCache(MemoryBackend())
+
+
+dashboard_cache = create_cache()
+# identical dashboard computations in flight at once run once, with or without the cache
+dashboard_flights = dashboard_cache.flights if dashboard_cache is not None else SingleFlight()
+dashboard_requests = LatestRequests()
+registry.add_stats('cache.dashboard', dashboard_cache.stats if dashboard_cache is not None else dashboard_flights.stats)
+registry.add_stats('cache.dashboard_requests', dashboard_requests.stats)
+
+
+def cached_result(key):
+    '''
+    (found, value) of the dashboard filters key in the cache, never found when caching is off
+    '''
+    if dashboard_cache is not None:
+        return dashboard_cache.lookup(key)
+    return False, None
+
+
+def compute_coalesced(key, compute, *args):
+    '''
+    compute(*args) for the dashboard filters key once cached_result(key) has missed, cached
+    when enabled and shared with any identical computation already running
+    '''
+    if dashboard_cache is not None:
+        return dashboard_cache.compute(key, compute, *args)
+    return dashboard_flights.do((get_data_version(), key), compute, *args)
+
+
+def invalidate_dashboard_cache(table, df, mode, previous=None):
+    '''
+    Drop cached results once the data changes
+    '''
+    if dashboard_cache is not None:
+        dashboard_cache.clear()
+
+
+add_change_listener(invalidate_dashboard_cache)
@@ -0,0 +1,120 @@
+import os
+
+# Runtime settings, overridable through environment variables
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def env_bool(name, default=False):
+    '''
+    Read a boolean flag from the environment
+    '''
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_int(name, default):
+    '''
+    Read an integer from the environment
+    '''
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+# Database
+DB_PATH = os.path.abspath(os.environ.get('GROCERY_DB_PATH', os.path.join(root, 'data.db')))
+DB_ECHO = env_bool('GROCERY_DB_ECHO')
+DB_POOL_SIZE = env_int('GROCERY_DB_POOL_SIZE', 8)
+DB_MAX_OVERFLOW = env_int('GROCERY_DB_MAX_OVERFLOW', 8)
+DB_POOL_TIMEOUT = env_int('GROCERY_DB_POOL_TIMEOUT', 30)
+
+# SQLite pragmas applied to every new connection
+SQLITE_JOURNAL_MODE = os.environ.get('GROCERY_SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('GROCERY_SQLITE_SYNCHRONOUS', 'NORMAL')
+# Negative values are KiB, positive values are pages
+SQLITE_CACHE_SIZE = env_int('GROCERY_SQLITE_CACHE_SIZE', -64000)
+SQLITE_MMAP_SIZE = env_int('GROCERY_SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+
+# Split the grocery table into this many SQLite files next to the database, rows routed by a hash
+# of Warehouse_Location, so loads of different warehouses take different file locks and dashboard
+# aggregates fan out across them. 0 keeps one table; at most 10, SQLite's limit on attached files
+SHARDS = env_int('GROCERY_SHARDS', 0)
+SHARD_DIR = os.path.abspath(os.environ.get('GROCERY_SHARD_DIR', os.path.splitext(DB_PATH)[0] + '_shards'))
+# Threads running the per-shard queries and writes, 0 for one per shard
+SHARD_WORKERS = env_int('GROCERY_SHARD_WORKERS', 0)
+
+# Layout of a newly written grocery table: 'wide' (labels and dates as text on every row) or
+# 'normalized' (dimension tables, integer keys and epoch days behind a decoding view)
+STORAGE = os.environ.get('GROCERY_STORAGE', 'wide')
+
+# Dashboard result cache: 'memory' (per process), 'sqlite' (shared) or 'none'
+CACHE_BACKEND = os.environ.get('GROCERY_CACHE_BACKEND', 'memory')
+CACHE_MAX_ENTRIES = env_int('GROCERY_CACHE_MAX_ENTRIES', 256)
+CACHE_TTL = env_int('GROCERY_CACHE_TTL', 600)
+CACHE_PATH = os.path.abspath(os.environ.get('GROCERY_CACHE_PATH', os.path.join(root, 'cache.db')))
+
+# Milliseconds a dashboard update that isn't cached waits for a newer one from the same page
+# before running its queries, superseded updates are skipped, 0 computes straight away
+DASHBOARD_DEBOUNCE_MS = env_int('GROCERY_DASHBOARD_DEBOUNCE_MS', 50)
+# Send category, product and warehouse selections only once their dropdown menu closes,
+# on Dash versions whose Dropdown supports it
+FILTER_DEBOUNCE = env_bool('GROCERY_FILTER_DEBOUNCE')
+
+# Optional JSON file the startup timing report is written to
+STARTUP_REPORT_PATH = os.environ.get('GROCERY_STARTUP_REPORT')
+
+# Rows per chunk for streaming ingest
+INGEST_CHUNK_ROWS = env_int('GROCERY_INGEST_CHUNK_ROWS', 50000)
+# Processes parsing input files in ingest.py, 0 for one per core
+INGEST_WORKERS = env_int('GROCERY_INGEST_WORKERS', 0)
+# Let the dashboard download and load the dataset itself when the table is missing,
+# turn off when ingest.py feeds the database
+WEB_INGEST = env_bool('GROCERY_WEB_INGEST', True)
+
+# Rows fetched from the cursor per export batch
+EXPORT_BATCH_ROWS = env_int('GROCERY_EXPORT_BATCH_ROWS', 5000)
+
+# Arrow IPC snapshot of the grocery table for fast warm starts
+SNAPSHOT_ENABLED = env_bool('GROCERY_SNAPSHOT_ENABLED', True)
+SNAPSHOT_PATH = os.path.abspath(os.environ.get('GROCERY_SNAPSHOT_PATH', os.path.join(root, 'data.arrow')))
+# Hash the whole snapshot on load instead of trusting its recorded size and mtime
+SNAPSHOT_VERIFY_CHECKSUM = env_bool('GROCERY_SNAPSHOT_VERIFY_CHECKSUM')
+# Seconds after a write before the snapshot is rewritten in the background, batching the writes
+# in between. 0 leaves a stale snapshot to be rewritten by the next full read
+SNAPSHOT_DELAY = env_int('GROCERY_SNAPSHOT_DELAY', 5)
+
+# Publish the dashboard columns as a memory-mapped Arrow file every worker process attaches to read-only
+SHARED_DATASET = env_bool('GROCERY_SHARED_DATASET')
+SHARED_DIR = os.path.abspath(os.environ.get('GROCERY_SHARED_DIR', os.path.join(root, 'shared')))
+# Generation files kept on disk, older ones are deleted after each publish
+SHARED_KEEP_GENERATIONS = env_int('GROCERY_SHARED_KEEP_GENERATIONS', 2)
+# Seconds after a write before the writing process publishes a new generation in the background,
+# batching the writes in between. Readers query the table until it lands
+SHARED_DELAY = env_int('GROCERY_SHARED_DELAY', 5)
+
+# Seconds between background checks for new data and the daily flag recompute, 0 disables them
+REFRESH_INTERVAL = env_int('GROCERY_REFRESH_INTERVAL', 30)
+
+# Callback, request and SQL timing histograms served on /metrics
+METRICS_ENABLED = env_bool('GROCERY_METRICS_ENABLED', True)
+# Also serialize each callback output to record its size on 1 in this many calls, 0 records only
+# the size and encoding time of the whole response Dash sends
+METRICS_PAYLOAD_SAMPLE = env_int('GROCERY_METRICS_PAYLOAD_SAMPLE', 0)
+# Profile callbacks and keep the profile of any slower than this many milliseconds, 0 disables
+PROFILE_SLOW_MS = env_int('GROCERY_PROFILE_SLOW_MS', 0)
+# 'cprofile' (.prof files) or 'pyinstrument' (.html, needs pyinstrument installed)
+PROFILER = os.environ.get('GROCERY_PROFILER', 'cprofile')
+PROFILE_DIR = os.path.abspath(os.environ.get('GROCERY_PROFILE_DIR', os.path.join(root, 'profiles')))
+
+# Dashboard filtering: 'sql' (indexed queries, or the shared dataset when enabled) or 'bitmap' (in-memory indexes)
+FILTER_ENGINE = os.environ.get('GROCERY_FILTER_ENGINE', 'sql')
+
+# Append-only daily history of changed rows behind the inventory trend chart
+HISTORY_ENABLED = env_bool('GROCERY_HISTORY_ENABLED', True)
+# Days of history the trend chart shows
+HISTORY_TREND_DAYS = env_int('GROCERY_HISTORY_TREND_DAYS', 365)
+
+# Bars in the Top Products chart, answered from per-category rankings when the filters allow
+TOP_PRODUCTS = env_int('GROCERY_TOP_PRODUCTS', 10)
@@ -2,11 +2,15 @@ import pandas as pd
 import kagglehub as kh
 import os
 import glob
-import re
+import numpy as np
 from datetime import datetime
 
 dataset_path = "willianoliveiragibin/grocery-inventory"
 proj = 'grocery'
+# Raw dataset dates look like 8/16/2024
+date_format = '%m/%d/%Y'
+int_cols = ['Stock_Quantity', 'Reorder_Level', 'Reorder_Quantity', 'Sales_Volume', 'Inventory_Turnover_Rate']
+category_cols = ['Category', 'Status', 'Supplier_Name']
 
 def download_dataset(dataset_path,path=''):
     '''
@@ -28,7 +32,52 @@ def read_dataset(path):
         return pd.read_excel(path)
     elif ext == '.json':
         return pd.read_json(path)
+    elif ext in ('.jsonl', '.ndjson'):
+        return pd.read_json(path, lines=True)
     return pd.DataFrame
+def iter_excel(path, chunksize):
+    '''
+    Yield DataFrames of chunksize rows from the first sheet of an xlsx file,
+    reading rows with openpyxl's streaming read-only mode
+    '''
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunksize:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        wb.close()
+
+def iter_dataset(path, chunksize=50000):
+    '''
+    Yield DataFrames of at most chunksize rows from path.
+    CSV, XLSX and JSON lines (.jsonl/.ndjson) are streamed, a plain JSON
+    array has to be parsed whole and is then sliced.
+    '''
+    _,ext = os.path.splitext(path)
+    if ext == '.csv':
+        yield from pd.read_csv(path, chunksize=chunksize)
+    elif ext == '.xlsx':
+        yield from iter_excel(path, chunksize)
+    elif ext in ('.jsonl', '.ndjson'):
+        yield from pd.read_json(path, lines=True, chunksize=chunksize)
+    elif ext == '.json':
+        df = pd.read_json(path)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize].copy()
+    else:
+        raise ValueError(f"Unsupported dataset type: {path}")
+
 def get_dataset():
     '''
     Get dataset : dataset_path
@@ -43,25 +92,58 @@ def dataset_to_frame(path):
     '''
     return read_dataset(path)
 
+def parse_dates(values, date_format=date_format):
+    '''
+    Parse a date column with the dataset's known format, inferring it if the format doesn't match
+    '''
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    try:
+        return pd.to_datetime(values, format=date_format)
+    except (ValueError, TypeError):
+        return pd.to_datetime(values)
+
+def parse_number(values, strip, scale=1):
+    '''
+    Vectorized float parsing of formatted strings such as "$1,024.50" or "12.5%"
+    '''
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype('float64')
+    parsed = pd.to_numeric(values.astype(str).str.replace(strip, '', regex=True), errors='coerce')
+    return parsed / scale if scale != 1 else parsed
+
 def convert_data_types(df):
     '''
     Make sure data types are correct
     '''
     df = df.rename(columns={'Catagory':'Category'})
     date_cols = [c for c in df.columns if 'date' in c.lower()]
-    # df[date_cols] = pd.to_datetime(df[date_cols])
     for c in date_cols:
-        df[c] = pd.to_datetime(df[c])
-    df['Unit_Price'] = [float(re.sub(r'[\$,]', '',v)) for v in df['Unit_Price'].values]
-    df['percentage'] = [float(re.sub(r'[\%,]', '',v)) / 100 for v in df['percentage'].values]
+        df[c] = parse_dates(df[c])
+    df['Unit_Price'] = parse_number(df['Unit_Price'], r'[\$,]')
+    df['percentage'] = parse_number(df['percentage'], r'[\%,]', 100)
+    for c in int_cols:
+        if c in df.columns:
+            df[c] = df[c].astype('int32' if df[c].notna().all() else 'Int32')
+    for c in category_cols:
+        if c in df.columns:
+            df[c] = df[c].astype('category')
     return df
 def add_fields(df):
-    df['Revenue'] = (df['Sales_Volume'] * df['Unit_Price']).round(2)
-    df['Inventory Value'] = df['Unit_Price'] * df['Stock_Quantity']
-    df['Discontinued'] = df['Status'] == 'Discontinued'
-    df['Low Stock'] = df['Stock_Quantity'] < df['Reorder_Level']
-    df['Expired'] = df['Expiration_Date'] <= datetime.today()
-    df['Restock'] = ((df['Low Stock'] == True) | (df['Expired'] == True)) & (df['Status'] == 'Active')
+    '''
+    Derived revenue, value and restock flags, computed from the underlying arrays in one pass
+    '''
+    price = df['Unit_Price'].to_numpy(dtype='float64', na_value=np.nan)
+    stock = df['Stock_Quantity'].to_numpy(dtype='float64', na_value=np.nan)
+    active = (df['Status'] == 'Active').to_numpy()
+    low_stock = stock < df['Reorder_Level'].to_numpy(dtype='float64', na_value=np.nan)
+    expired = (df['Expiration_Date'] <= datetime.today()).to_numpy()
+    df['Revenue'] = np.round(df['Sales_Volume'].to_numpy(dtype='float64', na_value=np.nan) * price, 2)
+    df['Inventory Value'] = price * stock
+    df['Discontinued'] = (df['Status'] == 'Discontinued').to_numpy()
+    df['Low Stock'] = low_stock
+    df['Expired'] = expired
+    df['Restock'] = (low_stock | expired) & active
     return df
 def load_df():
     '''
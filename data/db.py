@@ -1,53 +1,314 @@
-from sqlalchemy import create_engine, Table, MetaData, Column, Integer, String,Float, DateTime, text,Boolean
+from sqlalchemy import create_engine, event, bindparam, Table, MetaData, Column, Integer, String,Float, DateTime, text,Boolean
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+from contextlib import contextmanager
 import pandas as pd
 import os
+import threading
+from . import config
+from .metrics import instrument_engine, statement_name, timed
 from .data import load_df
 
 # Initialize SQLAlchemy engine
 
 table = 'grocery'
+# Columns the dashboard callbacks read from filtered queries
+dashboard_columns = ['Product_Name', 'Category', 'Revenue', 'Inventory_Value', 'Inventory_Turnover_Rate']
+measure_columns = ['Revenue', 'Inventory_Value', 'Inventory_Turnover_Rate']
+# Columns of the Needs Replenishment table and the column filters it accepts
+restock_columns = ['Product_Name', 'Category', 'Product_ID', 'Supplier_Name', 'Supplier_ID',
+                   'Stock_Quantity', 'Reorder_Level', 'Reorder_Quantity', 'Revenue']
+table_filter_operators = ['=', '!=', '<', '<=', '>', '>=', 'contains', 'scontains', 'datestartswith']
+index_columns = ['Date_Received', 'Last_Order_Date', 'Category', 'Status', 'Product_Name', 'Warehouse_Location']
+db_datetime_format = '%Y-%m-%d %H:%M:%S.%f'
+meta_table = f'{table}_meta'
+key_column = 'Product_ID'
+_engine = None
+_engine_lock = threading.Lock()
+# engine this thread works on instead of the main database, see using_engine
+_local = threading.local()
+# Callables run after a table is written, see add_change_listener
+change_listeners = []
+# Callables run once the data version has been bumped, see add_version_listener
+version_listeners = []
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    '''
+    Apply configured pragmas to a new SQLite connection
+    '''
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}')
+    cursor.execute(f'PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA cache_size={int(config.SQLITE_CACHE_SIZE)}')
+    cursor.execute(f'PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}')
+    cursor.close()
+
+def create_db_engine(path=None, echo=None, pool_size=None, max_overflow=None):
+    '''
+    Create a pooled sqlalchemy engine for the SQLite file at path
+    '''
+    path = path or config.DB_PATH
+    engine = create_engine(f'sqlite:///{path}',
+                           echo=config.DB_ECHO if echo is None else echo,
+                           poolclass=QueuePool,
+                           pool_size=config.DB_POOL_SIZE if pool_size is None else pool_size,
+                           max_overflow=config.DB_MAX_OVERFLOW if max_overflow is None else max_overflow,
+                           pool_timeout=config.DB_POOL_TIMEOUT,
+                           # shards are attached through read-only file: URIs
+                           connect_args={'check_same_thread': False, 'uri': config.SHARDS > 0})
+    event.listen(engine, 'connect', set_sqlite_pragmas)
+    if config.METRICS_ENABLED:
+        instrument_engine(engine)
+    return engine
 
 def get_engine():
     '''
-    Get sqlalchemy engine
+    Get the process-wide sqlalchemy engine, or the one this thread is using_engine
+    '''
+    global _engine
+    engine = getattr(_local, 'engine', None)
+    if engine is not None:
+        return engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_db_engine()
+                if config.SHARDS > 0:
+                    from .shards import attach_shards
+                    attach_shards(engine)
+                _engine = engine
+    return _engine
+
+@contextmanager
+def using_engine(engine):
+    '''
+    Run the functions of this module against engine on this thread, e.g. a shard's
+    '''
+    previous = getattr(_local, 'engine', None)
+    _local.engine = engine
+    try:
+        yield engine
+    finally:
+        _local.engine = previous
+
+def is_sharded(name):
+    '''
+    name is the grocery table split across shard files and this thread isn't working on one of them
+    '''
+    return config.SHARDS > 0 and name == table and getattr(_local, 'engine', None) is None
+
+def dispose_engine():
+    '''
+    Close pooled connections and drop the shared engine, e.g. after a fork
+    '''
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = None
+    if config.SHARDS > 0:
+        from .shards import dispose_shard_engines
+        dispose_shard_engines()
+
+def add_change_listener(listener):
+    '''
+    Register listener(table, df, mode, previous) to run after table is written.
+    mode is 'create', 'append', 'replace' or 'upsert', df holds the written rows
+    and previous the rows they overwrote (upserts only).
+    '''
+    if listener not in change_listeners:
+        change_listeners.append(listener)
+    return listener
+
+def notify_change(table, df=None, mode='replace', previous=None):
+    '''
+    Run change listeners for table, then bump the data version
+    '''
+    for listener in list(change_listeners):
+        listener(table, df, mode, previous)
+    version = bump_data_version()
+    for listener in list(version_listeners):
+        listener(table, version)
+
+def add_version_listener(listener):
+    '''
+    Register listener(table, version) to run after a write has bumped the data version
+    '''
+    if listener not in version_listeners:
+        version_listeners.append(listener)
+    return listener
+
+def bump_data_version():
+    '''
+    Increment the stored data version shared by every process using the db, returns the new version
+    '''
+    with get_engine().begin() as conn:
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{meta_table}" (key TEXT PRIMARY KEY, value INTEGER)'))
+        conn.execute(text(f'''INSERT INTO "{meta_table}" (key, value) VALUES ('data_version', 1)
+                              ON CONFLICT(key) DO UPDATE SET value = value + 1'''))
+        return conn.execute(text(f"SELECT value FROM \"{meta_table}\" WHERE key = 'data_version'")).scalar()
+
+def get_data_version():
+    '''
+    Current data version, 0 before the first tracked write
     '''
-    return create_engine('sqlite:///data.db', echo=True)
+    with get_engine().connect() as conn:
+        try:
+            row = conn.execute(text(f"SELECT value FROM \"{meta_table}\" WHERE key = 'data_version'")).fetchone()
+        except OperationalError:
+            return 0
+    return row[0] if row else 0
 
 def db_exists():
-    return os.path.exists('data.db')
+    return os.path.exists(config.DB_PATH)
 
 
 
+def sql_type(dtype):
+    '''
+    SQLAlchemy column type for a pandas dtype, categoricals and strings map to String
+    '''
+    if pd.api.types.is_bool_dtype(dtype):
+        return Boolean
+    if pd.api.types.is_integer_dtype(dtype):
+        return Integer
+    if pd.api.types.is_float_dtype(dtype):
+        return Float
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return DateTime
+    return String
+
 def create_db(df,table=table,override=False):
     '''
     Create database with ecomm table
     '''
     if not db_exists() or override:
-        # SQLAlchemy engine & metadata
-        engine = get_engine()
-        metadata = MetaData()
-        df = df.rename(columns={c : c.replace(' ','_') for c in df.columns})
-        dtypes = df.dtypes.astype(str).to_dict()
-        column_mapping = {'int64':Integer,'float64':Float,'object':String,'datetime64[ns]':DateTime,'bool':Boolean}
-        columns = (Column(k,column_mapping[v]) if k != 'Product_ID' else Column(k,column_mapping[v],primary_key=True) for k,v in dtypes.items())
-        # Define symbols table (equivalent to a pandas DataFrame)
-        _ = Table(table, metadata,
-                  *columns
-                              )
-        # Create the table if it doesn't exist
-        metadata.create_all(engine)
+        df = write_table(df, table)
+        create_indexes(table)
+        notify_change(table, df, 'create')
 
+def define_table(df, table, metadata):
+    '''
+    SQLAlchemy Table typed from df, keyed on Product_ID when present
+    '''
+    columns = (Column(k,sql_type(v)) if k != key_column else Column(k,sql_type(v),primary_key=True) for k,v in df.dtypes.items())
+    return Table(table, metadata, *columns)
+
+def write_table(df, table):
+    '''
+    (Re)create table from df with its primary key, returns the db-named rows written
+    '''
+    # SQLAlchemy engine & metadata
+    engine = get_engine()
+    metadata = MetaData()
+    df = df.rename(columns={c : c.replace(' ','_') for c in df.columns})
+    if key_column in df.columns:
+        df = df.drop_duplicates(key_column, keep='last')
+    if is_sharded(table):
+        from .shards import write_shards
+        return write_shards(df, table)
+    if config.STORAGE == 'normalized':
+        from .normalized import write_storage
+        write_storage(df, table)
+        return df
+    sql_table = define_table(df, table, metadata)
+    with engine.begin() as conn:
+        if is_view(table):
+            from .normalized import drop_storage
+            drop_storage(table, conn)
+        sql_table.drop(conn, checkfirst=True)
+        metadata.create_all(conn)
         # Insert DataFrame into SQLAlchemy table
-        with engine.connect() as conn:
-            df.to_sql(table, conn, if_exists='replace', index=False)
+        df.to_sql(table, conn, if_exists='append', index=False)
+    return df
+
+def primary_key_columns(table=table):
+    '''
+    Primary key column names of table
+    '''
+    with get_engine().connect() as conn:
+        info = conn.execute(text(f'PRAGMA table_info("{table}")')).fetchall()
+    return [r[1] for r in sorted(info, key=lambda r: r[5]) if r[5]]
+
+def ensure_primary_key(table=table):
+    '''
+    Rebuild a table written without a key (e.g. by to_sql) with PRIMARY KEY (Product_ID),
+    keeping the last row for duplicated ids
+    '''
+    if is_sharded(table):
+        from .shards import each_shard
+        each_shard(lambda i: ensure_primary_key(table))
+        return
+    if is_view(table) or primary_key_columns(table) == [key_column]:
+        return
+    with get_engine().connect() as conn:
+        info = conn.execute(text(f'PRAGMA table_info("{table}")')).fetchall()
+    columns = ', '.join(f'"{r[1]}" {r[2]}' for r in info)
+    staging = f'{table}_rekey'
+    with get_engine().begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS "{staging}"'))
+        conn.execute(text(f'CREATE TABLE "{staging}" ({columns}, PRIMARY KEY ("{key_column}"))'))
+        conn.execute(text(f'INSERT OR REPLACE INTO "{staging}" SELECT * FROM "{table}" ORDER BY rowid'))
+    swap_tables(staging, table)
+    create_indexes(table)
+
+def swap_tables(staging, table=table):
+    '''
+    Atomically replace table with staging, readers see either the old or the new rows
+    (of each shard when sharded)
+    '''
+    if is_sharded(table):
+        from .shards import each_shard
+        each_shard(lambda i: swap_tables(staging, table))
+        return
+    raw = get_engine().raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        if is_view(staging):
+            from .normalized import swap_storage
+            swap_storage(staging, table, cursor)
+        else:
+            cursor.execute(f'DROP TABLE IF EXISTS "{table}"')
+            cursor.execute(f'ALTER TABLE "{staging}" RENAME TO "{table}"')
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+def create_indexes(table=table):
+    '''
+    Create the filter indexes used by the dashboard queries
+    '''
+    if is_sharded(table):
+        from .shards import each_shard
+        each_shard(lambda i: create_indexes(table))
+        return
+    if is_view(table):
+        from .normalized import create_fact_indexes
+        with get_engine().begin() as conn:
+            create_fact_indexes(table, conn)
+        return
+    columns = set(table_columns(table))
+    with get_engine().begin() as conn:
+        for c in index_columns:
+            if c in columns:
+                conn.execute(text(f'CREATE INDEX IF NOT EXISTS "ix_{table}_{c}" ON "{table}" ("{c}")'))
+        if {'Restock', 'Revenue'} <= columns:
+            # default order of the Needs Replenishment table, covers LIMIT/OFFSET paging
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS "ix_{table}_restock_revenue" ON "{table}" ("Revenue") '
+                              f'WHERE "Restock" = 1'))
 
 def list_tables():
     '''
-    List table names
+    List table names, including the views of normalized storage and the temp view over the shards
     '''
     engine = get_engine()
     with engine.connect() as connection:
-        result = connection.execute(text("SELECT name FROM sqlite_master WHERE type='table';"))
+        result = connection.execute(text("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') "
+                                         "UNION ALL SELECT name FROM sqlite_temp_master WHERE type = 'view';"))
         tables = result.fetchall()
         return [table[0] for table in tables]
 
@@ -57,14 +318,163 @@ def has_table(table):
     '''
     return table in list_tables()
 
+def is_view(table):
+    '''
+    table is the decoding view of normalized storage
+    '''
+    with get_engine().connect() as conn:
+        return conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = :name"),
+                            {'name': table}).scalar() is not None
+
+def table_columns(table=table):
+    '''
+    Column names of table
+    '''
+    with get_engine().connect() as conn:
+        return [r[1] for r in conn.execute(text(f'PRAGMA table_info("{table}")')).fetchall()]
+
+def column_types(table=table):
+    '''
+    Column name -> declared SQLite type of table
+    '''
+    with get_engine().connect() as conn:
+        return {r[1]: r[2] for r in conn.execute(text(f'PRAGMA table_info("{table}")')).fetchall()}
+
 def get_all_data(order_by_col=None,ascending=False):
     engine = get_engine()
     # Fetch data using SQLAlchemy
+    query = f"SELECT * FROM {table} where Category is not null"
+    if order_by_col:
+        if order_by_col not in table_columns(table):
+            raise ValueError(f"Unknown column: {order_by_col}")
+        query += f'\norder by "{order_by_col}" {"asc" if ascending else "desc"}'
     with engine.connect() as conn:
-        query = f"SELECT * FROM {table} where Category is not null"
-        if order_by_col:
-            query += f'\norder by {order_by_col} {"desc" if not ascending else ""}'
         df = pd.read_sql(query, conn)
+    return decode_categories(df)
+
+def to_db_datetime(value):
+    '''
+    Format a date or date string the way DATETIME columns are stored
+    '''
+    return pd.Timestamp(value).strftime(db_datetime_format)
+
+def filter_clauses(rec_start_date=None, rec_end_date=None, order_start_date=None, order_end_date=None,
+                   categories=None, products=None, statuses=None, warehouses=None):
+    '''
+    WHERE clauses, params and expanding binds for the dashboard filters
+    '''
+    clauses = ['Category is not null']
+    params = {}
+    for col, start, end, key in [('Date_Received', rec_start_date, rec_end_date, 'rec'),
+                                 ('Last_Order_Date', order_start_date, order_end_date, 'order')]:
+        if end:
+            clauses.append(f'"{col}" <= :{key}_end')
+            params[f'{key}_end'] = to_db_datetime(end)
+            if start:
+                clauses.append(f'"{col}" >= :{key}_start')
+                params[f'{key}_start'] = to_db_datetime(start)
+    binds = []
+    for col, values, key in [('Category', categories, 'categories'),
+                             ('Product_Name', products, 'products'),
+                             ('Status', statuses, 'statuses'),
+                             ('Warehouse_Location', warehouses, 'warehouses')]:
+        if values:
+            clauses.append(f'"{col}" IN :{key}')
+            params[key] = list(values)
+            binds.append(bindparam(key, expanding=True))
+    return clauses, params, binds
+
+def build_filter_query(rec_start_date=None, rec_end_date=None, order_start_date=None, order_end_date=None,
+                       categories=None, products=None, statuses=None, columns=None, table=table, warehouses=None):
+    '''
+    Build a parameterized SELECT for the dashboard filters.
+    Returns (sqlalchemy text clause, params)
+    '''
+    columns = columns or dashboard_columns
+    select = ', '.join(f'"{c}"' for c in columns)
+    clauses, params, binds = filter_clauses(rec_start_date, rec_end_date, order_start_date, order_end_date,
+                                            categories, products, statuses, warehouses)
+    query = text(f'SELECT {select} FROM "{table}" WHERE ' + ' AND '.join(clauses))
+    if binds:
+        query = query.bindparams(*binds)
+    return query, params
+
+def table_filter_clauses(table_filters, params):
+    '''
+    SQL for DataTable column filters given as (column, operator, value) triples,
+    adding their values to params
+    '''
+    clauses = []
+    for i, (col, op, value) in enumerate(table_filters or []):
+        if col not in restock_columns or op not in table_filter_operators:
+            raise ValueError(f"Unsupported table filter: {col} {op}")
+        key = f'tf_{i}'
+        if op == 'contains':
+            clauses.append(f'"{col}" LIKE :{key}')
+            params[key] = f'%{value}%'
+        elif op == 'scontains':
+            # LIKE ignores case
+            clauses.append(f'instr("{col}", :{key}) > 0')
+            params[key] = str(value)
+        elif op == 'datestartswith':
+            clauses.append(f'"{col}" LIKE :{key}')
+            params[key] = f'{value}%'
+        else:
+            clauses.append(f'"{col}" {op} :{key}')
+            params[key] = value
+    return clauses
+
+def build_restock_query(filters, table_filters=None, sort_by=None, limit=None, offset=0, table=table):
+    '''
+    (rows query, count query, params) for the Needs Replenishment table.
+    filters are the dashboard filter values, sort_by is a list of (column, ascending)
+    and defaults to Revenue, largest first
+    '''
+    clauses, params, binds = filter_clauses(*filters)
+    clauses.append('"Restock" = 1')
+    clauses += table_filter_clauses(table_filters, params)
+    where = ' AND '.join(clauses)
+    order = []
+    for col, ascending in sort_by or [('Revenue', False)]:
+        if col not in restock_columns:
+            raise ValueError(f"Unknown column: {col}")
+        order.append(f'"{col}" {"ASC" if ascending else "DESC"}')
+    select = ', '.join(f'"{c}"' for c in restock_columns)
+    sql = f'SELECT {select} FROM "{table}" WHERE {where} ORDER BY {", ".join(order)}'
+    if limit is not None:
+        sql += ' LIMIT :limit OFFSET :offset'
+        params.update(limit=int(limit), offset=int(offset))
+    query = text(sql)
+    count = text(f'SELECT COUNT(*) AS n FROM "{table}" WHERE {where}')
+    if binds:
+        query, count = query.bindparams(*binds), count.bindparams(*binds)
+    return query, count, params
+
+def query_restock_page(filters, table_filters=None, sort_by=None, page_current=0, page_size=10):
+    '''
+    One page of restock rows and the total row count for the filters
+    '''
+    query, count, params = build_restock_query(filters, table_filters, sort_by,
+                                               limit=page_size, offset=page_current * page_size)
+    total = int(query_db(count, params)['n'].iloc[0])
+    return query_db(query, params), total
+
+def query_filtered(rec_start_date=None, rec_end_date=None, order_start_date=None, order_end_date=None,
+                   categories=None, products=None, statuses=None, columns=None, table=table, warehouses=None):
+    '''
+    Filtered rows for the dashboard, read through the indexes, from the shards holding
+    the selected warehouses in parallel when sharded
+    '''
+    filters = (rec_start_date, rec_end_date, order_start_date, order_end_date, categories, products, statuses)
+    if is_sharded(table):
+        from .shards import each_shard, shards_of
+        parts = each_shard(lambda i: query_filtered(*filters, columns, table, warehouses), shards_of(warehouses))
+        return pd.concat(parts.values(), ignore_index=True)
+    query, params = build_filter_query(*filters, columns, table, warehouses)
+    df = query_db(query, params)
+    if df.empty:
+        # read_sql can't infer dtypes without rows, keep the measures numeric for the aggregations
+        df = df.astype({c: 'float64' for c in measure_columns if c in df.columns})
     return df
 
 
@@ -76,6 +486,7 @@ def initial_setup(override=False):
             # Call to create database and table on the first run
             create_db(df,override=override)
             return df
+        create_indexes(table)
         return get_all_data()
 
     else:
@@ -85,32 +496,168 @@ def initial_setup(override=False):
         return df
         
  
-def query_db(query):
+def get_date_bounds(columns=('Date_Received', 'Last_Order_Date'), table=table):
+    '''
+    {column: (min, max)} for date columns, answered from the indexes of each shard when sharded
+    '''
+    if is_sharded(table):
+        from .shards import each_shard
+        parts = list(each_shard(lambda i: get_date_bounds(columns, table)).values())
+        return {c: (min((p[c][0] for p in parts if p[c][0] is not None), default=None),
+                    max((p[c][1] for p in parts if p[c][1] is not None), default=None)) for c in columns}
+    select = ', '.join(f'MIN("{c}"), MAX("{c}")' for c in columns)
+    with get_engine().connect() as conn:
+        row = conn.execute(text(f'SELECT {select} FROM "{table}" WHERE Category is not null')).fetchone()
+    return {c: (pd.Timestamp(row[2 * i]) if row[2 * i] else None,
+                pd.Timestamp(row[2 * i + 1]) if row[2 * i + 1] else None)
+            for i, c in enumerate(columns)}
+
+def get_distinct_values(column, table=table):
+    '''
+    Distinct non-null values of column in first-seen order, shard by shard when sharded
+    '''
+    if is_sharded(table):
+        from .shards import each_shard
+        parts = each_shard(lambda i: get_distinct_values(column, table))
+        return list(dict.fromkeys(v for i in sorted(parts) for v in parts[i]))
+    if column not in table_columns(table):
+        raise ValueError(f"Unknown column: {column}")
+    with get_engine().connect() as conn:
+        rows = conn.execute(text(f'SELECT "{column}" FROM "{table}" WHERE Category is not null '
+                                 f'AND "{column}" is not null GROUP BY "{column}" ORDER BY MIN(rowid)')).fetchall()
+    return [r[0] for r in rows]
+
+def query_db(query, params=None):
     '''
-    Read query
+    Read query, timed through fetching the last row
     '''
     engine = get_engine()
-    with engine.connect() as conn:
-        return pd.read_sql(query, conn)
+    with timed(statement_name(query, 'sql.read')), engine.connect() as conn:
+        return decode_categories(pd.read_sql(query, conn, params=params))
+
+def decode_categories(df):
+    '''
+    Normalized storage reads its dimension columns back as pandas categoricals
+    '''
+    if config.STORAGE == 'normalized':
+        from .normalized import decode_frame
+        return decode_frame(df)
+    return df
         
 
+def frame_rows(df):
+    '''
+    Rows of df as tuples for executemany, dates in the DATETIME storage format and nulls as None
+    '''
+    columns = []
+    for c in df.columns:
+        values = df[c]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.dt.strftime(db_datetime_format)
+        elif pd.api.types.is_bool_dtype(values):
+            values = values.astype('Int8')
+        values = values.astype(object)
+        columns.append(values.where(values.notna(), None))
+    return list(zip(*columns))
+
 def insert_data(df,table):
-    engine = get_engine()
-    with engine.connect() as conn:
-        df.to_sql(table, conn, if_exists='append', index=False)
-def upsert_data(df,table):
-    raise Exception("Not Implemented")
-    engine = get_engine()
-    with engine.connect() as conn:
-        df['Date'] = df['Date'].dt.date
-        conn.execute(
-            text(f"""
-            INSERT OR REPLACE INTO {table} 
-            (Ticker, Date, Open, High, Low, Close, Volume)
-            VALUES (:Ticker, :Date, :Open, :High, :Low, :Close, :Volume)
-            """), df.to_dict(orient='records')
-        )
+    if is_sharded(table):
+        from .shards import each_shard, shard_rows
+        parts = shard_rows(df)
+        each_shard(lambda i: parts[i].to_sql(table, get_engine(), if_exists='append', index=False),
+                   [i for i, part in parts.items() if len(part)])
+    else:
+        engine = get_engine()
+        with engine.connect() as conn:
+            df.to_sql(table, conn, if_exists='append', index=False)
+    notify_change(table, df, 'append')
+def upsert_data(df,table=table):
+    '''
+    Insert new products and update changed ones, keyed on Product_ID.
+    Rows whose values all match the stored row are left alone.
+    Returns {'inserted', 'updated', 'unchanged'} row counts
+    '''
+    df = df.rename(columns={c : c.replace(' ','_') for c in df.columns})
+    if key_column not in df.columns:
+        raise ValueError(f"upsert needs a {key_column} column")
+    df = df.drop_duplicates(key_column, keep='last')
+    if is_sharded(table):
+        from .shards import upsert_shards
+        counts, previous, current = upsert_shards(df, table)
+    else:
+        counts, previous, current = apply_upsert(df, table)
+    if len(current):
+        notify_change(table, current, 'upsert', previous)
+    return counts
+def apply_upsert(df,table=table):
+    '''
+    The writes of upsert_data without notifying listeners.
+    Returns (counts, rows before, rows after) of the changed products
+    '''
+    ensure_primary_key(table)
+    columns = [c for c in table_columns(table) if c in df.columns]
+    values = [c for c in columns if c != key_column]
+    quoted = ', '.join(f'"{c}"' for c in columns)
+    stage, changes = f'{table}_upsert', f'{table}_changes'
+    normalized = is_view(table)
+    raw = get_engine().raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{stage}"')
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{changes}"')
+        cursor.execute(f'CREATE TEMP TABLE "{stage}" AS SELECT {quoted} FROM "{table}" WHERE 0')
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.executemany(f'INSERT INTO temp."{stage}" ({quoted}) VALUES ({", ".join("?" * len(columns))})',
+                           frame_rows(df[columns]))
+        # new ids plus ids where any incoming value differs from the stored one
+        differs = ' OR '.join(f's."{c}" IS NOT t."{c}"' for c in values) or '0'
+        cursor.execute(f'''CREATE TEMP TABLE "{changes}" AS
+                          SELECT s."{key_column}", t."{key_column}" IS NULL AS is_new
+                          FROM temp."{stage}" s LEFT JOIN "{table}" t ON t."{key_column}" = s."{key_column}"
+                          WHERE t."{key_column}" IS NULL OR {differs}''')
+        changed_rows = f'SELECT t.* FROM "{table}" t JOIN temp."{changes}" c ON c."{key_column}" = t."{key_column}"'
+        previous = pd.read_sql(changed_rows, raw.driver_connection)
+        changed_ids = f'SELECT "{key_column}" FROM temp."{changes}"'
+        if normalized:
+            # views take no ON CONFLICT, their triggers insert the new ids and update the rest
+            cursor.execute(f'''INSERT INTO "{table}" ({quoted})
+                               SELECT {quoted} FROM temp."{stage}" s
+                               WHERE s."{key_column}" IN ({changed_ids} WHERE is_new)''')
+            if values:
+                listed = ', '.join(f'"{c}"' for c in values)
+                cursor.execute(f'''UPDATE "{table}" SET ({listed}) =
+                                   (SELECT {listed} FROM temp."{stage}" s WHERE s."{key_column}" = "{table}"."{key_column}")
+                                   WHERE "{key_column}" IN ({changed_ids} WHERE NOT is_new)''')
+        else:
+            updates = ', '.join(f'"{c}" = excluded."{c}"' for c in values)
+            upsert = f'''INSERT INTO "{table}" ({quoted})
+                         SELECT {quoted} FROM temp."{stage}" s
+                         WHERE s."{key_column}" IN ({changed_ids})'''
+            if updates:
+                upsert += f' ON CONFLICT("{key_column}") DO UPDATE SET {updates}'
+            cursor.execute(upsert)
+        current = pd.read_sql(changed_rows, raw.driver_connection)
+        inserted = cursor.execute(f'SELECT COALESCE(SUM(is_new), 0) FROM temp."{changes}"').fetchone()[0]
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{stage}"')
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{changes}"')
+        raw.close()
+    counts = {'inserted': int(inserted), 'updated': len(previous), 'unchanged': len(df) - len(current)}
+    return counts, previous, current
 def replace_data(df,table):
-    engine = get_engine()
-    df.to_sql(table, engine, if_exists='replace', index=False)
+    '''
+    Replace every row of table, swapped in atomically (shard by shard when sharded)
+    '''
+    if is_sharded(table):
+        df = write_table(df, table)
+    else:
+        staging = f'{table}_staging'
+        df = write_table(df, staging)
+        swap_tables(staging, table)
+    create_indexes(table)
+    notify_change(table, df, 'replace')
 
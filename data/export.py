@@ -0,0 +1,130 @@
+import csv
+import io
+import os
+import tempfile
+from . import config
+from .db import get_engine, build_restock_query, restock_columns, column_types
+
+# Streaming exports of the Needs Replenishment rows, batches come straight off the SQLite cursor
+
+export_mimetypes = {'csv': 'text/csv',
+                    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                    'parquet': 'application/vnd.apache.parquet'}
+# Header names as shown in the DataTable
+export_columns = [c.replace('_',' ').title() for c in restock_columns]
+
+
+def iter_batches(query, params, batch_size=None):
+    '''
+    Yield lists of row tuples for query, batch_size rows at a time
+    '''
+    batch_size = batch_size or config.EXPORT_BATCH_ROWS
+    with get_engine().connect() as conn:
+        result = conn.execute(query, params)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [tuple(r) for r in rows]
+
+
+def stream_csv(query, params):
+    '''
+    CSV text, one chunk per cursor batch
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_columns)
+    for rows in iter_batches(query, params):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def write_xlsx(path, query, params):
+    '''
+    Write an xlsx with openpyxl's write-only mode, rows are flushed as they are appended
+    '''
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Replenishment Needs')
+    ws.append(export_columns)
+    for rows in iter_batches(query, params):
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+
+
+def arrow_type(declared):
+    '''
+    pyarrow type for a declared SQLite column type, following SQLite's affinity rules
+    '''
+    import pyarrow as pa
+    declared = declared.upper()
+    if 'INT' in declared:
+        return pa.int64()
+    if any(t in declared for t in ('REAL', 'FLOA', 'DOUB')):
+        return pa.float64()
+    return pa.string()
+
+
+def parquet_schema():
+    '''
+    Export schema from the table's declared column types, so it doesn't depend on
+    which values the first batch happens to hold (e.g. all nulls)
+    '''
+    import pyarrow as pa
+    types = column_types()
+    return pa.schema([(name, arrow_type(types.get(c, ''))) for c, name in zip(restock_columns, export_columns)])
+
+
+def write_parquet(path, query, params):
+    '''
+    Write a parquet file one row group per cursor batch, each converted to the declared schema
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = parquet_schema()
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in iter_batches(query, params):
+            writer.write_table(pa.Table.from_pylist([dict(zip(export_columns, r)) for r in rows], schema=schema))
+
+
+def stream_file(path, chunk_size=1 << 16):
+    '''
+    Yield the bytes of path, deleting it once read
+    '''
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def export_restock(file_type, filters, table_filters=None, sort_by=None):
+    '''
+    (byte/str chunk generator, mimetype) for the export in file_type.
+    xlsx and parquet need a seekable file, so they are written to a temp file and streamed from it
+    '''
+    if file_type not in export_mimetypes:
+        raise ValueError(f"Unsupported export type: {file_type}")
+    # built up front so bad columns or operators fail before the response starts
+    query, _, params = build_restock_query(filters, table_filters, sort_by)
+    if file_type == 'csv':
+        return stream_csv(query, params), export_mimetypes[file_type]
+    fd, path = tempfile.mkstemp(suffix=f'.{file_type}')
+    os.close(fd)
+    try:
+        writer = write_xlsx if file_type == 'xlsx' else write_parquet
+        writer(path, query, params)
+    except Exception:
+        os.remove(path)
+        raise
+    return stream_file(path), export_mimetypes[file_type]
@@ -0,0 +1,217 @@
+from datetime import date, timedelta
+import pandas as pd
+from sqlalchemy import text, bindparam
+from . import config
+from .db import get_engine, add_change_listener, has_table, table_columns, query_db, table, key_column
+
+# Append-only daily history of the grocery table. A product gets a row only on the days it
+# changed, keyed (Product_ID, Snapshot_Date) so as-of lookups and ranges are index seeks.
+# The latest table holds each product's current state to diff new writes against, the
+# totals table the per-category sums of every snapshot day for trend charts.
+
+history_table = f'{table}_history'
+latest_table = f'{table}_history_latest'
+totals_table = f'{table}_history_totals'
+# column: SQLite type
+history_columns = {'Product_Name': 'TEXT', 'Category': 'TEXT', 'Status': 'TEXT', 'Stock_Quantity': 'INTEGER',
+                   'Reorder_Level': 'INTEGER', 'Unit_Price': 'REAL', 'Sales_Volume': 'INTEGER', 'Revenue': 'REAL',
+                   'Inventory_Value': 'REAL', 'Restock': 'INTEGER'}
+trend_measures = ['Stock_Quantity', 'Revenue', 'Restock']
+
+
+def create_history_tables(cursor):
+    columns = ', '.join(f'"{c}" {t}' for c, t in history_columns.items())
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS "{history_table}" (
+                           "{key_column}" NOT NULL, Snapshot_Date TEXT NOT NULL, {columns},
+                           Deleted INTEGER NOT NULL DEFAULT 0,
+                           PRIMARY KEY ("{key_column}", Snapshot_Date)) WITHOUT ROWID''')
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS "{latest_table}" (
+                           "{key_column}" NOT NULL PRIMARY KEY, Snapshot_Date TEXT NOT NULL, {columns},
+                           Deleted INTEGER NOT NULL DEFAULT 0)''')
+    measures = ', '.join(f'"{m}" REAL' for m in trend_measures)
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS "{totals_table}" (
+                           Snapshot_Date TEXT NOT NULL, Category TEXT NOT NULL, Rows INTEGER NOT NULL, {measures},
+                           PRIMARY KEY (Snapshot_Date, Category)) WITHOUT ROWID''')
+
+
+def record_snapshot(day=None, ids=None):
+    '''
+    Add the products that changed since their latest history row under day (default today),
+    only the products in ids when given, otherwise every product, marking the ones that are
+    gone as deleted. Later writes on the same day replace that day's rows.
+    Returns the number of history rows written
+    '''
+    if not has_table(table):
+        return 0
+    day = pd.Timestamp(day or date.today()).strftime('%Y-%m-%d')
+    columns = [c for c in history_columns if c in table_columns(table)]
+    quoted = ', '.join(f'"{c}"' for c in columns)
+    selected = ', '.join(f't."{c}"' for c in columns)
+    differs = ' OR '.join(f'l."{c}" IS NOT t."{c}"' for c in columns) or '0'
+    changed, scope = f'{table}_history_changes', f'{table}_history_ids'
+    raw = get_engine().raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{changed}"')
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{scope}"')
+        cursor.execute('BEGIN IMMEDIATE')
+        create_history_tables(cursor)
+        where = ''
+        if ids is not None:
+            cursor.execute(f'CREATE TEMP TABLE "{scope}" ("{key_column}" PRIMARY KEY)')
+            cursor.executemany(f'INSERT OR IGNORE INTO temp."{scope}" VALUES (?)', [(i,) for i in ids])
+            where = f'AND t."{key_column}" IN (SELECT "{key_column}" FROM temp."{scope}")'
+        # + drops t's INTEGER affinity, which would keep the lookup off the untyped key's index
+        cursor.execute(f'''CREATE TEMP TABLE "{changed}" AS
+                           SELECT t."{key_column}" AS "{key_column}", {selected}, 0 AS Deleted
+                           FROM "{table}" t LEFT JOIN "{latest_table}" l ON l."{key_column}" = +t."{key_column}"
+                           WHERE (l."{key_column}" IS NULL OR l.Deleted OR {differs}) {where}''')
+        if ids is None:
+            cursor.execute(f'''INSERT INTO temp."{changed}"
+                               SELECT l."{key_column}", {', '.join(f'l."{c}"' for c in columns)}, 1
+                               FROM "{latest_table}" l
+                               WHERE NOT l.Deleted AND NOT EXISTS
+                                     (SELECT 1 FROM "{table}" t WHERE t."{key_column}" = l."{key_column}")''')
+        # the day's per-category totals move by the changed rows' new values less their latest ones
+        measures = ', '.join(f'"{m}"' for m in trend_measures)
+        new = ', '.join(f'"{m}"' if m in columns else f'0 AS "{m}"' for m in trend_measures)
+        old = ', '.join(f'-l."{m}"' if m in columns else '0' for m in trend_measures)
+        sums = ', '.join(f'COALESCE(SUM("{m}"), 0)' for m in trend_measures)
+        cursor.execute(f'''INSERT INTO "{totals_table}" (Snapshot_Date, Category, Rows, {measures})
+                           SELECT ?, Category, Rows, {measures} FROM "{totals_table}"
+                           WHERE Snapshot_Date = (SELECT MAX(Snapshot_Date) FROM "{totals_table}" WHERE Snapshot_Date < ?)
+                             AND NOT EXISTS (SELECT 1 FROM "{totals_table}" WHERE Snapshot_Date = ?)''', (day, day, day))
+        updates = ', '.join(f'"{m}" = "{m}" + excluded."{m}"' for m in ['Rows'] + trend_measures)
+        cursor.execute(f'''INSERT INTO "{totals_table}" (Snapshot_Date, Category, Rows, {measures})
+                           SELECT ?, Category, SUM(n), {sums}
+                           FROM (SELECT Category, 1 AS n, {new} FROM temp."{changed}" WHERE NOT Deleted
+                                 UNION ALL
+                                 SELECT l.Category, -1, {old} FROM temp."{changed}" c
+                                 JOIN "{latest_table}" l ON l."{key_column}" = +c."{key_column}" WHERE NOT l.Deleted)
+                           WHERE Category IS NOT NULL GROUP BY Category
+                           ON CONFLICT (Snapshot_Date, Category) DO UPDATE SET {updates}''', (day,))
+        cursor.execute(f'DELETE FROM "{totals_table}" WHERE Snapshot_Date = ? AND Rows <= 0', (day,))
+        for target in (history_table, latest_table):
+            cursor.execute(f'''INSERT OR REPLACE INTO "{target}" ("{key_column}", Snapshot_Date, {quoted}, Deleted)
+                               SELECT "{key_column}", ?, {quoted}, Deleted FROM temp."{changed}"''', (day,))
+        written = cursor.execute(f'SELECT COUNT(*) FROM temp."{changed}"').fetchone()[0]
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{changed}"')
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{scope}"')
+        raw.close()
+    return written
+
+
+def on_table_change(changed, df, mode, previous=None):
+    '''
+    Record every write to the grocery table in today's snapshot
+    '''
+    if changed != table or not config.HISTORY_ENABLED:
+        return
+    if mode in ('append', 'upsert') and df is not None and has_table(latest_table):
+        record_snapshot(ids=df[key_column].tolist())
+    else:
+        record_snapshot()
+
+
+add_change_listener(on_table_change)
+
+
+def ensure_history():
+    '''
+    Start the history with today's rows when it is empty
+    '''
+    if config.HISTORY_ENABLED and not has_table(latest_table):
+        record_snapshot()
+
+
+def state_as_of(day, columns=None, ids=None):
+    '''
+    Each product's row as it was at the end of day, one index seek per product.
+    Products deleted by then or added later are left out
+    '''
+    columns = columns or list(history_columns)
+    selected = ', '.join(f'h."{c}"' for c in [key_column] + columns)
+    clauses, params, binds = ['NOT h.Deleted'], {'day': pd.Timestamp(day).strftime('%Y-%m-%d')}, []
+    if ids is not None:
+        clauses.append(f'p."{key_column}" IN :ids')
+        params['ids'] = list(ids)
+        binds.append(bindparam('ids', expanding=True))
+    query = text(f'''SELECT {selected} FROM "{latest_table}" p
+                     JOIN "{history_table}" h ON h."{key_column}" = p."{key_column}" AND h.Snapshot_Date =
+                         (SELECT MAX(Snapshot_Date) FROM "{history_table}" x
+                          WHERE x."{key_column}" = p."{key_column}" AND x.Snapshot_Date <= :day)
+                     WHERE {' AND '.join(clauses)}''')
+    if binds:
+        query = query.bindparams(*binds)
+    return query_db(query, params)
+
+
+def product_history(products, start, end, measures=None):
+    '''
+    Daily measures summed per product name from start to end: the state as of start,
+    then every change. Products are the names the dashboard filters on
+    '''
+    measures = measures or ['Stock_Quantity', 'Revenue']
+    ids_query = text(f'SELECT "{key_column}" FROM "{latest_table}" WHERE Product_Name IN :names') \
+        .bindparams(bindparam('names', expanding=True))
+    ids = query_db(ids_query, {'names': list(products)})[key_column].tolist()
+    if not ids:
+        return pd.DataFrame(columns=['Snapshot_Date', 'Product_Name'] + measures)
+    start, end = pd.Timestamp(start).strftime('%Y-%m-%d'), pd.Timestamp(end).strftime('%Y-%m-%d')
+    opening = state_as_of(start, ['Product_Name'] + measures, ids)
+    opening['Snapshot_Date'] = start
+    opening['Deleted'] = 0
+    selected = ', '.join(f'"{c}"' for c in [key_column, 'Snapshot_Date', 'Product_Name', 'Deleted'] + measures)
+    changes = query_db(text(f'''SELECT {selected} FROM "{history_table}"
+                                WHERE "{key_column}" IN :ids AND Snapshot_Date > :start AND Snapshot_Date <= :end''')
+                       .bindparams(bindparam('ids', expanding=True)), {'ids': ids, 'start': start, 'end': end})
+    rows = pd.concat([opening, changes], ignore_index=True)
+    if rows.empty:
+        return pd.DataFrame(columns=['Snapshot_Date', 'Product_Name'] + measures)
+    rows.loc[rows['Deleted'].astype(bool), measures] = 0
+    # carry each product's values forward to every day any of them changed
+    days = sorted(rows['Snapshot_Date'].unique())
+    names = rows.groupby(key_column)['Product_Name'].last()
+    frames = []
+    for m in measures:
+        wide = rows.pivot_table(index='Snapshot_Date', columns=key_column, values=m, aggfunc='last')
+        wide = wide.reindex(days).ffill().fillna(0)
+        frames.append(wide.T.groupby(names).sum().T.stack().rename(m))
+    return pd.concat(frames, axis=1).reset_index()[['Snapshot_Date', 'Product_Name'] + measures]
+
+
+def totals_history(start, end, categories=None):
+    '''
+    Per-category measures on every snapshot day from start to end, starting with the
+    last snapshot on or before start. Reads only the totals of those days
+    '''
+    start, end = pd.Timestamp(start).strftime('%Y-%m-%d'), pd.Timestamp(end).strftime('%Y-%m-%d')
+    where, params, binds = '', {'start': start, 'end': end}, []
+    if categories:
+        where = 'AND Category IN :categories'
+        params['categories'] = list(categories)
+        binds.append(bindparam('categories', expanding=True))
+    measures = ', '.join(f'"{m}"' for m in trend_measures)
+    query = text(f'''SELECT Snapshot_Date, Category, Rows, {measures} FROM "{totals_table}"
+                     WHERE Snapshot_Date BETWEEN
+                           COALESCE((SELECT MAX(Snapshot_Date) FROM "{totals_table}" WHERE Snapshot_Date <= :start), :start)
+                           AND :end {where}
+                     ORDER BY Snapshot_Date, Category''')
+    if binds:
+        query = query.bindparams(*binds)
+    rows = query_db(query, params)
+    rows.loc[rows['Snapshot_Date'] < start, 'Snapshot_Date'] = start
+    return rows
+
+
+def trend_range(days=None, end=None):
+    '''
+    (start, end) dates of the trend chart, the last days days up to today
+    '''
+    end = pd.Timestamp(end or date.today()).date()
+    return end - timedelta(days=days or config.HISTORY_TREND_DAYS), end
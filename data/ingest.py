@@ -0,0 +1,169 @@
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from sqlalchemy import text
+from . import config
+from .data import read_dataset
+from .stream import prepare_chunk
+from .db import get_engine, create_db, upsert_data, has_table, table
+from .snapshot import file_checksum, defer_snapshots
+from .shards import ensure_shards
+# keep the rollup and history tables in step with the writes below
+from . import rollup, history
+
+# Bulk ingest of many input files: parsed in worker processes, written by this process alone
+
+input_extensions = ('.csv', '.xlsx', '.json', '.jsonl', '.ndjson')
+ingested_table = f'{table}_ingested'
+
+
+def discover(paths):
+    '''
+    Input files under paths, which may be files, directories or glob patterns, in sorted order
+    '''
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = glob.iglob(os.path.join(path, '**', '*'), recursive=True)
+        else:
+            candidates = glob.iglob(path) if glob.has_magic(path) else [path]
+        found.update(os.path.abspath(c) for c in candidates
+                     if os.path.isfile(c) and os.path.splitext(c)[1].lower() in input_extensions)
+    return sorted(found)
+
+
+def create_ingested_table():
+    with get_engine().begin() as conn:
+        conn.execute(text(f'''
+            CREATE TABLE IF NOT EXISTS "{ingested_table}" (
+                digest TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                ingested_at TEXT NOT NULL
+            )'''))
+
+
+def ingested_digests():
+    create_ingested_table()
+    with get_engine().connect() as conn:
+        return {row[0] for row in conn.execute(text(f'SELECT digest FROM "{ingested_table}"'))}
+
+
+def record_ingested(digest, path, rows):
+    with get_engine().begin() as conn:
+        conn.execute(text(f'''INSERT INTO "{ingested_table}" (digest, path, rows, ingested_at)
+                              VALUES (:digest, :path, :rows, :ingested_at)
+                              ON CONFLICT(digest) DO UPDATE SET path = excluded.path, rows = excluded.rows,
+                                                                ingested_at = excluded.ingested_at'''),
+                     {'digest': digest, 'path': path, 'rows': rows,
+                      'ingested_at': datetime.now().isoformat(timespec='seconds')})
+
+
+def parse_file(path):
+    '''
+    Read and transform one input in a worker process, returns (db-named rows, seconds)
+    '''
+    start = time.perf_counter()
+    df = prepare_chunk(read_dataset(path))
+    return df, time.perf_counter() - start
+
+
+def write_rows(df):
+    '''
+    Upsert rows into the grocery table, creating it from the first file when missing
+    '''
+    if not has_table(table):
+        create_db(df, override=True)
+        return {'inserted': len(df), 'updated': 0, 'unchanged': 0}
+    return upsert_data(df)
+
+
+def print_file(stats):
+    if stats['status'] == 'skipped':
+        print(f"{stats['path']}: unchanged, skipped")
+    elif stats['status'] == 'failed':
+        print(f"{stats['path']}: failed, {stats['error']}")
+    else:
+        print(f"{stats['path']}: {stats['rows']:,} rows, parse {stats['parse_seconds']:.2f}s, "
+              f"write {stats['write_seconds']:.2f}s, {stats['rows_per_sec']:,.0f} rows/s, "
+              f"{stats['mb_per_sec']:.1f} MB/s ({stats['inserted']:,} new, {stats['updated']:,} updated)")
+
+
+def write_parsed(path, digest, future, submitted):
+    '''
+    Upsert one input's parse result, returns its stats dict
+    '''
+    stats = {'path': path, 'bytes': os.path.getsize(path)}
+    try:
+        df, stats['parse_seconds'] = future.result()
+        write_start = time.perf_counter()
+        stats.update(write_rows(df))
+        stats['write_seconds'] = time.perf_counter() - write_start
+        record_ingested(digest, path, len(df))
+    except Exception as e:
+        stats.update(status='failed', error=repr(e))
+    else:
+        seconds = stats['parse_seconds'] + stats['write_seconds']
+        stats.update(status='loaded', rows=len(df), rows_per_sec=len(df) / max(seconds, 1e-9),
+                     mb_per_sec=stats['bytes'] / 1e6 / max(seconds, 1e-9),
+                     wall_seconds=time.perf_counter() - submitted)
+    return stats
+
+
+def ingest_files(paths, workers=None, force=False, progress=print_file):
+    '''
+    Parse the inputs in a process pool and upsert them from this process only, so SQLite
+    sees a single writer (per shard when sharded, each file's rows are written to the
+    shards in parallel). Writes follow the order of paths whichever parse finishes first,
+    so when inputs share a Product_ID the later path's row wins on every run. Inputs whose
+    content hash was already ingested are skipped unless force is set.
+    Returns one stats dict per input
+    '''
+    workers = workers or config.INGEST_WORKERS or os.cpu_count()
+    ensure_shards()
+    done = set() if force else ingested_digests()
+    results = []
+    pending = []
+    for path in paths:
+        digest = file_checksum(path)
+        if digest in done:
+            results.append({'path': path, 'status': 'skipped'})
+            if progress:
+                progress(results[-1])
+        else:
+            done.add(digest)
+            pending.append((path, digest))
+    if not pending:
+        return results
+    with ProcessPoolExecutor(min(workers, len(pending))) as pool, defer_snapshots():
+        # a couple of files per worker are parsing or parsed ahead of the writer at most
+        queue = iter(enumerate(pending))
+        running = {}
+        # parsed inputs waiting for the ones before them, by position in pending
+        parsed = {}
+        written = 0
+
+        def submit():
+            for index, (path, digest) in queue:
+                running[pool.submit(parse_file, path)] = (index, time.perf_counter())
+                return
+
+        for _ in range(2 * workers):
+            submit()
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index, submitted = running.pop(future)
+                parsed[index] = (future, submitted)
+            while written in parsed:
+                future, submitted = parsed.pop(written)
+                path, digest = pending[written]
+                written += 1
+                submit()
+                stats = write_parsed(path, digest, future, submitted)
+                results.append(stats)
+                if progress:
+                    progress(stats)
+    return results
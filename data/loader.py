@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+import traceback
+from . import config
+from .stream import setup_db
+from .rollup import ensure_rollup
+from .snapshot import ensure_snapshot
+from .shared import publish_if_stale
+from .refresh import recompute_flags, refresher
+from .cache import dashboard_cache
+from .bitmap import filter_engine
+from .topk import top_products
+from .history import ensure_history
+
+# Background dataset load so the web server can start before the data is ready
+
+data_ready = threading.Event()
+# Startup stage durations in seconds, filled in by app.py and load_data
+timings = {}
+load_error = None
+_load_thread = None
+_load_lock = threading.Lock()
+
+
+def record_timing(stage, seconds):
+    timings[stage] = round(seconds, 4)
+
+
+def load_data():
+    '''
+    Create or check the database, bring the derived flags up to date,
+    then build the rollup, top products rankings, snapshot and shared dataset
+    '''
+    global load_error
+    start = time.perf_counter()
+    try:
+        setup_db()
+        record_timing('data_load.setup_db', time.perf_counter() - start)
+        flags_start = time.perf_counter()
+        recompute_flags()
+        record_timing('data_load.flags', time.perf_counter() - flags_start)
+        rollup_start = time.perf_counter()
+        ensure_rollup()
+        record_timing('data_load.rollup', time.perf_counter() - rollup_start)
+        history_start = time.perf_counter()
+        ensure_history()
+        record_timing('data_load.history', time.perf_counter() - history_start)
+        topk_start = time.perf_counter()
+        top_products.ensure_current()
+        record_timing('data_load.topk', time.perf_counter() - topk_start)
+        snapshot_start = time.perf_counter()
+        ensure_snapshot()
+        record_timing('data_load.snapshot', time.perf_counter() - snapshot_start)
+        if config.SHARED_DATASET:
+            shared_start = time.perf_counter()
+            publish_if_stale()
+            record_timing('data_load.shared', time.perf_counter() - shared_start)
+        if config.FILTER_ENGINE == 'bitmap':
+            index_start = time.perf_counter()
+            filter_engine.get_index()
+            record_timing('data_load.filter_index', time.perf_counter() - index_start)
+        data_ready.set()
+        refresher.start()
+    except Exception:
+        load_error = traceback.format_exc()
+        print(f"Error loading data: {load_error}")
+    finally:
+        record_timing('data_load', time.perf_counter() - start)
+        report_startup()
+
+
+def refresh_derived_state(version):
+    '''
+    Catch up after another process changed the data
+    '''
+    if dashboard_cache is not None:
+        dashboard_cache.clear()
+    ensure_snapshot()
+    if config.SHARED_DATASET:
+        publish_if_stale()
+    if config.FILTER_ENGINE == 'bitmap':
+        # rebuild here rather than on the next dashboard request
+        filter_engine.get_index()
+    top_products.ensure_current()
+
+
+refresher.add_listener(refresh_derived_state)
+
+
+def start_data_load():
+    '''
+    Start load_data on a daemon thread once per process
+    '''
+    global _load_thread
+    with _load_lock:
+        if _load_thread is None:
+            _load_thread = threading.Thread(target=load_data, name='grocery-data-load', daemon=True)
+            _load_thread.start()
+    return _load_thread
+
+
+def is_data_ready():
+    return data_ready.is_set()
+
+
+def startup_report():
+    '''
+    Startup stage timings plus load status
+    '''
+    return {'timings': dict(timings), 'data_ready': is_data_ready(), 'error': load_error}
+
+
+def report_startup():
+    '''
+    Print the startup report and write it to STARTUP_REPORT_PATH when set
+    '''
+    report = startup_report()
+    print("Startup timings: " + ', '.join(f'{k}={v:.3f}s' for k, v in report['timings'].items()))
+    if config.STARTUP_REPORT_PATH:
+        with open(config.STARTUP_REPORT_PATH, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,290 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import functools
+import itertools
+import os
+import re
+import threading
+import time
+from . import config
+
+# Latency and payload-size histograms for callbacks, their stages, requests and SQL queries
+
+time_buckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+size_buckets = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+_local = threading.local()
+
+
+class Histogram:
+    '''
+    Fixed-bucket histogram, quantiles are estimated by interpolating inside a bucket
+    '''
+
+    def __init__(self, buckets, unit='seconds'):
+        self.buckets = list(buckets)
+        self.unit = unit
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.buckets[i - 1] if i else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return self.max
+
+    def snapshot(self):
+        with self.lock:
+            cumulative, total = {}, 0
+            for bound, n in zip(self.buckets + ['+Inf'], self.counts):
+                total += n
+                cumulative[str(bound)] = total
+            return {'unit': self.unit, 'count': self.count, 'sum': round(self.sum, 6),
+                    'mean': round(self.sum / self.count, 6) if self.count else None,
+                    'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+                    'max': self.max, 'buckets': cumulative}
+
+
+class Registry:
+    '''
+    Named histograms, created on first observation, and named counter sources read when exported
+    '''
+
+    def __init__(self):
+        self.histograms = {}
+        self.sources = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name, buckets=time_buckets, unit='seconds'):
+        hist = self.histograms.get(name)
+        if hist is None:
+            with self.lock:
+                hist = self.histograms.setdefault(name, Histogram(buckets, unit))
+        return hist
+
+    def observe(self, name, value, buckets=time_buckets, unit='seconds'):
+        self.histogram(name, buckets, unit).observe(value)
+
+    def observe_size(self, name, size):
+        self.observe(name, size, size_buckets, 'bytes')
+
+    def snapshot(self):
+        return {name: hist.snapshot() for name, hist in sorted(self.histograms.items())}
+
+    def add_stats(self, name, stats):
+        '''
+        Export the counters stats() returns, e.g. a cache's hits and misses, under name
+        '''
+        self.sources[name] = stats
+
+    def stats(self):
+        return {name: stats() for name, stats in sorted(self.sources.items())}
+
+    def prometheus_text(self):
+        '''
+        Prometheus text exposition, one histogram family per unit labelled by metric name
+        '''
+        lines = []
+        snapshot = self.snapshot()
+        for unit in ('seconds', 'bytes'):
+            family = f'grocery_{unit}'
+            lines.append(f'# TYPE {family} histogram')
+            for name, hist in snapshot.items():
+                if hist['unit'] != unit:
+                    continue
+                for bound, n in hist['buckets'].items():
+                    lines.append(f'{family}_bucket{{name="{name}",le="{bound}"}} {n}')
+                lines.append(f'{family}_sum{{name="{name}"}} {hist["sum"]}')
+                lines.append(f'{family}_count{{name="{name}"}} {hist["count"]}')
+        lines.append('# TYPE grocery_stat gauge')
+        for name, stats in self.stats().items():
+            for stat, value in stats.items():
+                lines.append(f'grocery_stat{{name="{name}",stat="{stat}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+
+registry = Registry()
+
+
+@contextmanager
+def timed(name):
+    '''
+    Record the duration of the with block under name
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if config.METRICS_ENABLED:
+            registry.observe(name, time.perf_counter() - start)
+
+
+def stage(name):
+    '''
+    Time a stage of the callback running on this thread, e.g. stage('filter')
+    '''
+    prefix = getattr(_local, 'callback', None)
+    return timed(f'{prefix}.{name}' if prefix else name)
+
+
+def payload_size(value):
+    '''
+    Bytes value takes in the callback response, None for no_update
+    '''
+    from plotly.io.json import to_json_plotly
+    if type(value).__name__ == 'NoUpdate':
+        return None
+    return len(to_json_plotly(value))
+
+
+def start_profiler():
+    '''
+    Profiler for one callback when slow-request profiling is on, None otherwise
+    '''
+    if config.PROFILE_SLOW_MS <= 0:
+        return None
+    if config.PROFILER == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another thread is already being profiled
+        return None
+    return profiler
+
+
+def stop_profiler(profiler, name, seconds):
+    '''
+    Stop profiler and keep its output when the callback took longer than PROFILE_SLOW_MS
+    '''
+    if profiler is None:
+        return None
+    if config.PROFILER == 'pyinstrument':
+        profiler.stop()
+    else:
+        profiler.disable()
+    if seconds * 1000 < config.PROFILE_SLOW_MS:
+        return None
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(config.PROFILE_DIR, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}-{int(seconds * 1000)}ms')
+    if config.PROFILER == 'pyinstrument':
+        path += '.html'
+        with open(path, 'w') as f:
+            f.write(profiler.output_html())
+    else:
+        path += '.prof'
+        profiler.dump_stats(path)
+    return path
+
+
+def record_payload(prefix, size, callback_end=None):
+    '''
+    Record the size of the response Dash encoded for the callback named in this request,
+    and the time from the callback returning to the encoded response when callback_end is given
+    '''
+    registry.observe_size(f'{prefix}.payload', size)
+    if callback_end is not None:
+        registry.observe(f'{prefix}.encode', time.perf_counter() - callback_end)
+
+
+def instrument(name, outputs=None):
+    '''
+    Decorator timing a Dash callback and its stages. The response size and Dash's encoding
+    time are recorded once Dash has encoded it (see record_payload), each output's size on a
+    METRICS_PAYLOAD_SAMPLE sample of calls. outputs names the returned values, they are numbered otherwise
+    '''
+    def decorator(func):
+        calls = itertools.count()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not config.METRICS_ENABLED:
+                return func(*args, **kwargs)
+            prefix = f'callback.{name}'
+            _local.callback = prefix
+            from flask import g, has_request_context
+            if has_request_context():
+                g.metrics_callback = prefix
+            profiler = start_profiler()
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                _local.callback = None
+                registry.observe(f'{prefix}.total', seconds)
+                stop_profiler(profiler, name, seconds)
+                if has_request_context():
+                    g.metrics_callback_end = time.perf_counter()
+            if config.METRICS_PAYLOAD_SAMPLE <= 0 or next(calls) % config.METRICS_PAYLOAD_SAMPLE:
+                return result
+            # serialized again the way Dash encodes the response
+            values = result if isinstance(result, (tuple, list)) and outputs and len(outputs) > 1 else [result]
+            for i, value in enumerate(values):
+                size = payload_size(value)
+                if size is not None:
+                    label = outputs[i] if outputs and i < len(outputs) else str(i)
+                    registry.observe_size(f'{prefix}.payload.{label}', size)
+            return result
+        return wrapper
+    return decorator
+
+
+def statement_name(statement, prefix='sql.execute'):
+    '''
+    Short stable label for a SQL statement, expanded IN lists collapsed
+    '''
+    statement = re.sub(r'\(\s*\?(\s*,\s*\?)*\s*\)', '(?)', ' '.join(str(statement).split()))
+    return f'{prefix}.{statement[:120]}'
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if starts:
+        registry.observe(statement_name(statement), time.perf_counter() - starts.pop())
+
+
+def handle_error(context):
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine):
+    '''
+    Time every statement run through the engine
+    '''
+    from sqlalchemy import event
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
+    return engine
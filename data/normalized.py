@@ -0,0 +1,215 @@
+import pandas as pd
+from sqlalchemy import MetaData, text
+from .db import get_engine, define_table, table, key_column
+
+# Normalized storage: repeated labels live in dimension tables and the fact table holds their
+# integer keys, dates are integer days since 1970-01-01. A view with the table's name decodes
+# the rows back to the wide layout, and INSTEAD OF triggers encode the writes made through it,
+# so queries and writers elsewhere don't change.
+
+# column: dimension table suffix
+dimension_columns = {'Category': 'categories', 'Supplier_Name': 'suppliers',
+                     'Warehouse_Location': 'warehouses', 'Status': 'statuses'}
+day_columns = ['Date_Received', 'Last_Order_Date', 'Expiration_Date']
+key_suffix = '_Key'
+# julianday of 1970-01-01
+epoch_julian_day = 2440587.5
+
+
+def facts_table(name):
+    return f'{name}_facts'
+
+
+def dimension_table(column):
+    # one set of dimensions serves the table and its staging copies
+    return f'{table}_{dimension_columns[column]}'
+
+
+def decode_day(expression):
+    '''
+    SQL text of an epoch day in the DATETIME storage format, same as db_datetime_format
+    '''
+    return f"strftime('%Y-%m-%d %H:%M:%S', {expression} * 86400, 'unixepoch') || '.000000'"
+
+
+def encode_day(expression):
+    return f'CAST(julianday({expression}) - {epoch_julian_day} AS INTEGER)'
+
+
+def fact_layout(info):
+    '''
+    [(column, kind)] of the logical table from the fact table's PRAGMA table_info rows,
+    kind is 'dimension', 'day' or 'value'
+    '''
+    layout = []
+    for row in info:
+        name = row[1]
+        if name.endswith(key_suffix) and name[:-len(key_suffix)] in dimension_columns:
+            layout.append((name[:-len(key_suffix)], 'dimension'))
+        elif name in day_columns:
+            layout.append((name, 'day'))
+        else:
+            layout.append((name, 'value'))
+    return layout
+
+
+def create_dimension_tables(conn):
+    for column in dimension_columns:
+        conn.exec_driver_sql(f'CREATE TABLE IF NOT EXISTS "{dimension_table(column)}" '
+                             f'(id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)')
+
+
+def view_statements(name, facts, layout):
+    '''
+    SQL creating view name over facts, with triggers that encode inserts, updates and deletes through it
+    '''
+    selects, joins = [], []
+    for i, (column, kind) in enumerate(layout):
+        if kind == 'dimension':
+            selects.append(f'd{i}.name AS "{column}"')
+            joins.append(f'LEFT JOIN "{dimension_table(column)}" d{i} ON d{i}.id = f."{column}{key_suffix}"')
+        elif kind == 'day':
+            day = decode_day(f'f."{column}"')
+            selects.append(f'{day} AS "{column}"')
+        else:
+            selects.append(f'f."{column}" AS "{column}"')
+    fact_names, encoded, dimension_inserts = [], [], []
+    for column, kind in layout:
+        if kind == 'dimension':
+            fact_names.append(f'"{column}{key_suffix}"')
+            encoded.append(f'(SELECT id FROM "{dimension_table(column)}" WHERE name = NEW."{column}")')
+            # not OR IGNORE: an INSERT OR REPLACE through the view would turn it into a replace
+            dimension_inserts.append(f'INSERT INTO "{dimension_table(column)}" (name) '
+                                     f'SELECT NEW."{column}" WHERE NEW."{column}" IS NOT NULL AND NOT EXISTS '
+                                     f'(SELECT 1 FROM "{dimension_table(column)}" WHERE name = NEW."{column}");')
+        else:
+            fact_names.append(f'"{column}"')
+            encoded.append(encode_day(f'NEW."{column}"') if kind == 'day' else f'NEW."{column}"')
+    dimension_sql = ' '.join(dimension_inserts)
+    assignments = ', '.join(f'{c} = {e}' for c, e in zip(fact_names, encoded))
+    return [f'CREATE VIEW "{name}" AS SELECT {", ".join(selects)} FROM "{facts}" f {" ".join(joins)}',
+            f'''CREATE TRIGGER "{name}_insert" INSTEAD OF INSERT ON "{name}" BEGIN
+                {dimension_sql}
+                INSERT OR REPLACE INTO "{facts}" ({", ".join(fact_names)}) VALUES ({", ".join(encoded)});
+            END''',
+            f'''CREATE TRIGGER "{name}_update" INSTEAD OF UPDATE ON "{name}" BEGIN
+                {dimension_sql}
+                UPDATE "{facts}" SET {assignments} WHERE "{key_column}" = OLD."{key_column}";
+            END''',
+            f'''CREATE TRIGGER "{name}_delete" INSTEAD OF DELETE ON "{name}" BEGIN
+                DELETE FROM "{facts}" WHERE "{key_column}" = OLD."{key_column}";
+            END''']
+
+
+def drop_storage(name, conn):
+    '''
+    Drop name whether it is a table or a normalized view, with the view's fact table.
+    Names are main's, not the temp view over the shards
+    '''
+    kind = conn.exec_driver_sql('SELECT type FROM main.sqlite_master WHERE name = ?', (name,)).scalar()
+    if kind in ('view', 'table'):
+        conn.exec_driver_sql(f'DROP {kind.upper()} main."{name}"')
+    conn.exec_driver_sql(f'DROP TABLE IF EXISTS main."{facts_table(name)}"')
+
+
+def dimension_keys(column, values, conn):
+    '''
+    {label: key} for values, adding labels the dimension doesn't have yet
+    '''
+    labels = [v for v in pd.unique(values.dropna().astype(str))]
+    if labels:
+        conn.execute(text(f'INSERT OR IGNORE INTO "{dimension_table(column)}" (name) VALUES (:name)'),
+                     [{'name': v} for v in labels])
+    rows = conn.execute(text(f'SELECT name, id FROM "{dimension_table(column)}"')).fetchall()
+    return dict(rows)
+
+
+def encode_frame(df, conn):
+    '''
+    db-named rows with dimension labels replaced by keys and dates by epoch days
+    '''
+    encoded = {}
+    for c in df.columns:
+        if c in dimension_columns:
+            keys = dimension_keys(c, df[c], conn)
+            encoded[f'{c}{key_suffix}'] = df[c].astype(object).map(keys).astype('Int64')
+        elif c in day_columns:
+            days = pd.to_datetime(df[c]).to_numpy(dtype='datetime64[D]')
+            encoded[c] = pd.Series(days.astype('int64'), index=df.index).where(~pd.isna(days)).astype('Int64')
+        else:
+            encoded[c] = df[c]
+    return pd.DataFrame(encoded, index=df.index)
+
+
+def create_storage(df, name, conn):
+    '''
+    Create the fact table and view for name with columns typed from db-named rows df,
+    replacing whatever name was before. Returns the encoded rows
+    '''
+    create_dimension_tables(conn)
+    encoded = encode_frame(df, conn)
+    drop_storage(name, conn)
+    metadata = MetaData()
+    define_table(encoded, facts_table(name), metadata)
+    metadata.create_all(conn)
+    info = conn.exec_driver_sql(f'PRAGMA table_info("{facts_table(name)}")').fetchall()
+    for statement in view_statements(name, facts_table(name), fact_layout(info)):
+        conn.exec_driver_sql(statement)
+    return encoded
+
+
+def write_storage(df, name):
+    '''
+    (Re)create name in normalized storage holding db-named rows df
+    '''
+    with get_engine().begin() as conn:
+        encoded = create_storage(df, name, conn)
+        encoded.to_sql(facts_table(name), conn, if_exists='append', index=False)
+
+
+def swap_storage(staging, name, cursor):
+    '''
+    Move staging's facts under name and rebuild the view, inside the caller's transaction
+    '''
+    for view in (staging, name):
+        kind = cursor.execute('SELECT type FROM sqlite_master WHERE name = ?', (view,)).fetchone()
+        if kind:
+            cursor.execute(f'DROP {kind[0].upper()} "{view}"')
+    cursor.execute(f'DROP TABLE IF EXISTS "{facts_table(name)}"')
+    cursor.execute(f'ALTER TABLE "{facts_table(staging)}" RENAME TO "{facts_table(name)}"')
+    info = cursor.execute(f'PRAGMA table_info("{facts_table(name)}")').fetchall()
+    for statement in view_statements(name, facts_table(name), fact_layout(info)):
+        cursor.execute(statement)
+
+
+def create_fact_indexes(name, conn):
+    '''
+    Filter indexes on the fact table behind view name: dimension keys, decoded dates
+    (matching the view's expressions so date filters can use them) and product names
+    '''
+    facts = facts_table(name)
+    layout = dict(fact_layout(conn.exec_driver_sql(f'PRAGMA table_info("{facts}")').fetchall()))
+    for column in ['Date_Received', 'Last_Order_Date', 'Category', 'Status', 'Product_Name', 'Warehouse_Location']:
+        kind = layout.get(column)
+        if kind == 'dimension':
+            expression = f'"{column}{key_suffix}"'
+        elif kind == 'day':
+            expression = decode_day(f'"{column}"')
+        elif kind == 'value':
+            expression = f'"{column}"'
+        else:
+            continue
+        conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS "ix_{facts}_{column}" ON "{facts}" ({expression})')
+    if {'Restock', 'Revenue'} <= set(layout):
+        conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS "ix_{facts}_restock_revenue" ON "{facts}" ("Revenue") '
+                             f'WHERE "Restock" = 1')
+
+
+def decode_frame(df):
+    '''
+    Dimension columns of query results as pandas categoricals
+    '''
+    for c in dimension_columns:
+        if c in df.columns:
+            df[c] = df[c].astype('category')
+    return df
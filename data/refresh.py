@@ -0,0 +1,174 @@
+import threading
+import traceback
+from datetime import datetime
+import pandas as pd
+from . import config
+from .db import (get_engine, get_data_version, notify_change, has_table, is_sharded, table_columns, to_db_datetime,
+                 table, meta_table, key_column)
+
+# Keeps derived flags current and notices writes made by other processes
+
+flags_key = 'flags_date'
+# Derived columns add_fields computes at ingest, as SQL over the stored columns
+derived_flags = {
+    'Discontinued': '''COALESCE("Status" = 'Discontinued', 0)''',
+    'Low_Stock': 'COALESCE("Stock_Quantity" < "Reorder_Level", 0)',
+    'Expired': 'COALESCE("Expiration_Date" <= :now, 0)',
+    'Restock': '''COALESCE(("Stock_Quantity" < "Reorder_Level" OR "Expiration_Date" <= :now)
+                  AND "Status" = 'Active', 0)''',
+}
+
+
+def day_number(now):
+    '''
+    yyyymmdd integer for the meta table
+    '''
+    return int(now.strftime('%Y%m%d'))
+
+
+def rewrite_flags(raw, flags, params, table=table):
+    '''
+    Update the stale flags of table inside the caller's transaction on raw,
+    returns (rows before, rows after) of the changed products
+    '''
+    cursor = raw.cursor()
+    differs = ' OR '.join(f'"{c}" IS NOT ({e})' for c, e in flags.items())
+    changes = f'{table}_flag_changes'
+    changed_rows = f'SELECT t.* FROM "{table}" t JOIN temp."{changes}" c ON c."{key_column}" = t."{key_column}"'
+    cursor.execute(f'DROP TABLE IF EXISTS temp."{changes}"')
+    try:
+        cursor.execute(f'CREATE TEMP TABLE "{changes}" AS SELECT "{key_column}" FROM "{table}" WHERE {differs}',
+                       params)
+        previous = pd.read_sql(changed_rows, raw.driver_connection)
+        if len(previous):
+            updates = ', '.join(f'"{c}" = {e}' for c, e in flags.items())
+            cursor.execute(f'UPDATE "{table}" SET {updates} WHERE "{key_column}" IN '
+                           f'(SELECT "{key_column}" FROM temp."{changes}")', params)
+        current = pd.read_sql(changed_rows, raw.driver_connection)
+    finally:
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{changes}"')
+    return previous, current
+
+
+def rewrite_shard_flags(flags, params, table=table):
+    '''
+    rewrite_flags on every shard in parallel, each in its own transaction
+    '''
+    from .shards import each_shard
+
+    def rewrite(shard):
+        raw = get_engine().raw_connection()
+        try:
+            raw.cursor().execute('BEGIN IMMEDIATE')
+            result = rewrite_flags(raw, flags, params, table)
+            raw.commit()
+            return result
+        except Exception:
+            raw.rollback()
+            raise
+        finally:
+            raw.close()
+
+    results = list(each_shard(rewrite).values())
+    return (pd.concat([r[0] for r in results], ignore_index=True),
+            pd.concat([r[1] for r in results], ignore_index=True))
+
+
+def recompute_flags(now=None, force=False, table=table):
+    '''
+    Rewrite derived flags that no longer match the stored columns, e.g. Expired once a
+    product's expiration date has passed. Runs at most once per day across every process
+    unless force is set. Returns the number of rows changed, None when it wasn't due
+    '''
+    if not has_table(table):
+        return None
+    now = now or datetime.today()
+    flags = {c: e for c, e in derived_flags.items() if c in table_columns(table)}
+    if not flags:
+        return None
+    params = {'now': to_db_datetime(now)}
+    raw = get_engine().raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS "{meta_table}" (key TEXT PRIMARY KEY, value INTEGER)')
+        row = cursor.execute(f'SELECT value FROM "{meta_table}" WHERE key = ?', (flags_key,)).fetchone()
+        if not force and row and row[0] >= day_number(now):
+            raw.rollback()
+            return None
+        cursor.execute(f'INSERT INTO "{meta_table}" (key, value) VALUES (?, ?) '
+                       f'ON CONFLICT(key) DO UPDATE SET value = excluded.value', (flags_key, day_number(now)))
+        if is_sharded(table):
+            # the shards are written through their own engines, this transaction claims the day
+            previous, current = rewrite_shard_flags(flags, params, table)
+        else:
+            previous, current = rewrite_flags(raw, flags, params, table)
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    if len(current):
+        notify_change(table, current, 'upsert', previous)
+    return len(current)
+
+
+class Refresher:
+    '''
+    Background poll of the data version and the daily flag recompute.
+    Version listeners run for writes made by any process, e.g. the ingest command
+    '''
+
+    def __init__(self, interval=None):
+        self.interval = config.REFRESH_INTERVAL if interval is None else interval
+        self.version = None
+        self.listeners = []
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add_listener(self, listener):
+        '''
+        Register listener(version) to run when the data version moves
+        '''
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+        return listener
+
+    def poll(self):
+        '''
+        One refresh pass, returns the current data version
+        '''
+        recompute_flags()
+        version = get_data_version()
+        if self.version is not None and version != self.version:
+            for listener in list(self.listeners):
+                listener(version)
+        self.version = version
+        return version
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                print(f"Error refreshing data: {traceback.format_exc()}")
+
+    def start(self):
+        if self.thread is None and self.interval > 0:
+            self.version = get_data_version()
+            self.thread = threading.Thread(target=self.run, name='grocery-refresh', daemon=True)
+            self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.stopped.set()
+
+    def current_version(self):
+        '''
+        Last version seen by the poll, queried directly when the refresher isn't running
+        '''
+        return self.version if self.thread is not None else get_data_version()
+
+
+refresher = Refresher()
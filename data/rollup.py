@@ -0,0 +1,194 @@
+from sqlalchemy import text, bindparam
+import pandas as pd
+from .db import get_engine, add_change_listener, has_table, query_db, table
+
+# Partial sums per (Category, Status, Date_Received day, Last_Order_Date day)
+
+rollup_table = f'{table}_rollup'
+rollup_keys = ['Category', 'Status', 'Received_Day', 'Order_Day']
+rollup_measures = ['Row_Count', 'Revenue_Sum', 'Inventory_Value_Sum', 'Turnover_Sum', 'Turnover_Count']
+
+
+def create_rollup_table():
+    '''
+    Create the rollup table if it doesn't exist
+    '''
+    with get_engine().begin() as conn:
+        conn.execute(text(f'''
+            CREATE TABLE IF NOT EXISTS "{rollup_table}" (
+                Category TEXT NOT NULL,
+                Status TEXT NOT NULL,
+                Received_Day TEXT NOT NULL,
+                Order_Day TEXT NOT NULL,
+                Row_Count INTEGER NOT NULL,
+                Revenue_Sum FLOAT NOT NULL,
+                Inventory_Value_Sum FLOAT NOT NULL,
+                Turnover_Sum FLOAT NOT NULL,
+                Turnover_Count INTEGER NOT NULL,
+                PRIMARY KEY (Category, Status, Received_Day, Order_Day)
+            )'''))
+
+
+def build_rollup(source=table):
+    '''
+    Rebuild the rollup from every row of source
+    '''
+    create_rollup_table()
+    with get_engine().begin() as conn:
+        conn.execute(text(f'DELETE FROM "{rollup_table}"'))
+        conn.execute(text(f'''
+            INSERT INTO "{rollup_table}"
+            SELECT Category,
+                   COALESCE(Status, ''),
+                   COALESCE(date(Date_Received), ''),
+                   COALESCE(date(Last_Order_Date), ''),
+                   COUNT(*),
+                   COALESCE(SUM(Revenue), 0),
+                   COALESCE(SUM(Inventory_Value), 0),
+                   COALESCE(SUM(Inventory_Turnover_Rate), 0),
+                   COUNT(Inventory_Turnover_Rate)
+            FROM "{source}"
+            WHERE Category IS NOT NULL
+            GROUP BY 1, 2, 3, 4'''))
+
+
+def frame_to_rollup(df):
+    '''
+    Aggregate db-named rows into rollup records
+    '''
+    df = df.loc[df['Category'].notna()]
+    day = lambda c: pd.to_datetime(df[c]).dt.strftime('%Y-%m-%d').fillna('')
+    parts = pd.DataFrame({'Category': df['Category'].astype(object),
+                          'Status': df['Status'].astype(object).fillna(''),
+                          'Received_Day': day('Date_Received'),
+                          'Order_Day': day('Last_Order_Date'),
+                          'Revenue_Sum': df['Revenue'].fillna(0),
+                          'Inventory_Value_Sum': df['Inventory_Value'].fillna(0),
+                          'Turnover_Sum': df['Inventory_Turnover_Rate'].fillna(0),
+                          'Turnover_Count': df['Inventory_Turnover_Rate'].notna().astype(int)})
+    grouped = parts.groupby(rollup_keys, as_index=False)
+    out = grouped.sum()
+    out['Row_Count'] = grouped.size()['size'].values
+    return out[rollup_keys + rollup_measures]
+
+
+def apply_rollup_delta(df, sign=1):
+    '''
+    Add (sign=1) or remove (sign=-1) rows from the rollup without a rebuild
+    '''
+    records = frame_to_rollup(df)
+    if records.empty:
+        return
+    records[rollup_measures] *= sign
+    create_rollup_table()
+    updates = ', '.join(f'{m} = {m} + excluded.{m}' for m in rollup_measures)
+    columns = rollup_keys + rollup_measures
+    with get_engine().begin() as conn:
+        conn.execute(text(f'''
+            INSERT INTO "{rollup_table}" ({', '.join(columns)})
+            VALUES ({', '.join(':' + c for c in columns)})
+            ON CONFLICT ({', '.join(rollup_keys)}) DO UPDATE SET {updates}'''),
+            records.to_dict(orient='records'))
+        if sign < 0:
+            conn.execute(text(f'DELETE FROM "{rollup_table}" WHERE Row_Count <= 0'))
+
+
+def on_table_change(changed, df, mode, previous=None):
+    '''
+    Keep the rollup in step with writes to the grocery table
+    '''
+    if changed != table:
+        return
+    if mode in ('append', 'upsert') and df is not None and has_table(rollup_table):
+        if previous is not None and not previous.empty:
+            apply_rollup_delta(previous, -1)
+        apply_rollup_delta(df)
+    else:
+        build_rollup()
+
+
+add_change_listener(on_table_change)
+
+
+def ensure_rollup():
+    '''
+    Build the rollup if it is missing or out of step with the source table
+    '''
+    if not has_table(table):
+        return
+    if has_table(rollup_table):
+        counts = query_db(f'SELECT (SELECT COALESCE(SUM(Row_Count), 0) FROM "{rollup_table}") AS rolled, '
+                          f'(SELECT COUNT(*) FROM "{table}" WHERE Category IS NOT NULL) AS source')
+        if counts['rolled'].iloc[0] == counts['source'].iloc[0]:
+            return
+    build_rollup()
+
+
+def is_whole_day(value):
+    ts = pd.Timestamp(value)
+    return ts == ts.normalize()
+
+
+def can_use_rollup(rec_start_date=None, rec_end_date=None, order_start_date=None, order_end_date=None,
+                   products=None):
+    '''
+    Rollup answers filters on whole days without a product selection
+    '''
+    if products:
+        return False
+    return all(is_whole_day(d) for d in [rec_start_date, rec_end_date, order_start_date, order_end_date] if d)
+
+
+def rollup_where(rec_start_date=None, rec_end_date=None, order_start_date=None, order_end_date=None,
+                 categories=None, statuses=None):
+    '''
+    WHERE clause, params and expanding binds over the rollup keys
+    '''
+    clauses = ['1 = 1']
+    params = {}
+    binds = []
+    for col, start, end, key in [('Received_Day', rec_start_date, rec_end_date, 'rec'),
+                                 ('Order_Day', order_start_date, order_end_date, 'order')]:
+        # same semantics as db.build_filter_query, at day granularity
+        if end:
+            clauses.append(f"{col} != '' AND {col} <= :{key}_end")
+            params[f'{key}_end'] = pd.Timestamp(end).strftime('%Y-%m-%d')
+            if start:
+                clauses.append(f'{col} >= :{key}_start')
+                params[f'{key}_start'] = pd.Timestamp(start).strftime('%Y-%m-%d')
+    for col, values, key in [('Category', categories, 'categories'), ('Status', statuses, 'statuses')]:
+        if values:
+            clauses.append(f'{col} IN :{key}')
+            params[key] = list(values)
+            binds.append(bindparam(key, expanding=True))
+    return ' AND '.join(clauses), params, binds
+
+
+def rollup_query(select, rec_start_date=None, rec_end_date=None, order_start_date=None, order_end_date=None,
+                 categories=None, statuses=None, suffix=''):
+    where, params, binds = rollup_where(rec_start_date, rec_end_date, order_start_date, order_end_date,
+                                        categories, statuses)
+    query = text(f'SELECT {select} FROM "{rollup_table}" WHERE {where} {suffix}')
+    if binds:
+        query = query.bindparams(*binds)
+    return query_db(query, params)
+
+
+def rollup_kpis(*filters):
+    '''
+    (total revenue, total inventory value, mean turnover) for the filters
+    '''
+    row = rollup_query('SUM(Revenue_Sum) AS revenue, SUM(Inventory_Value_Sum) AS inventory, '
+                       'SUM(Turnover_Sum) AS turnover, SUM(Turnover_Count) AS turnover_count', *filters).iloc[0]
+    revenue = row['revenue'] if pd.notna(row['revenue']) else 0.0
+    inventory = row['inventory'] if pd.notna(row['inventory']) else 0.0
+    turnover = row['turnover'] / row['turnover_count'] if row['turnover_count'] else float('nan')
+    return revenue, inventory, turnover
+
+
+def rollup_sales_per_category(*filters):
+    '''
+    Revenue per Category for the filters, largest first
+    '''
+    return rollup_query('Category, SUM(Revenue_Sum) AS Revenue', *filters,
+                        suffix='GROUP BY Category ORDER BY Revenue DESC')
@@ -0,0 +1,420 @@
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import pathname2url
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, event, text
+from . import config
+from .db import (get_engine, create_db_engine, dispose_engine, using_engine, write_table, create_indexes, apply_upsert,
+                 filter_clauses, query_db, notify_change, has_table, table, meta_table, key_column)
+from .normalized import drop_storage
+from .topk import RankedCell, merge_top
+
+# Per-warehouse sharding: the grocery rows live in SHARDS SQLite files picked by a hash of
+# Warehouse_Location, each written through its own engine so loads of different warehouses
+# take different file locks. The main database attaches the files read-only under a temp
+# UNION ALL view named like the table, so readers elsewhere see one table, while the
+# dashboard aggregates fan out across the files and merge their partial results.
+
+shard_column = 'Warehouse_Location'
+shards_key = 'shards'
+_engines = {}
+_engines_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def shard_of(warehouse):
+    '''
+    Shard holding warehouse's rows, the same in every process
+    '''
+    if warehouse is None or pd.isna(warehouse):
+        return 0
+    return zlib.crc32(str(warehouse).encode()) % config.SHARDS
+
+
+def shards_of(warehouses):
+    '''
+    Shards holding the selected warehouses, None (every shard) when nothing is selected
+    '''
+    if not warehouses:
+        return None
+    if isinstance(warehouses, str):
+        warehouses = [warehouses]
+    return {shard_of(w) for w in warehouses}
+
+
+def shard_index(df):
+    '''
+    Shard of each row of df, as an array
+    '''
+    if shard_column not in df.columns:
+        return np.zeros(len(df), dtype=int)
+    codes, labels = pd.factorize(df[shard_column].astype(object))
+    routes = np.array([shard_of(w) for w in labels] + [0], dtype=int)
+    return routes[codes]  # missing warehouses have code -1, the trailing 0
+
+
+def shard_rows(df):
+    '''
+    {shard: rows of df routed to it} for every shard
+    '''
+    shard = shard_index(df)
+    return {i: df[shard == i] for i in range(config.SHARDS)}
+
+
+def shard_path(i):
+    return os.path.join(config.SHARD_DIR, f'{table}_{i:02d}.db')
+
+
+def shard_schema(i):
+    return f'shard_{i}'
+
+
+def shard_engine(i):
+    '''
+    Pooled engine writing shard i's file
+    '''
+    engine = _engines.get(i)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(i)
+            if engine is None:
+                os.makedirs(config.SHARD_DIR, exist_ok=True)
+                engine = _engines[i] = create_db_engine(shard_path(i))
+    return engine
+
+
+def dispose_shard_engines():
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(config.SHARD_WORKERS or config.SHARDS, thread_name_prefix='grocery-shard')
+    return _pool
+
+
+def each_shard(function, shards=None):
+    '''
+    {shard: function(shard)} over shards (default all) on the shard threads, the db
+    functions function calls work on that shard's file
+    '''
+    shards = range(config.SHARDS) if shards is None else sorted(shards)
+
+    def run(i):
+        with using_engine(shard_engine(i)):
+            return function(i)
+
+    return dict(zip(shards, get_pool().map(run, shards)))
+
+
+def attach_shards(engine):
+    '''
+    Give the main engine's connections the shards, attached read-only, and the temp view
+    over them once every shard holds the table
+    '''
+    check_storage()
+    @event.listens_for(engine, 'checkout')
+    def attach(dbapi_connection, connection_record, connection_proxy):
+        info = connection_record.info
+        if info.get('shard_view'):
+            return
+        attached = info.setdefault('shards', set())
+        cursor = dbapi_connection.cursor()
+        try:
+            for i in range(config.SHARDS):
+                if i not in attached and os.path.exists(shard_path(i)):
+                    uri = f'file:{pathname2url(shard_path(i))}?mode=ro'
+                    cursor.execute(f'ATTACH DATABASE ? AS {shard_schema(i)}', (uri,))
+                    attached.add(i)
+            if len(attached) < config.SHARDS:
+                return
+            for i in range(config.SHARDS):
+                if not cursor.execute(f'SELECT 1 FROM {shard_schema(i)}.sqlite_master WHERE name = ?',
+                                      (table,)).fetchone():
+                    return
+            union = ' UNION ALL '.join(f'SELECT * FROM {shard_schema(i)}."{table}"' for i in range(config.SHARDS))
+            cursor.execute(f'CREATE TEMP VIEW IF NOT EXISTS "{table}" AS {union}')
+            info['shard_view'] = True
+        finally:
+            cursor.close()
+
+
+def write_shards(df, name=table):
+    '''
+    (Re)create name in every shard from db-named rows df, each shard in one transaction
+    on its own thread. Returns df
+    '''
+    parts = shard_rows(df)
+    each_shard(lambda i: write_table(parts[i], name))
+    return df
+
+
+def remove_rows(ids, name=table):
+    '''
+    Delete the products in ids from name, returns the deleted rows
+    '''
+    moved = f'{name}_moved'
+    raw = get_engine().raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{moved}"')
+        cursor.execute(f'CREATE TEMP TABLE "{moved}" ("{key_column}" PRIMARY KEY)')
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.executemany(f'INSERT OR IGNORE INTO temp."{moved}" VALUES (?)', [(i,) for i in ids])
+        removed = pd.read_sql(f'SELECT t.* FROM "{name}" t JOIN temp."{moved}" m '
+                              f'ON m."{key_column}" = t."{key_column}"', raw.driver_connection)
+        cursor.execute(f'DELETE FROM "{name}" WHERE "{key_column}" IN (SELECT "{key_column}" FROM temp."{moved}")')
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{moved}"')
+        raw.close()
+    return removed
+
+
+def stored_warehouses(ids, name=table):
+    '''
+    Product_ID and Warehouse_Location of the stored products in ids, one lookup over the
+    attached shards
+    '''
+    wanted = f'{name}_wanted'
+    raw = get_engine().raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{wanted}"')
+        cursor.execute(f'CREATE TEMP TABLE "{wanted}" ("{key_column}" PRIMARY KEY)')
+        cursor.executemany(f'INSERT OR IGNORE INTO temp."{wanted}" VALUES (?)', [(i,) for i in ids])
+        return pd.read_sql(f'SELECT t."{key_column}", t."{shard_column}" FROM "{name}" t '
+                           f'JOIN temp."{wanted}" w ON w."{key_column}" = t."{key_column}"', raw.driver_connection)
+    finally:
+        cursor.execute(f'DROP TABLE IF EXISTS temp."{wanted}"')
+        raw.close()
+
+
+def upsert_shards(df, name=table):
+    '''
+    apply_upsert for db-named rows df split by shard, the shards in parallel. Products whose
+    warehouse now routes to another shard are removed from the old one, rows without a
+    warehouse column stay in their product's shard.
+    Returns (counts, rows before, rows after) of the changed products
+    '''
+    stored = stored_warehouses(df[key_column].tolist(), name)
+    was = pd.Series(shard_index(stored), index=stored[key_column])
+    if shard_column in df.columns:
+        shard = shard_index(df)
+    else:
+        shard = df[key_column].map(was).fillna(0).astype(int).to_numpy()
+    parts = {i: df[shard == i] for i in range(config.SHARDS)}
+    now = pd.Series(shard, index=df[key_column]).reindex(was.index)
+    moved = was[was != now]
+    # only the shards products moved out of have rows to delete
+    leaving = {i: ids.index.tolist() for i, ids in moved.groupby(moved)}
+
+    def upsert(i):
+        removed = remove_rows(leaving[i], name) if i in leaving else None
+        if parts[i].empty:
+            return None, removed
+        return apply_upsert(parts[i], name), removed
+
+    results = list(each_shard(upsert, set(leaving) | {i for i, part in parts.items() if len(part)}).values())
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    previous, current = [], []
+    for upserted, removed in results:
+        if upserted is not None:
+            for k, v in upserted[0].items():
+                counts[k] += v
+            previous.append(upserted[1])
+            current.append(upserted[2])
+        if removed is not None and len(removed):
+            # a moved product is inserted into its new shard, count it as updated
+            counts['inserted'] -= len(removed)
+            counts['updated'] += len(removed)
+            previous.append(removed)
+    previous = pd.concat(previous, ignore_index=True) if previous else pd.DataFrame()
+    current = pd.concat(current, ignore_index=True) if current else pd.DataFrame()
+    return counts, previous, current
+
+
+def stored_shard_count():
+    '''
+    Shard count the grocery rows were last written with, 0 for one table
+    '''
+    with get_engine().connect() as conn:
+        if not conn.execute(text("SELECT 1 FROM main.sqlite_master WHERE name = :name"), {'name': meta_table}).scalar():
+            return 0
+        row = conn.execute(text(f'SELECT value FROM main."{meta_table}" WHERE key = :key'), {'key': shards_key}).fetchone()
+    return row[0] if row else 0
+
+
+def store_shard_count(count):
+    with get_engine().begin() as conn:
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS main."{meta_table}" (key TEXT PRIMARY KEY, value INTEGER)'))
+        conn.execute(text(f'''INSERT INTO main."{meta_table}" (key, value) VALUES (:key, :value)
+                              ON CONFLICT(key) DO UPDATE SET value = excluded.value'''),
+                     {'key': shards_key, 'value': count})
+
+
+def check_storage():
+    '''
+    Raise ValueError for settings the shards can't be written with
+    '''
+    if config.SHARDS > 10:
+        raise ValueError(f"GROCERY_SHARDS={config.SHARDS}: SQLite attaches at most 10 shard files")
+    if config.SHARDS > 0 and config.STORAGE == 'normalized':
+        # each shard would get its own dimension tables behind a view the main database can't read
+        raise ValueError("GROCERY_SHARDS needs GROCERY_STORAGE=wide, normalized storage can't be sharded")
+
+
+def read_stored_rows(count):
+    '''
+    Every grocery row as written with count shards, from the table or normalized view of the
+    main database when count is 0. None when there are none
+    '''
+    if not count:
+        with get_engine().connect() as conn:
+            if not conn.execute(text("SELECT 1 FROM main.sqlite_master WHERE type IN ('table', 'view') "
+                                     "AND name = :name"), {'name': table}).scalar():
+                return None
+            return pd.read_sql(f'SELECT * FROM main."{table}"', conn)
+    parts = []
+    for i in range(count):
+        if os.path.exists(shard_path(i)):
+            with using_engine(shard_engine(i)):
+                if has_table(table):
+                    parts.append(query_db(f'SELECT * FROM "{table}"'))
+    return pd.concat(parts, ignore_index=True) if parts else None
+
+
+def ensure_shards():
+    '''
+    Move the grocery rows into the configured shards when sharding was turned on or the
+    shard count changed since they were written, or back into one table when it was
+    turned off. Returns True when rows were moved
+    '''
+    check_storage()
+    count = stored_shard_count()
+    if count == config.SHARDS:
+        return False
+    print(f"Moving {table} from {count or 'no'} shards to {config.SHARDS or 'one table'}")
+    rows = read_stored_rows(count)
+    if rows is not None:
+        write_table(rows, table)
+        create_indexes(table)
+    if count:
+        dispose_shard_engines()
+        for i in range(config.SHARDS, count):
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(shard_path(i) + suffix):
+                    os.remove(shard_path(i) + suffix)
+    elif rows is not None:
+        with get_engine().begin() as conn:
+            drop_storage(table, conn)
+    # only now that the rows are in their new home, or there were none to move
+    store_shard_count(config.SHARDS)
+    # connections attached the old shard files
+    dispose_engine()
+    if rows is not None:
+        notify_change(table, rows, 'replace')
+    return rows is not None
+
+
+def shard_partial(filters, warehouses):
+    '''
+    (KPI sums, revenue per Category) of this shard's rows matching the filters
+    '''
+    clauses, params, binds = filter_clauses(*filters, warehouses)
+    query = text(f'''SELECT Category, COALESCE(SUM(Revenue), 0) AS Revenue, SUM(Inventory_Value) AS Inventory_Value,
+                            SUM(Inventory_Turnover_Rate) AS Turnover, COUNT(Inventory_Turnover_Rate) AS Turnover_Count
+                     FROM "{table}" WHERE {' AND '.join(clauses)} GROUP BY Category''')
+    if binds:
+        query = query.bindparams(*binds)
+    rows = query_db(query, params)
+    rows['Revenue'] = rows['Revenue'].astype(float)
+    sums = (rows['Revenue'].sum(), rows['Inventory_Value'].astype(float).sum(),
+            rows['Turnover'].astype(float).sum(), int(rows['Turnover_Count'].sum()))
+    return sums, rows.set_index('Category')['Revenue']
+
+
+def shard_products(filters, warehouses, depth=None, names=None):
+    '''
+    Revenue per product of this shard's rows matching the filters as a ranked cell: the top
+    depth products, with rest set when there may be more, or only the products in names,
+    left out of the ranking
+    '''
+    clauses, params, binds = filter_clauses(*filters, warehouses)
+    clauses.append('Product_Name IS NOT NULL')
+    limit = ''
+    if names is not None:
+        clauses.append('Product_Name IN :names')
+        params['names'] = list(names)
+        binds.append(bindparam('names', expanding=True))
+    else:
+        limit = 'ORDER BY Revenue DESC, Product_Name LIMIT :depth'
+        params['depth'] = depth
+    query = text(f'''SELECT Product_Name, COALESCE(SUM(Revenue), 0) AS Revenue FROM "{table}"
+                     WHERE {' AND '.join(clauses)} GROUP BY Product_Name {limit}''')
+    if binds:
+        query = query.bindparams(*binds)
+    rows = query_db(query, params)
+    cell = RankedCell()
+    cell.totals = {p: (float(r), 1) for p, r in zip(rows['Product_Name'], rows['Revenue'])}
+    if names is None:
+        cell.ranking = sorted((-r, p) for p, (r, _) in cell.totals.items())
+        if len(cell.ranking) == depth:
+            cell.rest = cell.ranking[-1][0]
+    return cell
+
+
+def merge_shard_top(filters, warehouses, shards, k):
+    '''
+    [(product, revenue)] top k across shards. Each shard sends its top k products, the ones
+    a shard cut off are looked up there, and the cut off shards are asked for twice as many
+    until the merged k-th total beats anything they may still hold (see merge_top)
+    '''
+    depth = k
+    cells = each_shard(lambda i: shard_products(filters, warehouses, depth=depth), shards)
+    while True:
+        candidates = set().union(*(cell.totals for cell in cells.values()))
+        missing = {i: candidates.difference(cell.totals) for i, cell in cells.items() if cell.rest}
+        found = each_shard(lambda i: shard_products(filters, warehouses, names=missing[i]),
+                           [i for i in missing if missing[i]])
+        for i, cell in found.items():
+            cells[i].totals.update(cell.totals)
+        ranked = [cell for cell in cells.values() if cell.ranking]
+        top = merge_top(ranked, k) if ranked else []
+        cut = [i for i, cell in cells.items() if cell.rest]
+        if not cut or (len(top) == k and top[-1][1] >= -sum(cells[i].rest for i in cut)):
+            return top
+        depth *= 2
+        cells.update(each_shard(lambda i: shard_products(filters, warehouses, depth=depth), cut))
+
+
+def query_shards(rec_start_date=None, rec_end_date=None, order_start_date=None, order_end_date=None,
+                 categories=None, products=None, statuses=None, warehouses=None, k=None):
+    '''
+    ((total revenue, total inventory value, mean turnover), revenue per Category largest first,
+    [(product, revenue)] top k) for the dashboard filters, merged from partial aggregates
+    computed in parallel on the shards holding the selected warehouses
+    '''
+    k = k or config.TOP_PRODUCTS
+    filters = (rec_start_date, rec_end_date, order_start_date, order_end_date, categories, products, statuses)
+    shards = shards_of(warehouses)
+    partials = list(each_shard(lambda i: shard_partial(filters, warehouses), shards).values())
+    revenue, inventory, turnover, turnover_count = (sum(p[0][j] for p in partials) for j in range(4))
+    kpis = (revenue, inventory, turnover / turnover_count if turnover_count else float('nan'))
+    per_category = pd.concat([p[1] for p in partials])
+    per_category = per_category.groupby(level=0).sum().sort_values(ascending=False).rename('Revenue')
+    top = merge_shard_top(filters, warehouses, shards, k)
+    return kpis, per_category.rename_axis('Category').reset_index(), top
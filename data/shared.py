@@ -0,0 +1,220 @@
+import glob
+import json
+import os
+import threading
+import time
+import traceback
+import numpy as np
+import pandas as pd
+from . import config
+from .db import get_data_version, add_version_listener, dashboard_columns, table
+from .snapshot import load_frame
+
+# Dashboard columns published once as a memory-mapped Arrow file, attached read-only by every worker.
+# Each publish writes a new generation file, then atomically repoints current.json at it.
+
+shared_columns = ['Date_Received', 'Last_Order_Date', 'Category', 'Product_Name', 'Status',
+                  'Revenue', 'Inventory_Value', 'Inventory_Turnover_Rate']
+pointer_name = 'current.json'
+# pending background publish, see schedule_publish
+_timer = None
+_timer_lock = threading.Lock()
+
+
+def pointer_path(directory=None):
+    return os.path.join(directory or config.SHARED_DIR, pointer_name)
+
+
+def shared_arrays(df):
+    '''
+    Arrow arrays for the shared columns, laid out so attaching is zero-copy:
+    strings dictionary encoded, numbers as float64 with NaN rather than nulls
+    '''
+    import pyarrow as pa
+    arrays = {}
+    for c in shared_columns:
+        values = df[c]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            arrays[c] = pa.array(values.to_numpy())
+        elif pd.api.types.is_numeric_dtype(values):
+            arrays[c] = pa.array(values.to_numpy(dtype='float64', na_value=np.nan), from_pandas=False)
+        else:
+            arrays[c] = pa.array(values.astype('category'))
+    return pa.table(arrays)
+
+
+def read_shared_source():
+    '''
+    Shared columns of every dashboard row, from the snapshot when it is current
+    '''
+    df = load_frame(shared_columns)
+    return df[df['Category'].notna()].reset_index(drop=True)
+
+
+def publish(df=None, version=None, directory=None):
+    '''
+    Write a new generation of the shared dataset and point current.json at it.
+    Returns the pointer contents
+    '''
+    import pyarrow as pa
+    directory = directory or config.SHARED_DIR
+    os.makedirs(directory, exist_ok=True)
+    version = get_data_version() if version is None else version
+    shared = shared_arrays(read_shared_source() if df is None else df)
+    name = f'gen-{version}-{os.getpid()}-{time.time_ns()}.arrow'
+    path = os.path.join(directory, name)
+    # a single record batch keeps every column contiguous, which to_pandas needs to avoid copying
+    with pa.OSFile(f'{path}.tmp', 'wb') as sink:
+        with pa.ipc.new_file(sink, shared.schema) as writer:
+            writer.write_table(shared, max_chunksize=max(shared.num_rows, 1))
+    os.replace(f'{path}.tmp', path)
+    pointer = {'generation': name, 'data_version': version, 'rows': shared.num_rows, 'published': time.time()}
+    with open(f'{pointer_path(directory)}.{os.getpid()}.tmp', 'w') as f:
+        json.dump(pointer, f, indent=2)
+    os.replace(f'{pointer_path(directory)}.{os.getpid()}.tmp', pointer_path(directory))
+    remove_old_generations(directory)
+    return pointer
+
+
+def remove_old_generations(directory=None, keep=None):
+    '''
+    Delete all but the newest keep generation files, workers still attached to one keep their mapping
+    '''
+    directory = directory or config.SHARED_DIR
+    keep = config.SHARED_KEEP_GENERATIONS if keep is None else keep
+    files = sorted(glob.glob(os.path.join(directory, 'gen-*.arrow')), key=os.path.getmtime)
+    for path in files[:-keep] if keep else files:
+        try:
+            os.remove(path)
+        except OSError:
+            # still mapped on platforms that lock open files
+            pass
+
+
+def read_pointer(directory=None):
+    '''
+    current.json contents, None before the first publish
+    '''
+    try:
+        with open(pointer_path(directory)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def publish_if_stale(directory=None):
+    '''
+    Publish when there is no generation yet or it predates the current data version
+    '''
+    pointer = read_pointer(directory)
+    if pointer is None or pointer['data_version'] != get_data_version() \
+            or not os.path.exists(os.path.join(directory or config.SHARED_DIR, pointer['generation'])):
+        return publish(directory=directory)
+    return pointer
+
+
+class SharedDataset:
+    '''
+    Read-only view of the current generation, reattached when current.json changes
+    '''
+
+    def __init__(self, directory=None):
+        self.directory = directory or config.SHARED_DIR
+        self.lock = threading.Lock()
+        self.pointer_stat = None
+        self.generation = None
+        self.version = None
+        self.frame = None
+
+    def attach(self, name):
+        import pyarrow as pa
+        source = pa.memory_map(os.path.join(self.directory, name), 'r')
+        shared = pa.ipc.open_file(source).read_all()
+        # columns stay backed by the mapped file, only dictionaries are copied
+        return shared.to_pandas(split_blocks=True, self_destruct=False)
+
+    def get_frame(self):
+        '''
+        DataFrame of the current generation, None before anything was published
+        '''
+        try:
+            stat = os.stat(pointer_path(self.directory))
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if key != self.pointer_stat:
+            with self.lock:
+                if key != self.pointer_stat:
+                    pointer = read_pointer(self.directory)
+                    if pointer and pointer['generation'] != self.generation:
+                        self.frame = self.attach(pointer['generation'])
+                        self.generation = pointer['generation']
+                        self.version = pointer['data_version']
+                    self.pointer_stat = key
+        return self.frame
+
+    def current_frame(self):
+        '''
+        DataFrame of the current generation when it holds the current data version, else None
+        '''
+        df = self.get_frame()
+        return df if df is not None and self.version == get_data_version() else None
+
+
+shared_dataset = SharedDataset()
+
+
+def filter_shared(rec_start_date=None, rec_end_date=None, order_start_date=None, order_end_date=None,
+                  categories=None, products=None, statuses=None, columns=None):
+    '''
+    Same rows as db.query_filtered, answered from the shared dataset.
+    None when no generation of the current data has been published yet
+    '''
+    df = shared_dataset.current_frame()
+    if df is None:
+        return None
+    mask = np.ones(len(df), dtype=bool)
+    for col, start, end in [('Date_Received', rec_start_date, rec_end_date),
+                            ('Last_Order_Date', order_start_date, order_end_date)]:
+        if end:
+            mask &= (df[col] <= pd.Timestamp(end)).to_numpy()
+            if start:
+                mask &= (df[col] >= pd.Timestamp(start)).to_numpy()
+    for col, values in [('Category', categories), ('Product_Name', products), ('Status', statuses)]:
+        if values:
+            mask &= df[col].isin(values).to_numpy()
+    return df.loc[mask, columns or dashboard_columns]
+
+
+def publish_scheduled():
+    global _timer
+    with _timer_lock:
+        _timer = None
+    try:
+        publish_if_stale()
+    except Exception:
+        print(f"Error publishing the shared dataset: {traceback.format_exc()}")
+
+
+def schedule_publish():
+    '''
+    Publish a new generation on a background thread SHARED_DELAY seconds from now, once for
+    however many writes land in between
+    '''
+    global _timer
+    with _timer_lock:
+        if _timer is None:
+            _timer = threading.Timer(config.SHARED_DELAY, publish_scheduled)
+            _timer.daemon = True
+            _timer.start()
+
+
+def on_version_change(changed, version):
+    '''
+    Publish a new generation from the process that wrote the data, off the writer's thread
+    '''
+    if changed == table and config.SHARED_DATASET:
+        schedule_publish()
+
+
+add_version_listener(on_version_change)
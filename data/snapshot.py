@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+import pandas as pd
+from . import config
+from .data import category_cols
+from .db import (query_db, get_data_version, add_version_listener, write_table, create_indexes, notify_change,
+                 db_datetime_format, table)
+
+# Arrow IPC snapshot of the grocery table, memory-mapped on load.
+# A JSON sidecar records the data version it was written at plus the file's size, mtime and checksum.
+
+snapshot_format = 1
+date_columns = ['Date_Received', 'Last_Order_Date', 'Expiration_Date']
+bool_columns = ['Discontinued', 'Low_Stock', 'Expired', 'Restock']
+_deferred = False
+# pending background rewrite, see schedule_snapshot
+_timer = None
+_timer_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def metadata_path(path=None):
+    return f'{path or config.SNAPSHOT_PATH}.json'
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    '''
+    sha256 of a file, read in chunks
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def typed_frame(df):
+    '''
+    Restore pandas dtypes for rows read back from SQLite
+    '''
+    for c in date_columns:
+        if c in df.columns:
+            df[c] = pd.to_datetime(df[c], format=db_datetime_format)
+    for c in bool_columns:
+        if c in df.columns:
+            df[c] = df[c].astype('boolean' if df[c].isna().any() else bool)
+    for c in category_cols:
+        if c in df.columns:
+            df[c] = df[c].astype('category')
+    return df
+
+
+def read_table_frame():
+    '''
+    Every row of the grocery table with pandas dtypes
+    '''
+    return typed_frame(query_db(f'SELECT * FROM "{table}"'))
+
+
+def write_snapshot(df=None, version=None, path=None):
+    '''
+    Write df (default: the whole table) as an uncompressed Arrow IPC file plus its sidecar.
+    Both files are replaced atomically. Returns the sidecar metadata
+    '''
+    import pyarrow.feather as feather
+    path = path or config.SNAPSHOT_PATH
+    version = get_data_version() if version is None else version
+    df = read_table_frame() if df is None else df
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with _write_lock:
+        feather.write_feather(df, tmp, compression='uncompressed')
+        os.replace(tmp, path)
+        stat = os.stat(path)
+        meta = {'format': snapshot_format, 'table': table, 'data_version': version, 'rows': len(df),
+                'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_checksum(path),
+                'written': time.time()}
+        with open(f'{metadata_path(path)}.{os.getpid()}.tmp', 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(f'{metadata_path(path)}.{os.getpid()}.tmp', metadata_path(path))
+    return meta
+
+
+def read_metadata(path=None):
+    '''
+    Sidecar metadata, None when missing or unreadable
+    '''
+    try:
+        with open(metadata_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_matches_file(meta, path=None):
+    '''
+    Sidecar describes the snapshot file on disk: format, size, mtime and optionally checksum
+    '''
+    path = path or config.SNAPSHOT_PATH
+    if not meta or meta.get('format') != snapshot_format or not os.path.exists(path):
+        return False
+    stat = os.stat(path)
+    if (stat.st_size, stat.st_mtime_ns) != (meta['size'], meta['mtime_ns']):
+        return False
+    return not config.SNAPSHOT_VERIFY_CHECKSUM or file_checksum(path) == meta['sha256']
+
+
+def snapshot_is_current(path=None):
+    '''
+    Snapshot is intact and was written at the database's current data version
+    '''
+    meta = read_metadata(path)
+    return snapshot_matches_file(meta, path) and meta['data_version'] == get_data_version()
+
+
+def read_snapshot(path=None):
+    '''
+    Memory-mapped pyarrow Table of the snapshot, columns stay backed by the file
+    '''
+    import pyarrow as pa
+    source = pa.memory_map(path or config.SNAPSHOT_PATH, 'r')
+    return pa.ipc.open_file(source).read_all()
+
+
+def load_frame(columns=None):
+    '''
+    The grocery table with pandas dtypes (only columns when given), from the snapshot
+    when it is current, otherwise from SQLite, rewriting a stale snapshot on the way
+    '''
+    if not config.SNAPSHOT_ENABLED:
+        select = ', '.join(f'"{c}"' for c in columns) if columns else '*'
+        return typed_frame(query_db(f'SELECT {select} FROM "{table}"'))
+    if snapshot_is_current():
+        snapshot = read_snapshot()
+        return (snapshot.select(columns) if columns else snapshot).to_pandas()
+    # the version before the read, a write in between leaves the snapshot stale rather than wrong
+    version = get_data_version()
+    df = read_table_frame()
+    write_snapshot(df, version)
+    return df[columns] if columns else df
+
+
+def ensure_snapshot():
+    '''
+    Rebuild a missing or stale snapshot
+    '''
+    if config.SNAPSHOT_ENABLED and not snapshot_is_current():
+        write_snapshot()
+
+
+def restore_from_snapshot():
+    '''
+    Recreate the grocery table from an intact snapshot, e.g. when data.db was deleted.
+    Returns True when the table was restored
+    '''
+    if not snapshot_matches_file(read_metadata()):
+        return False
+    df = read_snapshot().to_pandas()
+    df = write_table(df, table)
+    create_indexes(table)
+    notify_change(table, df, 'create')
+    return True
+
+
+def write_scheduled():
+    global _timer
+    with _timer_lock:
+        _timer = None
+    try:
+        ensure_snapshot()
+    except Exception:
+        print(f"Error writing snapshot: {traceback.format_exc()}")
+
+
+def schedule_snapshot():
+    '''
+    Rewrite the snapshot on a background thread SNAPSHOT_DELAY seconds from now, once for
+    however many writes land in between
+    '''
+    global _timer
+    with _timer_lock:
+        if _timer is None:
+            _timer = threading.Timer(config.SNAPSHOT_DELAY, write_scheduled)
+            _timer.daemon = True
+            _timer.start()
+
+
+def on_version_change(changed, version):
+    '''
+    Schedule a snapshot rewrite after writes to the grocery table, off the writer's thread.
+    Without a delay the next load_frame rewrites it
+    '''
+    if changed == table and config.SNAPSHOT_ENABLED and config.SNAPSHOT_DELAY > 0 and not _deferred:
+        schedule_snapshot()
+
+
+@contextmanager
+def defer_snapshots():
+    '''
+    Write the snapshot once after a batch of writes instead of after each one
+    '''
+    global _deferred
+    _deferred = True
+    try:
+        yield
+    finally:
+        _deferred = False
+        ensure_snapshot()
+
+
+add_version_listener(on_version_change)
@@ -0,0 +1,129 @@
+from sqlalchemy import MetaData
+import time
+from . import config
+from .snapshot import restore_from_snapshot
+from .normalized import drop_storage
+from .data import iter_dataset, convert_data_types, add_fields, get_dataset
+from .db import (get_engine, define_table, frame_rows, create_indexes, swap_tables, notify_change, db_exists,
+                 has_table, is_sharded, table)
+
+# Chunked ingest: memory stays bounded by the chunk size, not the input size
+
+
+def prepare_chunk(df):
+    '''
+    Apply the ingest transform to a raw chunk and switch to db column names
+    '''
+    df = add_fields(convert_data_types(df))
+    return df.rename(columns={c : c.replace(' ','_') for c in df.columns})
+
+
+def create_table_like(df, name, conn):
+    '''
+    Create table name with columns typed from df and its primary key, if it doesn't exist
+    '''
+    if config.STORAGE == 'normalized':
+        from .normalized import create_storage
+        if not conn.exec_driver_sql('SELECT 1 FROM sqlite_master WHERE name = ?', (name,)).scalar():
+            create_storage(df.iloc[:0], name, conn)
+        return
+    metadata = MetaData()
+    define_table(df, name, metadata)
+    metadata.create_all(conn)
+
+
+def on_storage(sharded, function, shards=None):
+    '''
+    function(None) on the database, or function(shard) on every shard (those in shards) when sharded
+    '''
+    if not sharded:
+        function(None)
+        return
+    from .shards import each_shard
+    each_shard(function, shards)
+
+
+def print_progress(rows, seconds):
+    print(f"Loaded {rows:,} rows in {seconds:.1f}s ({rows / max(seconds, 1e-9):,.0f} rows/s)")
+
+
+def stream_ingest(path, table=table, chunksize=None, replace=True, progress=print_progress):
+    '''
+    Read path in chunks, transform each chunk and bulk insert it in its own transaction.
+    With replace the rows go to a staging table that is swapped in at the end,
+    otherwise they are appended to table. Sharded, each chunk is split by shard and
+    the shards are written in parallel.
+    Returns {'rows', 'chunks', 'seconds', 'rows_per_sec'}
+    '''
+    chunksize = chunksize or config.INGEST_CHUNK_ROWS
+    target = f'{table}_staging' if replace else table
+    sharded = is_sharded(table)
+
+    def drop_target(shard):
+        with get_engine().begin() as conn:
+            drop_storage(target, conn)
+
+    def create_target(shard):
+        with get_engine().begin() as conn:
+            create_table_like(df, target, conn)
+
+    def insert_rows(shard):
+        with get_engine().begin() as conn:
+            conn.exec_driver_sql(insert, frame_rows((df if shard is None else parts[shard])[columns]))
+
+    if replace:
+        on_storage(sharded, drop_target)
+    rows = chunks = 0
+    insert = columns = None
+    start = time.perf_counter()
+    for raw in iter_dataset(path, chunksize):
+        df = prepare_chunk(raw)
+        if columns is None:
+            columns = list(df.columns)
+            on_storage(sharded, create_target)
+            quoted = ', '.join(f'"{c}"' for c in columns)
+            # later rows win when a replace load repeats a Product_ID
+            verb = 'INSERT OR REPLACE' if replace else 'INSERT'
+            insert = f'{verb} INTO "{target}" ({quoted}) VALUES ({", ".join("?" * len(columns))})'
+        if sharded:
+            from .shards import shard_rows
+            parts = shard_rows(df)
+            on_storage(sharded, insert_rows, [i for i, part in parts.items() if len(part)])
+        else:
+            insert_rows(None)
+        rows += len(df)
+        chunks += 1
+        if progress:
+            progress(rows, time.perf_counter() - start)
+    if columns is not None:
+        if replace:
+            swap_tables(target, table)
+        create_indexes(table)
+        notify_change(table, None, 'replace' if replace else 'append')
+    seconds = time.perf_counter() - start
+    return {'rows': rows, 'chunks': chunks, 'seconds': seconds, 'rows_per_sec': rows / seconds if seconds else 0.0}
+
+
+def setup_db():
+    '''
+    Make sure the grocery table exists, restoring it from the snapshot or
+    streaming the dataset in when it is missing. Without web ingest, waits for
+    ingest.py to create it instead.
+    Returns True when the dataset had to be loaded
+    '''
+    if db_exists():
+        from .shards import ensure_shards
+        ensure_shards()
+    if db_exists() and has_table(table):
+        create_indexes(table)
+        return False
+    if restore_from_snapshot():
+        return True
+    if not config.WEB_INGEST:
+        print(f"Waiting for ingest.py to load {config.DB_PATH}")
+        while not (db_exists() and has_table(table)):
+            time.sleep(max(config.REFRESH_INTERVAL, 1))
+        create_indexes(table)
+        return False
+    stream_ingest(get_dataset())
+    return True
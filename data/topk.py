@@ -0,0 +1,204 @@
+from bisect import bisect_left, insort
+import heapq
+import threading
+import pandas as pd
+from . import config
+from .db import query_db, get_date_bounds, get_data_version, add_change_listener, add_version_listener, table
+
+# Revenue per product kept pre-sorted per (Category, Status) cell and updated in place on writes.
+# Cells also record whether the row has each date, since any date filter drops rows without one.
+
+cell_keys = ['Category', 'Status', 'Has_Received', 'Has_Ordered']
+
+
+class RankedCell:
+    '''
+    Revenue and row count per product, plus the products ordered by revenue, largest first.
+    A ranking cut short keeps its last -revenue as rest, the most any product past it has
+    '''
+
+    def __init__(self):
+        self.totals = {}
+        self.ranking = []
+        self.rest = 0.0
+
+    def add(self, product, revenue, rows):
+        revenue_now, rows_now = self.totals.get(product, (0.0, 0))
+        if product in self.totals:
+            del self.ranking[bisect_left(self.ranking, (-revenue_now, product))]
+        revenue_now, rows_now = revenue_now + revenue, rows_now + rows
+        if rows_now > 0:
+            self.totals[product] = (revenue_now, rows_now)
+            insort(self.ranking, (-revenue_now, product))
+        else:
+            self.totals.pop(product, None)
+
+    def revenue(self, product):
+        return self.totals.get(product, (0.0, 0))[0]
+
+
+def cell_frame(df):
+    '''
+    Revenue and row count per cell and product for db-named rows
+    '''
+    df = df.loc[df['Category'].notna()]
+    parts = pd.DataFrame({'Category': df['Category'].astype(object),
+                          'Status': df['Status'].astype(object).fillna(''),
+                          'Has_Received': df['Date_Received'].notna(),
+                          'Has_Ordered': df['Last_Order_Date'].notna(),
+                          'Product_Name': df['Product_Name'].astype(object).fillna(''),
+                          'Revenue': df['Revenue'].astype(float).fillna(0),
+                          'Rows': 1})
+    return parts.groupby(cell_keys + ['Product_Name'], as_index=False)[['Revenue', 'Rows']].sum()
+
+
+class TopProducts:
+    '''
+    Top-K products by revenue for category and status selections, answered from the
+    per-cell rankings with a threshold-bounded heap merge instead of a groupby
+    '''
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.cells = {}
+        self.bounds = {}
+        self.version = None
+        self.pending = False
+
+    def build(self):
+        rows = query_db(f'''
+            SELECT Category, COALESCE(Status, '') AS Status,
+                   Date_Received IS NOT NULL AS Has_Received, Last_Order_Date IS NOT NULL AS Has_Ordered,
+                   COALESCE(Product_Name, '') AS Product_Name, COALESCE(SUM(Revenue), 0) AS Revenue,
+                   COUNT(*) AS Rows
+            FROM "{table}" WHERE Category IS NOT NULL GROUP BY 1, 2, 3, 4, 5''')
+        cells = {}
+        rows = rows.sort_values('Revenue', ascending=False, kind='stable')
+        for key, group in rows.groupby(cell_keys, sort=False):
+            cell = RankedCell()
+            cell.totals = dict(zip(group['Product_Name'], zip(group['Revenue'], group['Rows'])))
+            cell.ranking = sorted((-r, p) for p, r in zip(group['Product_Name'], group['Revenue']))
+            cells[(key[0], key[1], bool(key[2]), bool(key[3]))] = cell
+        self.cells = cells
+        self.bounds = get_date_bounds()
+
+    def ensure_current(self):
+        version = get_data_version()
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.build()
+                    self.version = version
+
+    def apply(self, df, sign=1):
+        '''
+        Add (sign=1) or remove (sign=-1) db-named rows without resorting whole cells
+        '''
+        for record in cell_frame(df).itertuples(index=False):
+            key = (record.Category, record.Status, bool(record.Has_Received), bool(record.Has_Ordered))
+            self.cells.setdefault(key, RankedCell()).add(record.Product_Name, sign * record.Revenue,
+                                                         sign * record.Rows)
+        if sign > 0:
+            for column in ['Date_Received', 'Last_Order_Date']:
+                values = pd.to_datetime(df[column]).dropna()
+                if len(values):
+                    low, high = self.bounds.get(column, (None, None))
+                    self.bounds[column] = (min(low, values.min()) if low is not None else values.min(),
+                                           max(high, values.max()) if high is not None else values.max())
+
+    def covers(self, column, start, end):
+        '''
+        A date filter that keeps every dated row: None when there is no filter,
+        True when it spans the known bounds, False when it may drop rows
+        '''
+        if not end:
+            return None
+        low, high = self.bounds.get(column, (None, None))
+        if low is None or high is None:
+            return False
+        return pd.Timestamp(end) >= high and (not start or pd.Timestamp(start) <= low)
+
+    def matching_cells(self, rec_start_date, rec_end_date, order_start_date, order_end_date, categories, statuses):
+        '''
+        Cells the filters select, None when the dates can't be answered from the cells
+        '''
+        received = self.covers('Date_Received', rec_start_date, rec_end_date)
+        ordered = self.covers('Last_Order_Date', order_start_date, order_end_date)
+        if received is False or ordered is False:
+            return None
+        return [cell for (category, status, has_received, has_ordered), cell in self.cells.items()
+                if (not categories or category in categories) and (not statuses or status in statuses)
+                and (received is None or has_received) and (ordered is None or has_ordered) and cell.ranking]
+
+    def top(self, rec_start_date=None, rec_end_date=None, order_start_date=None, order_end_date=None,
+            categories=None, statuses=None, k=None):
+        '''
+        [(product, revenue)] largest first, None when the filters need row-level data
+        '''
+        k = k or config.TOP_PRODUCTS
+        self.ensure_current()
+        with self.lock:
+            cells = self.matching_cells(rec_start_date, rec_end_date, order_start_date, order_end_date,
+                                        categories, statuses)
+            if cells is None:
+                return None
+            if len(cells) == 1:
+                return [(p, -r) for r, p in cells[0].ranking[:k]]
+            return merge_top(cells, k)
+
+    def on_table_change(self, changed, df, mode, previous=None):
+        if changed != table:
+            return
+        with self.lock:
+            if mode in ('append', 'upsert') and df is not None and self.version is not None:
+                if previous is not None and not previous.empty:
+                    self.apply(previous, -1)
+                self.apply(df)
+                self.pending = True
+            else:
+                self.version = None
+
+    def on_version_change(self, changed, version):
+        # the deltas above already brought the cells to this version
+        with self.lock:
+            if changed == table and self.pending:
+                self.version = version
+                self.pending = False
+
+
+def merge_top(cells, k):
+    '''
+    Exact top k of per-product sums across cells. Rankings are read largest first through
+    a heap, each new product's total is looked up in every cell, and the scan stops once
+    the k-th total beats the sum of the unread heads (the threshold algorithm). Products past
+    the end of a cut short ranking are only found through the other cells
+    '''
+    heads = [cell.ranking[0][0] for cell in cells]
+    frontier = [(heads[i], i, 0) for i in range(len(cells))]
+    heapq.heapify(frontier)
+    best = []
+    seen = set()
+    while frontier:
+        _, i, position = heapq.heappop(frontier)
+        product = cells[i].ranking[position][1]
+        if position + 1 < len(cells[i].ranking):
+            heads[i] = cells[i].ranking[position + 1][0]
+            heapq.heappush(frontier, (heads[i], i, position + 1))
+        else:
+            heads[i] = cells[i].rest
+        if product not in seen:
+            seen.add(product)
+            total = sum(cell.revenue(product) for cell in cells)
+            if len(best) < k:
+                heapq.heappush(best, (total, product))
+            elif total > best[0][0]:
+                heapq.heapreplace(best, (total, product))
+        threshold = sum(max(-h, 0.0) for h in heads)
+        if len(best) == k and best[0][0] >= threshold:
+            break
+    return [(p, r) for r, p in sorted(best, key=lambda b: (-b[0], b[1]))]
+
+
+top_products = TopProducts()
+add_change_listener(top_products.on_table_change)
+add_version_listener(top_products.on_version_change)
@@ -0,0 +1,41 @@
+import argparse
+import json
+import time
+from data import config
+from data.ingest import discover, ingest_files, input_extensions
+
+# Load daily input files into the database outside the web process:
+#     python ingest.py incoming/ extra/warehouse_7.xlsx
+#     python ingest.py "incoming/*.csv" -w 4 --report ingest.json
+# Inputs are written in sorted path order, so a Product_ID repeated across files keeps the row of
+# the last one. Running dashboards pick up the new data on their next refresh poll.
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='input files, directories or glob patterns')
+    parser.add_argument('-w', '--workers', type=int, default=config.INGEST_WORKERS,
+                        help='parsing processes, 0 for one per core')
+    parser.add_argument('-f', '--force', action='store_true', help='load inputs even if already ingested')
+    parser.add_argument('--report', help='JSON file for the per-file stats')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    paths = discover(args.paths)
+    if not paths:
+        raise SystemExit(f"No {'/'.join(input_extensions)} inputs in {args.paths}")
+    start = time.perf_counter()
+    results = ingest_files(paths, workers=args.workers, force=args.force)
+    seconds = time.perf_counter() - start
+    loaded = [r for r in results if r['status'] == 'loaded']
+    rows = sum(r['rows'] for r in loaded)
+    failed = sum(r['status'] == 'failed' for r in results)
+    print(f"{len(loaded)} loaded, {len(results) - len(loaded) - failed} skipped, {failed} failed: "
+          f"{rows:,} rows in {seconds:.1f}s ({rows / max(seconds, 1e-9):,.0f} rows/s) into {config.DB_PATH}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'seconds': seconds, 'rows': rows, 'files': results}, f, indent=2)
+    if failed:
+        raise SystemExit(1)
@@ -4,8 +4,27 @@ from dash_bootstrap_templates import load_figure_template
 import plotly.io as pio
 import dash_bootstrap_components as dbc
 import pandas as pd
+import hashlib
+import inspect
+import json
+import re
+import time
+import uuid
+from data import config
 from data.data import rename_for_layout
-from data.db import initial_setup
+from data.db import (query_filtered, get_date_bounds, get_distinct_values, get_data_version, query_restock_page,
+                     restock_columns)
+from layout.routes import export_url
+from data.loader import is_data_ready
+from data.cache import compute_coalesced, cached_result, dashboard_requests, normalize_filters
+from data.rollup import can_use_rollup, rollup_kpis, rollup_sales_per_category
+from data.shared import filter_shared
+from data.bitmap import filter_engine
+from data.topk import top_products
+from data.shards import query_shards
+from data.refresh import refresher
+from data.metrics import instrument, stage
+from data.history import product_history, totals_history, trend_range
 
 
 import plotly.express as px
@@ -32,44 +51,93 @@ def create_color_mode_switch():
         dbc.Label(className="fa fa-sun", html_for="color-mode-switch")])
 
 
-# Load dataset (replace with your file path)
-df = rename_for_layout(initial_setup())
+# {data version: filter options}, only the latest version is kept
+filter_options_cache = {}
 
-def create_date_pickers():
+def get_filter_options():
+    '''
+    Date bounds and dropdown options from cheap MIN/MAX/DISTINCT queries, run once per
+    data version. Empty until the background data load has finished
+    '''
+    if not is_data_ready():
+        return {'bounds': {'Date_Received': (None, None), 'Last_Order_Date': (None, None)},
+                'categories': [], 'products': [], 'statuses': [], 'warehouses': []}
+    version = get_data_version()
+    options = filter_options_cache.get(version)
+    if options is None:
+        options = {'bounds': get_date_bounds(),
+                   'categories': get_distinct_values('Category'),
+                   'products': get_distinct_values('Product_Name'),
+                   'statuses': get_distinct_values('Status'),
+                   'warehouses': get_distinct_values('Warehouse_Location')}
+        filter_options_cache.clear()
+        filter_options_cache[version] = options
+    return options
+
+def dropdown_options(values):
+    return [{'label': v, 'value': v} for v in values]
+
+def create_date_pickers(options):
     # Filters
+    rec_start, rec_end = options['bounds']['Date_Received']
+    order_start, order_end = options['bounds']['Last_Order_Date']
     return html.Div([
         html.Div([html.H5('Date Received'),
             dcc.DatePickerRange(
                 id='date-received',
-                start_date=df['Date Received'].min(),
-                end_date=df['Date Received'].max()
+                start_date=rec_start,
+                end_date=rec_end
             )], style={'display': 'flex','margin': 'auto','flexDirection': 'column', 'alignItems': 'left'}),
             html.Div([html.H5('Last Order Date'),
             dcc.DatePickerRange(
                 id='date-last-order',
-                start_date=df['Last Order Date'].min(),
-                end_date=df['Last Order Date'].max()
+                start_date=order_start,
+                end_date=order_end
             )], style={'display': 'flex','margin': 'auto','flexDirection': 'column', 'alignItems': 'left'})
         ], style={'display': 'flex','margin': 'auto','flexDirection': 'row', 'alignItems': 'center'}
         # { 'gap': '10px',}
         )
-def create_selectables():
+# props the installed Dash's Dropdown accepts
+dropdown_props = set(inspect.signature(dcc.Dropdown.__init__).parameters)
+
+def dropdown_debounce():
+    '''
+    Dropdown props sending a selection only once its menu closes, when FILTER_DEBOUNCE is on.
+    Left out on Dash versions whose Dropdown doesn't have them (e.g. the pinned 2.14)
+    '''
+    if not config.FILTER_DEBOUNCE or not {'debounce', 'closeOnSelect'} <= dropdown_props:
+        return {}
+    return {'debounce': True, 'closeOnSelect': False}
+
+def create_selectables(options):
     return html.Div([dcc.Dropdown(
                 id='category-dropdown',
-                options=[{'label': cat, 'value': cat} for cat in df['Category'].unique()],
+                options=dropdown_options(options['categories']),
                 placeholder="Select a Category",
                 multi=True,
-                style={'width': '35%'}
+                style={'width': '35%'},
+                **dropdown_debounce()
             ),
             dcc.Dropdown(
                 id='product-dropdown',
-                options=[{'label': cat, 'value': cat} for cat in df['Product Name'].unique()],
+                options=dropdown_options(options['products']),
                 placeholder="Select a Product",
                 multi=True,
                 style={'width': '35%'},
-                searchable=True
+                searchable=True,
+                **dropdown_debounce()
+            ),
+            dcc.Checklist(options['statuses'],id='checklist-status'),
+            # with sharding on, only the shards holding the selected warehouses are queried
+            dcc.Dropdown(
+                id='warehouse-dropdown',
+                options=dropdown_options(options['warehouses']),
+                placeholder="Select a Warehouse",
+                multi=True,
+                style={'width': '25%'},
+                searchable=True,
+                **dropdown_debounce()
             ),
-            dcc.Checklist(df.Status.unique().tolist(),id='checklist-status'),
             ], style={'display': 'flex','margin': 'auto','flexDirection': 'row', 'alignItems': 'center'}
         )
 def create_cards():
@@ -81,10 +149,27 @@ def create_cards():
             html.Div(id='avg-turn', style={'padding': '20px'})
         ],id='kpi-cards', style={'display': 'flex', 'gap': '10px', 'margin-top': '20px'})
 def create_charts():
+    '''
+    Chart skeletons, update_dashboard only patches their trace data afterwards
+    '''
+    sales_skeleton, products_skeleton = chart_skeletons()
     return html.Div([
-        dcc.Graph(id='sales-category'),
-        dcc.Graph(id='top-products'),
+        dcc.Graph(id='sales-category', figure=sales_skeleton),
+        dcc.Graph(id='top-products', figure=products_skeleton),
+        dcc.Store(id='dashboard-digest', data={}),
+        # identifies this page to update_dashboard, which skips updates a newer one superseded
+        dcc.Store(id='session-id', data=uuid.uuid4().hex),
         ],id='charts', style={'display': 'flex','margin': 'auto','flexDirection': 'row',})
+def create_trend():
+    '''
+    Inventory trend over the snapshot history, filled in by update_trend
+    '''
+    measure_selector = dcc.RadioItems(
+        id='trend-measure',
+        options=[{'label': label, 'value': value} for value, label in trend_labels.items()],
+        value='Stock_Quantity',
+        labelStyle={'display': 'inline-block', 'margin': '10px'})
+    return html.Div([measure_selector, dcc.Graph(id='inventory-trend')], id='trend')
 def create_file_download_section():
     '''
     DataTable File download options and button
@@ -93,14 +178,16 @@ def create_file_download_section():
     file_type_selector = dcc.RadioItems(
         id="file-type-selector",
         options=[{"label": "Excel file", "value": "xlsx"},
-                 {"label": "CSV file", "value": "csv"}],
+                 {"label": "CSV file", "value": "csv"},
+                 {"label": "Parquet file", "value": "parquet"}],
         value='csv',
         labelStyle={'display': 'inline-block', 'margin': '10px'}
     )
+    # href is kept in step with the filters by update_download_link, the server streams the file
     download_button = html.Button("Download Data", id='download-button', style={"marginTop": 20})
-    download_component = dcc.Download(id='download')
+    download_component = html.A(download_button, id='download-link', href='', download='Replenishment Needs.csv')
     file_div = html.Div([file_type_header, file_type_selector], id='file-div', style={'display': 'flex', 'flex-direction': 'column', 'margin': '10px'})
-    download_div = html.Div([download_button, download_component], id='download-div', style={'display': 'flex', 'flex-direction': 'column', 'margin': '10px'})
+    download_div = html.Div([download_component], id='download-div', style={'display': 'flex', 'flex-direction': 'column', 'margin': '10px'})
     return html.Div([file_div, download_div], id='file-download-div', style={'display': 'flex', 'flex-direction': 'row', 'margin': '10px'})
 def data_table_style(dark) -> dict:
     '''
@@ -137,15 +224,57 @@ def data_table_filters(df):
     return df.loc[df['Restock'] == True,columns].sort_values(by=['Revenue'],ascending=False)
 def df_to_data_table(df):
     return df.to_dict(orient='records')
-def create_data_table(df):
+
+# DataTable column name -> grocery table column
+table_to_db = {c.replace('_',' ').title(): c for c in restock_columns}
+filter_operators = {'eq': '=', '=': '=', 'ne': '!=', '!=': '!=', 'lt': '<', '<': '<', 'le': '<=', '<=': '<=',
+                    'gt': '>', '>': '>', 'ge': '>=', '>=': '>=', 'contains': 'contains',
+                    'scontains': 'scontains', 'datestartswith': 'datestartswith'}
+# columns whose filter values are compared as numbers, the rest keep the typed text
+numeric_table_columns = ['Stock_Quantity', 'Reorder_Level', 'Reorder_Quantity', 'Revenue']
+filter_part_pattern = re.compile(r'^\{(?P<column>[^}]+)\}\s+(?P<operator>\S+)\s+(?P<value>.+)$')
+
+def split_filter_query(filter_query):
+    '''
+    DataTable filter_query -> [(db column, operator, value)], skipping parts that can't be translated
+    '''
+    parts = []
+    for part in (filter_query or '').split(' && '):
+        match = filter_part_pattern.match(part.strip())
+        if not match or match['column'] not in table_to_db:
+            continue
+        column, operator = table_to_db[match['column']], match['operator']
+        # case (in)sensitive variants, e.g. icontains or seq. contains is case-insensitive and
+        # comparisons are case-sensitive already, only scontains needs its own operator
+        if operator not in filter_operators and operator[:1] in ('i', 's'):
+            operator = operator[1:]
+        if operator not in filter_operators:
+            continue
+        operator = filter_operators[operator]
+        value = match['value'].strip()
+        if value[0] == value[-1] and value[0] in ('"', "'", '`') and len(value) > 1:
+            value = value[1:-1].replace('\\' + value[0], value[0])
+        elif column in numeric_table_columns and operator not in ('contains', 'scontains', 'datestartswith'):
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+        parts.append((column, operator, value))
+    return parts
+
+def sort_by_to_db(sort_by):
+    '''
+    DataTable sort_by -> [(db column, ascending)]
+    '''
+    return [(table_to_db[s['column_id']], s['direction'] == 'asc') for s in sort_by or [] if s['column_id'] in table_to_db]
+def create_data_table():
     ''''
-    DataTable displaying price information for the given dates
+    DataTable displaying price information for the given dates,
+    rows are filled in one page at a time by update_data_table
     '''
     money = FormatTemplate.money(2)
     # percent = FormatTemplate.percentage(2, True)
     columns = ['Product Name','Category','Product Id','Supplier Name','Supplier Id','Stock Quantity','Reorder Level','Reorder Quantity','Revenue']
-    dt_df = data_table_filters(df)
-    print(dt_df.head())
     dt_cols = []
     for i,c in enumerate(columns):
         if i < 5:
@@ -154,92 +283,236 @@ def create_data_table(df):
             dt_cols.append({'name': c, 'id': c, 'type': 'numeric','format':money})
         else:
             dt_cols.append({'name': c, 'id': c, 'type': 'numeric'})
-    return html.Div([html.H4('Needs Replenishment'),DataTable(data=df_to_data_table(dt_df),id='data-table', page_size=10, columns=dt_cols,
-                      sort_action="native", filter_action='native', style_table={"overflowX": "auto"},
+    return html.Div([html.H4('Needs Replenishment'),DataTable(data=[],id='data-table', page_size=10, columns=dt_cols,
+                      # paged, sorted and filtered server-side by update_data_table
+                      page_action='custom', page_current=0, sort_action='custom', sort_mode='multi', sort_by=[],
+                      filter_action='custom', filter_query='', style_table={"overflowX": "auto"},
     **data_table_style(False))])
 
+def create_data_ready_poll(ready):
+    '''
+    Interval polling for the background data load, disabled once it is done
+    '''
+    return dcc.Interval(id='data-ready-poll', interval=1000, disabled=ready)
+
+def create_data_version_poll():
+    '''
+    Interval and store holding the data version, dashboards recompute when it moves
+    '''
+    return html.Div([dcc.Interval(id='data-version-poll', interval=max(config.REFRESH_INTERVAL, 1) * 1000,
+                                  disabled=config.REFRESH_INTERVAL <= 0),
+                     dcc.Store(id='data-version')])
+
 def create_layout():
+    '''
+    Page layout, served as a function so pages opened after the data load get filled in options
+    '''
+    options = get_filter_options()
     return html.Div([
         create_header(),
         create_color_mode_switch(),
-        create_date_pickers(),
-        create_selectables(),
+        create_data_ready_poll(is_data_ready()),
+        create_data_version_poll(),
+        create_date_pickers(options),
+        create_selectables(options),
         create_cards(),
         create_charts(),
+        create_trend(),
         create_file_download_section(),
-        create_data_table(df)], className='dbc')
-
-def filter_data(rec_start_date, rec_end_date,order_start_date, order_end_date, selected_categories,selected_products,checklist_status):
-    filtered_df = pd.DataFrame
-    if all([rec_start_date, rec_end_date]):
-        filtered_df = df.loc[df['Date Received'].between(rec_start_date, rec_end_date),:]
-    elif rec_end_date:
-        filtered_df = df.loc[df['Date Received'] <= rec_end_date,:]
-    if all([order_start_date, order_end_date]):
-        if not filtered_df.empty:
-            filtered_df = filtered_df.loc[filtered_df['Last Order Date'].between(order_start_date, order_end_date),:]
-        else:
-            filtered_df = df.loc[df['Last Order Date'].between(order_start_date, order_end_date),:]
-    elif order_end_date:
-        if not filtered_df.empty:
-            filtered_df = filtered_df.loc[filtered_df['Last Order Date'] <= order_end_date,:]
-        else:
-            filtered_df = df.loc[df['Last Order Date'] <= order_end_date,:]
-    if filtered_df.empty:
-        filtered_df = df.copy()
-    if selected_categories:
-        filtered_df = filtered_df.loc[filtered_df['Category'].isin(selected_categories)]
-    if selected_products:
-        filtered_df = filtered_df.loc[filtered_df['Product Name'].isin(selected_products)]
-    if checklist_status:
-        filtered_df = filtered_df.loc[filtered_df['Status'].isin(checklist_status)]
-    return filtered_df
+        create_data_table()], className='dbc')
+
+def filter_data(rec_start_date, rec_end_date,order_start_date, order_end_date, selected_categories,selected_products,checklist_status,selected_warehouses=None):
+    '''
+    Filtered rows for the dashboard, from the bitmap engine or the shared dataset when enabled,
+    otherwise queried from the indexed grocery table. Warehouse selections always query the table
+    '''
+    if selected_warehouses:
+        return rename_for_layout(query_filtered(rec_start_date, rec_end_date, order_start_date, order_end_date,
+                                                selected_categories, selected_products, checklist_status,
+                                                warehouses=selected_warehouses))
+    if config.FILTER_ENGINE == 'bitmap':
+        return rename_for_layout(filter_engine.query(rec_start_date, rec_end_date, order_start_date, order_end_date,
+                                                     selected_categories, selected_products, checklist_status))
+    if config.SHARED_DATASET:
+        filtered_df = filter_shared(rec_start_date, rec_end_date, order_start_date, order_end_date,
+                                    selected_categories, selected_products, checklist_status)
+        if filtered_df is not None:
+            return rename_for_layout(filtered_df)
+    return rename_for_layout(query_filtered(rec_start_date, rec_end_date, order_start_date, order_end_date,
+                                            selected_categories, selected_products, checklist_status))
+
+def format_kpis(total_sales, total_inv, avg_turn):
+    return (f"Total Sales: ${total_sales:,.0f}",
+            f"Total Inventory: ${total_inv:,.0f}",
+            f"Avg Turnover: {avg_turn:,.0f}")
 
 def generate_kpis(filtered_df):
-    total_sales = f"Total Sales: ${filtered_df['Revenue'].sum():,.0f}"
-    total_orders = f"Total Inventory: ${filtered_df['Inventory Value'].sum():,.0f}"
-    avg_order_value = f"Avg Turnover: {filtered_df['Inventory Turnover Rate'].mean():,.0f}"
-    return total_sales, total_orders, avg_order_value
+    return format_kpis(filtered_df['Revenue'].sum(), filtered_df['Inventory Value'].sum(),
+                       filtered_df['Inventory Turnover Rate'].mean())
 
-def generate_charts(filtered_df):
-    cats = filtered_df.groupby('Category',as_index=False)['Revenue'].sum().sort_values(by='Revenue',ascending=False)
+def sales_per_category_chart(cats):
     top_cats = px.bar(cats,
                            x='Category', y='Revenue', title='Sales per Category',text=[f'${a:,.0f}' for a in cats['Revenue'].values.tolist()])
     top_cats.update_traces(marker_color='red')
-    prods = filtered_df.groupby('Product Name')['Revenue'].sum().nlargest(10).reset_index()
-    top_prods = px.bar(prods,
-                           x='Product Name', y='Revenue', title='Top 10 Products',text=[f'${a:,.0f}' for a in prods['Revenue'].values.tolist()])
+    return top_cats
+
+def top_products_chart(prods):
+    return px.bar(prods,
+                           x='Product Name', y='Revenue', title=f'Top {config.TOP_PRODUCTS} Products',text=[f'${a:,.0f}' for a in prods['Revenue'].values.tolist()])
+
+_chart_skeletons = None
+
+def chart_skeletons():
+    '''
+    Empty Sales per Category and Top Products figures, built once per process
+    '''
+    global _chart_skeletons
+    if _chart_skeletons is None:
+        _chart_skeletons = (sales_per_category_chart(pd.DataFrame({'Category': [], 'Revenue': []})),
+                            top_products_chart(pd.DataFrame({'Product Name': [], 'Revenue': []})))
+    return _chart_skeletons
+
+def bar_data(df, x):
+    '''
+    x, y and text arrays of a bar trace, as plain lists
+    '''
+    revenue = df['Revenue'].astype(float).tolist()
+    return {'x': df[x].astype(str).tolist(), 'y': revenue, 'text': [f'${a:,.0f}' for a in revenue]}
+
+def bar_patch(data):
+    '''
+    Patch replacing the first trace's arrays of a chart skeleton
+    '''
+    patched_figure = Patch()
+    for key, values in data.items():
+        patched_figure['data'][0][key] = values
+    return patched_figure
+
+def generate_charts(filtered_df, cats=None, prods=None):
+    '''
+    Trace data for Sales per Category and Top Products,
+    cats and prods are used instead of filtered_df when given
+    '''
+    with stage('chart.sales_category'):
+        if cats is None:
+            cats = filtered_df.groupby('Category',as_index=False,observed=True)['Revenue'].sum().sort_values(by='Revenue',ascending=False)
+        top_cats = bar_data(cats, 'Category')
+    with stage('chart.top_products'):
+        if prods is None:
+            prods = filtered_df.groupby('Product Name',observed=True)['Revenue'].sum().nlargest(config.TOP_PRODUCTS).reset_index()
+        top_prods = bar_data(prods, 'Product Name')
     # stats = filtered_df.groupby(by='Status',as_index=False)['Inventory Value'].sum()
     # inv_status = px.pie(stats, names='Status', title='Inventory Status')
     return top_cats, top_prods#, inv_status
 
+def output_digest(value):
+    return hashlib.md5(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+def skip_unchanged(results, digests):
+    '''
+    Replace outputs the page already shows with no_update, returns (outputs, new digests)
+    '''
+    outputs, new_digests = [], {}
+    for name, value in zip(dashboard_outputs, results):
+        new_digests[name] = output_digest(value)
+        if (digests or {}).get(name) == new_digests[name]:
+            outputs.append(no_update)
+        elif name in chart_outputs:
+            outputs.append(bar_patch(value))
+        else:
+            outputs.append(value)
+    return outputs, new_digests
+
 
 # Initialize Dash app
 # app = dash.Dash(__name__)
 # app.layout = create_layout()
 
+dashboard_outputs = ['total-sales', 'total-inventory', 'avg-turn', 'sales-category', 'top-products']
+chart_outputs = ['sales-category', 'top-products']
+
 @callback(
     [Output('total-sales', 'children'),
      Output('total-inventory', 'children'),
      Output('avg-turn', 'children'),
      Output('sales-category', 'figure'),
      Output('top-products', 'figure'),
-     Output('data-table','data')],
+     Output('dashboard-digest', 'data')],
     [Input('date-received', 'start_date'),
      Input('date-received', 'end_date'),
      Input('date-last-order', 'start_date'),
      Input('date-last-order', 'end_date'),
      Input('category-dropdown', 'value'),
      Input('product-dropdown', 'value'),
-     Input('checklist-status', 'value'),],
+     Input('checklist-status', 'value'),
+     Input('warehouse-dropdown', 'value'),
+     Input('data-version', 'data'),],
+    State('dashboard-digest', 'data'),
+    State('session-id', 'data'),
     #  prevent_initial_call=True,
 )
-def update_dashboard(rec_start_date, rec_end_date,order_start_date, order_end_date, selected_categories,selected_products,checklist_status):
-    filtered_df = filter_data(rec_start_date, rec_end_date,order_start_date, order_end_date, selected_categories,selected_products,checklist_status)
-    total_sales, total_inv, avg_inv_value = generate_kpis(filtered_df)
-    sales_cat, top_products = generate_charts(filtered_df)
-    dt_data = df_to_data_table(data_table_filters(filtered_df))
-    return total_sales, total_inv, avg_inv_value, sales_cat, top_products,dt_data
+@instrument('update_dashboard', outputs=dashboard_outputs + ['dashboard-digest'])
+def update_dashboard(rec_start_date, rec_end_date,order_start_date, order_end_date, selected_categories,selected_products,checklist_status,selected_warehouses=None,data_version=None,digests=None,session_id=None):
+    '''
+    KPI strings and chart trace patches for the filters,
+    outputs that match what the page already shows are not sent again.
+    Updates superseded by a newer one from the same page are skipped, the page drops their response anyway.
+    Uncached updates wait DASHBOARD_DEBOUNCE_MS first so a quick run of changes only queries the last one
+    '''
+    if not is_data_ready():
+        return (no_update,) * 6
+    ticket = dashboard_requests.begin(session_id)
+    filters = (rec_start_date, rec_end_date, order_start_date, order_end_date, selected_categories, selected_products, checklist_status, selected_warehouses)
+    key = normalize_filters(*filters)
+    found, results = cached_result(key)
+    if not found:
+        if config.DASHBOARD_DEBOUNCE_MS > 0:
+            time.sleep(config.DASHBOARD_DEBOUNCE_MS / 1000)
+        if dashboard_requests.superseded(session_id, ticket):
+            return (no_update,) * 6
+        with stage('compute'):
+            results = compute_coalesced(key, compute_dashboard, *filters)
+    if dashboard_requests.superseded(session_id, ticket):
+        return (no_update,) * 6
+    outputs, new_digests = skip_unchanged(results, digests)
+    return (*outputs, new_digests if new_digests != digests else no_update)
+
+def compute_dashboard(rec_start_date, rec_end_date,order_start_date, order_end_date, selected_categories,selected_products,checklist_status,selected_warehouses=None):
+    '''
+    KPI strings and chart trace data for the filters
+    '''
+    prods = None
+    if not selected_products and not selected_warehouses:
+        with stage('topk'):
+            top = top_products.top(rec_start_date, rec_end_date, order_start_date, order_end_date, selected_categories, checklist_status)
+        if top is not None:
+            prods = pd.DataFrame(top, columns=['Product Name', 'Revenue'])
+    use_rollup = not selected_warehouses and can_use_rollup(rec_start_date, rec_end_date, order_start_date, order_end_date, selected_products)
+    if config.SHARDS > 0 and not (use_rollup and prods is not None):
+        # partial aggregates of the shards holding the selected warehouses, merged
+        with stage('shards'):
+            kpis, cats, top = query_shards(rec_start_date, rec_end_date, order_start_date, order_end_date, selected_categories, selected_products, checklist_status, selected_warehouses)
+        if prods is None:
+            prods = pd.DataFrame(top, columns=['Product Name', 'Revenue'])
+        sales_cat, top_prods = generate_charts(None, cats=cats, prods=prods)
+        return (*format_kpis(*kpis), sales_cat, top_prods)
+    filtered_df = None
+    if not (use_rollup and prods is not None):
+        with stage('filter'):
+            filtered_df = filter_data(rec_start_date, rec_end_date,order_start_date, order_end_date, selected_categories,selected_products,checklist_status,selected_warehouses)
+    if use_rollup:
+        # KPIs and sales per category come from the precomputed rollup
+        rollup_filters = (rec_start_date, rec_end_date, order_start_date, order_end_date, selected_categories, checklist_status)
+        with stage('kpis'):
+            total_sales, total_inv, avg_inv_value = format_kpis(*rollup_kpis(*rollup_filters))
+        with stage('rollup_categories'):
+            cats = rollup_sales_per_category(*rollup_filters)
+        sales_cat, top_prods = generate_charts(filtered_df, cats=cats, prods=prods)
+    else:
+        with stage('kpis'):
+            total_sales, total_inv, avg_inv_value = generate_kpis(filtered_df)
+        sales_cat, top_prods = generate_charts(filtered_df, prods=prods)
+    return total_sales, total_inv, avg_inv_value, sales_cat, top_prods
     # kpis = generate_kpis(filtered_df)
     # charts = generate_charts(filtered_df)
     # results = list(kpis)
@@ -249,27 +522,151 @@ def update_dashboard(rec_start_date, rec_end_date,order_start_date, order_end_da
 
 
 @callback(
-    Output('download', "data"),
-    Input('download-button', "n_clicks"),
-    State("file-type-selector", 'value'),
-    State('data-table', "derived_virtual_data"),
+    Output('data-table', 'data'),
+    Output('data-table', 'page_count'),
+    Output('data-table', 'page_current'),
+    Input('data-table', 'page_current'),
+    Input('data-table', 'page_size'),
+    Input('data-table', 'sort_by'),
+    Input('data-table', 'filter_query'),
+    Input('date-received', 'start_date'),
+    Input('date-received', 'end_date'),
+    Input('date-last-order', 'start_date'),
+    Input('date-last-order', 'end_date'),
+    Input('category-dropdown', 'value'),
+    Input('product-dropdown', 'value'),
+    Input('checklist-status', 'value'),
+    Input('warehouse-dropdown', 'value'),
+    Input('data-version', 'data'),
+)
+@instrument('update_data_table', outputs=['data', 'page_count', 'page_current'])
+def update_data_table(page_current, page_size, sort_by, filter_query, *inputs):
+    '''
+    One page of the Needs Replenishment table, sorted and filtered in SQL,
+    page_current is moved back to the last page when the result shrinks below it
+    '''
+    if not is_data_ready():
+        return no_update, no_update, no_update
+    # the dashboard filters, the last input only triggers a reload when the data version moves
+    filters = inputs[:-1]
+    page_current, page_size = page_current or 0, page_size or 10
+    with stage('query'):
+        page, total = query_restock_page(filters, split_filter_query(filter_query), sort_by_to_db(sort_by),
+                                         page_current, page_size)
+        page_count = max(1, -(-total // page_size))
+        if page_current >= page_count:
+            # the filters shrank the result below the current page
+            page_current = page_count - 1
+            if total:
+                page, total = query_restock_page(filters, split_filter_query(filter_query), sort_by_to_db(sort_by),
+                                                 page_current, page_size)
+    with stage('serialize'):
+        data = df_to_data_table(rename_for_layout(page))
+    return data, page_count, page_current
+
+
+# history measure -> label
+trend_labels = {'Stock_Quantity': 'Stock Quantity', 'Revenue': 'Revenue', 'Restock': 'Needs Restock'}
+
+def trend_chart(df, color, measure, template):
+    '''
+    Step lines of measure per color value over the snapshot days
+    '''
+    df = df.rename(columns={'Snapshot_Date': 'Snapshot Date', color: color.replace('_', ' ')})
+    fig = px.line(df, x='Snapshot Date', y=measure, color=color.replace('_', ' '), line_shape='hv',
+                  title=f'{trend_labels[measure]} Trend', labels={measure: trend_labels[measure]},
+                  template=template)
+    return fig
+
+
+@callback(
+    Output('inventory-trend', 'figure'),
+    Input('category-dropdown', 'value'),
+    Input('product-dropdown', 'value'),
+    Input('trend-measure', 'value'),
+    Input('data-version', 'data'),
+    State('color-mode-switch', 'value'),
+)
+@instrument('update_trend', outputs=['inventory-trend'])
+def update_trend(selected_categories, selected_products, measure, data_version=None, switch_on=False):
+    '''
+    Trend of the selected products, or of the selected categories' totals, from the history tables
+    '''
+    if not is_data_ready() or not config.HISTORY_ENABLED:
+        return no_update
+    start, end = trend_range()
+    with stage('query'):
+        if selected_products:
+            df, color = product_history(selected_products, start, end, [measure]), 'Product_Name'
+        else:
+            df, color = totals_history(start, end, selected_categories), 'Category'
+    with stage('chart'):
+        return trend_chart(df, color, measure, get_template(switch_on))
+
+
+@callback(
+    Output('date-received', 'start_date'),
+    Output('date-received', 'end_date'),
+    Output('date-last-order', 'start_date'),
+    Output('date-last-order', 'end_date'),
+    Output('category-dropdown', 'options'),
+    Output('product-dropdown', 'options'),
+    Output('checklist-status', 'options'),
+    Output('warehouse-dropdown', 'options'),
+    Output('data-ready-poll', 'disabled'),
+    Input('data-ready-poll', 'n_intervals'),
     prevent_initial_call=True,
-    # prevent_initial_callbacks=True,
 )
-def download_data(click, download_type, data):
+def populate_filters(n_intervals):
     '''
-    Download data as CSV or XLSX from DataTable
+    Fill in the filters of a page served before the data load finished
     '''
-    if not click:
+    if not is_data_ready():
+        return (no_update,) * 9
+    options = get_filter_options()
+    rec_start, rec_end = options['bounds']['Date_Received']
+    order_start, order_end = options['bounds']['Last_Order_Date']
+    return (rec_start, rec_end, order_start, order_end, dropdown_options(options['categories']),
+            dropdown_options(options['products']), options['statuses'], dropdown_options(options['warehouses']), True)
+
+
+@callback(
+    Output('data-version', 'data'),
+    Input('data-version-poll', 'n_intervals'),
+    State('data-version', 'data'),
+)
+def check_data_version(n_intervals, data_version):
+    '''
+    Move the data-version store when the background refresher has seen new data
+    '''
+    if not is_data_ready():
         return no_update
-    # stock = stock_selected if not input_value else input_value
-    dff = pd.DataFrame(data)
-    dff.set_index(dff.columns[0], inplace=True)
-    if download_type == "csv":
-        writer = dff.to_csv
-    else:
-        writer = dff.to_excel
-    return dcc.send_data_frame(writer, f"Replenishment Needs.{download_type}")
+    version = refresher.current_version()
+    return version if version != data_version else no_update
+
+
+@callback(
+    Output('download-link', 'href'),
+    Output('download-link', 'download'),
+    Input("file-type-selector", 'value'),
+    Input('data-table', 'sort_by'),
+    Input('data-table', 'filter_query'),
+    Input('date-received', 'start_date'),
+    Input('date-received', 'end_date'),
+    Input('date-last-order', 'start_date'),
+    Input('date-last-order', 'end_date'),
+    Input('category-dropdown', 'value'),
+    Input('product-dropdown', 'value'),
+    Input('checklist-status', 'value'),
+    Input('warehouse-dropdown', 'value'),
+)
+@instrument('update_download_link', outputs=['href', 'download'])
+def update_download_link(download_type, sort_by, filter_query, *filters):
+    '''
+    Point the Download Data link at the server-side export for the current filters
+    '''
+    return (export_url(download_type, filters, split_filter_query(filter_query), sort_by_to_db(sort_by)),
+            f"Replenishment Needs.{download_type}")
 
 
 def get_template(switch_on):
@@ -283,6 +680,7 @@ def get_template(switch_on):
     # Output("stock-price-chart", "figure", allow_duplicate=True),
     Output('sales-category', 'figure', allow_duplicate=True),
      Output('top-products', 'figure', allow_duplicate=True),
+    Output('inventory-trend', 'figure', allow_duplicate=True),
     #  Output('inv-status', 'figure', allow_duplicate=True),
     Output('data-table', 'style_header'),
     Output('data-table', 'style_data_conditional'),
@@ -290,6 +688,7 @@ def get_template(switch_on):
     Input("color-mode-switch", "value"),
     prevent_initial_call=True
 )
+@instrument('update_theme', outputs=['sales-category', 'top-products', 'inventory-trend', 'style_header', 'style_data_conditional', 'style_data'])
 def update_theme(switch_on):
     '''
     Update theme to light or dark
@@ -301,7 +700,7 @@ def update_theme(switch_on):
     # pio.templates[template_themes[0]] if switch_on else pio.templates[template_themes[1]]
     template = get_template(switch_on)
     patches = []
-    for _ in range(2):
+    for _ in range(3):
         patched_figure = Patch()
         patched_figure["layout"]["template"] = template
         patches.append(patched_figure)
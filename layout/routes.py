@@ -0,0 +1,100 @@
+from flask import Response, abort, g, jsonify, request, stream_with_context
+from urllib.parse import urlencode
+import json
+import time
+from data import config
+from data.export import export_restock
+from data.metrics import registry, record_payload
+
+# Plain Flask routes served next to the Dash app
+
+export_path = 'export/replenishment'
+dash_update_path = '/_dash-update-component'
+
+
+def export_url(file_type, filters, table_filters=None, sort_by=None):
+    '''
+    Relative URL of the export for the dashboard filters, DataTable column filters and sort order
+    '''
+    state = {'filters': list(filters), 'table_filters': table_filters or [], 'sort_by': sort_by or []}
+    return f"{export_path}.{file_type}?{urlencode({'q': json.dumps(state, default=str)})}"
+
+
+def parse_export_state(q):
+    '''
+    (filters, table_filters, sort_by) from the export URL's q parameter
+    '''
+    state = json.loads(q or '{}')
+    filters = tuple(state.get('filters') or [None] * 8)
+    if len(filters) not in (7, 8):
+        raise ValueError("Expected 7 or 8 dashboard filters")
+    table_filters = [tuple(f) for f in state.get('table_filters', [])]
+    sort_by = [tuple(s) for s in state.get('sort_by', [])]
+    return filters, table_filters, sort_by
+
+
+def request_name():
+    '''
+    Metric name for the current request, Dash updates are named after their first output
+    '''
+    if request.path == dash_update_path:
+        body = request.get_json(silent=True) or {}
+        output = str(body.get('output', 'unknown')).lstrip('.').split('.')[0]
+        return f'http.dash_update.{output}'
+    if request.path.startswith(f'/{export_path}'):
+        return 'http.export'
+    return None
+
+
+def timed_stream(name, chunks):
+    '''
+    Pass chunks through, recording the streamed bytes and time once the body is sent
+    '''
+    start = time.perf_counter()
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    registry.observe(f'{name}.stream', time.perf_counter() - start)
+    registry.observe_size(f'{name}.bytes', size)
+
+
+def register_routes(server):
+    '''
+    Add the export and metrics routes to the Flask server
+    '''
+    @server.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @server.after_request
+    def record_request(response):
+        name = request_name() if config.METRICS_ENABLED else None
+        if name:
+            registry.observe(f'{name}.seconds', time.perf_counter() - g.request_start)
+            if not response.is_streamed:
+                size = response.calculate_content_length() or 0
+                registry.observe_size(f'{name}.bytes', size)
+                if 'metrics_callback' in g:
+                    record_payload(g.metrics_callback, size, g.get('metrics_callback_end'))
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return Response(registry.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+    @server.route('/metrics.json')
+    def metrics_json():
+        return jsonify({**registry.snapshot(), 'stats': registry.stats()})
+
+    @server.route(f'/{export_path}.<file_type>')
+    def export_replenishment(file_type):
+        try:
+            filters, table_filters, sort_by = parse_export_state(request.args.get('q'))
+            chunks, mimetype = export_restock(file_type, filters, table_filters, sort_by)
+        except ValueError as e:
+            abort(400, str(e))
+        if config.METRICS_ENABLED:
+            chunks = timed_stream(f'http.export.{file_type}', chunks)
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="Replenishment Needs.{file_type}"'})
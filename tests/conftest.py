@@ -0,0 +1,104 @@
+import os
+import sys
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import config, snapshot, shared
+from data.db import dispose_engine, create_db
+from data.shards import dispose_shard_engines
+from data.cache import dashboard_cache
+from data.topk import top_products
+from data.bitmap import filter_engine
+from benchmarks.synthetic import make_grocery_frame
+
+# Every test gets its own database, shard directory and snapshot paths under tmp_path,
+# with the process-wide engines and in-memory derived state reset around it
+
+# Dashboard filter states: (received start, end, last order start, end, categories, products, statuses)
+filter_cases = [
+    (None,) * 7,
+    ('2024-02-01', '2024-11-30', None, None, None, None, None),
+    (None, '2024-06-30', '2024-03-01', '2025-01-31', ['Dairy', 'Bakery'], None, ['Active']),
+    (None, None, None, None, None, ['Product 1', 'Product 7'], None),
+    ('2024-01-15', '2024-12-01', None, None, ['Seafood', 'Dairy'], ['Product 3', 'Product 200'], ['Active', 'Backordered']),
+    (None, None, '2024-05-01', '2024-12-31', None, [f'Product {i}' for i in range(0, 300, 4)], ['Discontinued']),
+    (None, None, None, None, ['Nothing'], None, None),
+]
+
+
+def filter_frame(df, rec_start_date=None, rec_end_date=None, order_start_date=None, order_end_date=None,
+                 categories=None, products=None, statuses=None, warehouses=None):
+    '''
+    The rows of a db-named frame the dashboard filters select, filtered in pandas
+    '''
+    keep = df['Category'].notna()
+    for col, start, end in [('Date_Received', rec_start_date, rec_end_date),
+                            ('Last_Order_Date', order_start_date, order_end_date)]:
+        if end:
+            keep &= df[col] <= pd.Timestamp(end)
+            if start:
+                keep &= df[col] >= pd.Timestamp(start)
+    for col, values in [('Category', categories), ('Product_Name', products), ('Status', statuses),
+                        ('Warehouse_Location', warehouses)]:
+        if values:
+            keep &= df[col].isin(values)
+    return df.loc[keep]
+
+
+def reset_state():
+    # background snapshot and shared dataset writes still pending from the last test
+    for module in (snapshot, shared):
+        if module._timer is not None:
+            module._timer.cancel()
+            module._timer = None
+    dispose_engine()
+    dispose_shard_engines()
+    if dashboard_cache is not None:
+        dashboard_cache.clear()
+    top_products.version = None
+    top_products.pending = False
+    filter_engine.key = None
+    filter_engine.index = None
+    # every test database starts again from the same data versions
+    if 'layout.layout' in sys.modules:
+        sys.modules['layout.layout'].filter_options_cache.clear()
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    '''
+    Settings pointing at an empty database in tmp_path
+    '''
+    monkeypatch.setattr(config, 'DB_PATH', str(tmp_path / 'grocery.db'))
+    monkeypatch.setattr(config, 'SHARD_DIR', str(tmp_path / 'grocery_shards'))
+    monkeypatch.setattr(config, 'SNAPSHOT_PATH', str(tmp_path / 'grocery.arrow'))
+    monkeypatch.setattr(config, 'SHARED_DIR', str(tmp_path / 'shared'))
+    monkeypatch.setattr(config, 'CACHE_PATH', str(tmp_path / 'cache.db'))
+    monkeypatch.setattr(config, 'SNAPSHOT_ENABLED', False)
+    monkeypatch.setattr(config, 'SHARED_DATASET', False)
+    monkeypatch.setattr(config, 'REFRESH_INTERVAL', 0)
+    monkeypatch.setattr(config, 'WEB_INGEST', False)
+    monkeypatch.setattr(config, 'STORAGE', 'wide')
+    monkeypatch.setattr(config, 'SHARDS', 0)
+    reset_state()
+    yield config
+    reset_state()
+
+
+@pytest.fixture
+def rows():
+    '''
+    A few thousand synthetic db-named rows
+    '''
+    return make_grocery_frame(3000, seed=1, products=300, warehouses=20)
+
+
+@pytest.fixture
+def loaded(db, rows):
+    '''
+    The rows written to the grocery table
+    '''
+    create_db(rows, override=True)
+    return rows
@@ -0,0 +1,18 @@
+from benchmarks.bench_suite import run_suite
+from benchmarks.load_test import filter_requests, dashboard_outputs, table_outputs
+
+
+def test_suite_runs_on_a_small_table(db):
+    results = run_suite(500, 1)
+    assert results['rows'] == 500
+    assert {'convert_data_types', 'create_db', 'get_all_data', 'data_table_filters'} <= set(results['benchmarks'])
+    assert any(name.startswith('filter_data.') for name in results['benchmarks'])
+
+
+def test_load_test_requests_match_the_callbacks():
+    from dash._callback import GLOBAL_CALLBACK_MAP
+    import layout.layout  # registers the callbacks
+    requests = dict(filter_requests((None,) * 7, None, 1, session='s'))
+    for name, outputs in [('update_dashboard', dashboard_outputs), ('update_data_table', table_outputs)]:
+        assert requests[name]['output'] in GLOBAL_CALLBACK_MAP
+        assert [(o['id'], o['property']) for o in requests[name]['outputs']] == outputs
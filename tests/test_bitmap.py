@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+from data.bitmap import filter_engine, FilterIndex
+from data.db import query_filtered, upsert_data
+from conftest import filter_cases
+
+columns = ['Product_Name', 'Category', 'Revenue']
+
+
+def sorted_rows(df):
+    return df[columns].astype({'Category': str}).sort_values(columns).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('filters', filter_cases)
+def test_bitmap_matches_query_filtered(loaded, filters):
+    result = filter_engine.query(*filters, columns=columns)
+    pd.testing.assert_frame_equal(sorted_rows(result), sorted_rows(query_filtered(*filters, columns=columns)),
+                                  check_dtype=False)
+
+
+def test_index_rebuilt_after_writes(loaded):
+    filters = filter_cases[2]
+    before = filter_engine.get_index()
+    changed = query_filtered(*filters, columns=['Product_ID', 'Category']).head(5)
+    upsert_data(changed.assign(Category='Seafood'))
+    assert filter_engine.get_index() is not before
+    result = filter_engine.query(*filters, columns=columns)
+    assert len(result) == len(query_filtered(*filters)) == len(before.query(*filters)) - 5
+
+
+def test_missing_values_never_match():
+    df = pd.DataFrame({'Product_Name': ['a', 'b', None, 'a'], 'Category': ['Dairy', None, 'Dairy', 'Bakery'],
+                       'Status': ['Active', 'Active', None, 'Active'], 'Revenue': [1.0, 2.0, 3.0, 4.0],
+                       'Date_Received': pd.to_datetime(['2024-01-01', '2024-01-02', None, '2024-01-04']),
+                       'Last_Order_Date': pd.to_datetime(['2024-02-01', None, '2024-02-03', '2024-02-04'])})
+    index = FilterIndex(df)
+    assert index.row_ids().tolist() == [0, 2, 3]
+    assert index.row_ids(None, '2024-01-03').tolist() == [0]
+    assert index.row_ids(products=['a']).tolist() == [0, 3]
+    assert index.row_ids(statuses=['Active'], categories=['Dairy']).tolist() == [0]
+    assert index.row_ids(order_start_date='2024-02-02', order_end_date='2024-02-03').tolist() == [2]
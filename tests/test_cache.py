@@ -0,0 +1,70 @@
+import pytest
+from data.cache import ResultCache, MemoryBackend, SqliteBackend, normalize_filters, compute_coalesced
+from data.db import query_filtered, upsert_data
+from data.rollup import ensure_rollup
+from conftest import filter_cases
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def cache(request, db, tmp_path):
+    if request.param == 'sqlite':
+        return ResultCache(SqliteBackend(path=str(tmp_path / 'results.db'), max_entries=3))
+    return ResultCache(MemoryBackend(max_entries=3))
+
+
+def test_equivalent_filters_share_a_key():
+    assert normalize_filters('2024-01-01', '2024-02-01T00:00:00', None, '', ['b', 'a', 'b'], [], 'Active') == \
+        normalize_filters('2024-01-01 00:00', '2024-02-01', None, None, ['a', 'b'], None, ['Active'])
+    assert normalize_filters(*filter_cases[1]) != normalize_filters(*filter_cases[2])
+
+
+def test_cached_results_match_and_follow_writes(cache, loaded):
+    calls = []
+
+    def revenue(*filters):
+        calls.append(filters)
+        return query_filtered(*filters, columns=['Revenue'])['Revenue'].sum()
+
+    filters = filter_cases[2]
+    key = normalize_filters(*filters)
+    expected = revenue(*filters)
+    assert cache.get_or_compute(key, revenue, *filters) == pytest.approx(expected)
+    assert cache.get_or_compute(key, revenue, *filters) == pytest.approx(expected)
+    assert (len(calls), cache.hits, cache.misses) == (2, 1, 1)
+
+    # a write moves the data version, the old entry no longer answers
+    changed = query_filtered(*filters, columns=['Product_ID', 'Revenue']).head(3)
+    upsert_data(changed.assign(Revenue=changed['Revenue'] + 100))
+    assert cache.get_or_compute(key, revenue, *filters) == pytest.approx(expected + 300)
+    assert len(calls) == 3
+
+
+def test_miss_looked_up_once_before_computing(monkeypatch, cache, loaded):
+    gets = []
+    get = cache.backend.get
+    monkeypatch.setattr(cache.backend, 'get', lambda key: gets.append(key) or get(key))
+    assert cache.lookup('key') == (False, None)
+    assert cache.compute('key', lambda: 7) == 7
+    # the flight's own check, for a computation that finished after the caller's lookup
+    assert len(gets) == 2
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cache.get_or_compute('key', lambda: pytest.fail('recomputed')) == 7
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_evicted(cache, loaded):
+    for value in range(4):
+        cache.get_or_compute(('key', value), lambda: value)
+    assert cache.lookup(('key', 0)) == (False, None)
+    assert cache.lookup(('key', 3)) == (True, 3)
+    assert len(cache.backend) == 3
+
+
+def test_dashboard_through_cache(loaded):
+    from layout.layout import compute_dashboard
+    ensure_rollup()
+    filters = filter_cases[1] + (None,)
+    direct = compute_dashboard(*filters)
+    cached = compute_coalesced(normalize_filters(*filters), compute_dashboard, *filters)
+    assert cached[:3] == direct[:3]
+    assert compute_coalesced(normalize_filters(*filters), compute_dashboard, *filters) is cached
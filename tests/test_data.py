@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from data.data import convert_data_types, add_fields
+from data.db import create_db, query_db, upsert_data
+from data.stream import prepare_chunk
+from benchmarks.synthetic import make_raw_frame
+
+
+def raw_rows():
+    raw = make_raw_frame(4, seed=0)
+    raw['Unit_Price'] = ['$1,024.50', '$0.99', '$12.00', '$3.10']
+    raw['percentage'] = ['10.00%', '12.5%', '0.1%', '1,000%']
+    raw['Stock_Quantity'] = [5, 50, 0, 10]
+    raw['Reorder_Level'] = [10, 10, 10, 10]
+    raw['Sales_Volume'] = [3, 1, 0, 7]
+    raw['Status'] = ['Active', 'Active', 'Discontinued', 'Backordered']
+    return raw
+
+
+def test_convert_and_add_fields():
+    df = add_fields(convert_data_types(raw_rows()))
+    assert df['Unit_Price'].tolist() == [1024.5, 0.99, 12.0, 3.1]
+    assert df['percentage'].dtype == np.float64
+    assert df['percentage'].tolist() == [0.1, 0.125, 0.001, 10.0]
+    assert df['Revenue'].tolist() == [3073.5, 0.99, 0.0, 21.7]
+    assert df['Inventory Value'].tolist() == [5122.5, 49.5, 0.0, 31.0]
+    assert df['Low Stock'].tolist() == [True, False, True, False]
+    assert df['Discontinued'].tolist() == [False, False, True, False]
+    assert isinstance(df['Category'].dtype, pd.CategoricalDtype)
+
+
+def test_percentage_round_trips_exactly(db):
+    df = prepare_chunk(raw_rows())
+    create_db(df, override=True)
+    stored = query_db('SELECT percentage FROM grocery ORDER BY Product_ID')['percentage']
+    assert stored.tolist() == [0.1, 0.125, 0.001, 10.0]
+    assert upsert_data(prepare_chunk(raw_rows())) == {'inserted': 0, 'updated': 0, 'unchanged': 4}
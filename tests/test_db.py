@@ -0,0 +1,116 @@
+import pandas as pd
+import pytest
+from data.db import query_filtered
+from conftest import filter_cases, filter_frame
+
+
+def test_one_pooled_engine_with_pragmas(monkeypatch, db):
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import text
+    from data.db import get_engine, dispose_engine
+    monkeypatch.setattr(db, 'SQLITE_CACHE_SIZE', -2000)
+    engine = get_engine()
+    with ThreadPoolExecutor(4) as pool:
+        assert set(pool.map(lambda i: get_engine(), range(8))) == {engine}
+
+    def pragmas():
+        with get_engine().connect() as conn:
+            return tuple(conn.execute(text(f'PRAGMA {p}')).scalar()
+                         for p in ['journal_mode', 'synchronous', 'cache_size'])
+    # every pooled connection is set up the same way, synchronous NORMAL is 1
+    with ThreadPoolExecutor(4) as pool:
+        assert set(pool.map(lambda i: pragmas(), range(8))) == {('wal', 1, -2000)}
+    dispose_engine()
+    assert get_engine() is not engine
+
+
+def by_id(df):
+    return df.astype({'Product_ID': str}).sort_values('Product_ID').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('filters', filter_cases)
+def test_query_filtered_matches_pandas(loaded, filters):
+    columns = ['Product_ID', 'Revenue', 'Inventory_Value']
+    expected = by_id(filter_frame(loaded, *filters)[columns])
+    result = by_id(query_filtered(*filters, columns=columns))
+    assert result['Product_ID'].tolist() == expected['Product_ID'].tolist()
+    assert result['Revenue'].tolist() == pytest.approx(expected['Revenue'].tolist())
+
+
+def test_query_filtered_by_warehouse(loaded):
+    warehouses = ['Warehouse 3', 'Warehouse 11']
+    expected = by_id(filter_frame(loaded, categories=['Dairy'], warehouses=warehouses))
+    result = by_id(query_filtered(categories=['Dairy'], warehouses=warehouses, columns=['Product_ID']))
+    assert len(expected) and result['Product_ID'].tolist() == expected['Product_ID'].tolist()
+
+
+def stored_frame():
+    from data.snapshot import read_table_frame
+    return by_id(read_table_frame()).set_index('Product_ID')
+
+
+def comparable(df):
+    return df.astype({c: str for c in ['Category', 'Supplier_Name', 'Status']}).astype({'Restock': bool})
+
+
+@pytest.fixture(params=['wide', 'normalized'])
+def storage(request, monkeypatch, db, rows):
+    from data import config
+    from data.db import create_db
+    monkeypatch.setattr(config, 'STORAGE', request.param)
+    create_db(rows, override=True)
+    return rows
+
+
+def test_upsert_round_trip(storage):
+    from data.db import upsert_data
+    rows = storage
+    changed = rows.iloc[:20].astype({'Supplier_Name': str})
+    changed['Stock_Quantity'] += 1
+    changed['Revenue'] *= 2
+    changed.loc[changed.index[:5], 'Category'] = 'Dairy'
+    changed.loc[changed.index[5:10], 'Status'] = 'Discontinued'
+    changed.loc[changed.index[10:15], 'Date_Received'] += pd.Timedelta(days=3)
+    changed.loc[changed.index[15], 'Supplier_Name'] = 'Supplier 999'
+    same = rows.iloc[20:30]
+    new = rows.iloc[30:35].assign(Product_ID=[f'new-{i}' for i in range(5)])
+    # the last row for a repeated id wins
+    repeated = changed.iloc[:1].assign(Stock_Quantity=-1)
+    batch = pd.concat([changed, same, new, repeated])
+    assert upsert_data(batch) == {'inserted': 5, 'updated': 20, 'unchanged': 10}
+
+    final = batch.drop_duplicates('Product_ID', keep='last').set_index('Product_ID')
+    expected = rows.set_index('Product_ID')
+    expected = pd.concat([expected.drop(final.index, errors='ignore'), final]).sort_index()
+    result = stored_frame()
+    assert list(result.index) == list(expected.index)
+    for column in ['Product_Name', 'Category', 'Supplier_Name', 'Status', 'Stock_Quantity', 'Date_Received', 'Restock']:
+        assert comparable(result)[column].tolist() == comparable(expected)[column].tolist(), column
+    assert result['Revenue'].tolist() == pytest.approx(expected['Revenue'].tolist())
+    assert upsert_data(batch) == {'inserted': 0, 'updated': 0, 'unchanged': 35}
+
+    # rows with only some columns change just those
+    partial = rows.iloc[40:45][['Product_ID', 'Reorder_Level']].assign(Reorder_Level=1000)
+    assert upsert_data(partial) == {'inserted': 0, 'updated': 5, 'unchanged': 0}
+    after = stored_frame()
+    assert (after.loc[partial['Product_ID'], 'Reorder_Level'] == 1000).all()
+    assert after.drop(index=partial['Product_ID'].tolist()).equals(result.drop(index=partial['Product_ID'].tolist()))
+
+
+@pytest.mark.parametrize('filters', filter_cases)
+def test_normalized_storage_filters_like_wide(monkeypatch, db, rows, filters):
+    from data import config
+    from data.db import create_db, is_view, query_db
+    from data.normalized import dimension_table, facts_table
+    monkeypatch.setattr(config, 'STORAGE', 'normalized')
+    create_db(rows, override=True)
+    assert is_view('grocery')
+    # the facts hold keys into the dimension tables instead of the labels
+    assert query_db(f'SELECT COUNT(*) AS n FROM "{dimension_table("Category")}"')['n'][0] == rows['Category'].nunique()
+    assert 'Category' not in query_db(f'SELECT * FROM "{facts_table("grocery")}" LIMIT 1').columns
+    columns = ['Product_ID', 'Category', 'Date_Received', 'Revenue']
+    expected = by_id(filter_frame(rows, *filters)[columns])
+    result = by_id(query_filtered(*filters, columns=columns))
+    assert result['Product_ID'].tolist() == expected['Product_ID'].tolist()
+    assert result['Category'].tolist() == expected['Category'].astype(str).tolist()
+    assert pd.to_datetime(result['Date_Received']).tolist() == expected['Date_Received'].tolist()
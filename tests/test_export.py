@@ -0,0 +1,55 @@
+import io
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from sqlalchemy import text
+from data import config
+from data.db import get_engine, query_db
+from data.export import export_restock, export_columns
+
+no_filters = (None,) * 8
+
+
+def export(file_type, sort_by=None):
+    chunks, _ = export_restock(file_type, no_filters, sort_by=sort_by)
+    return b''.join(c if isinstance(c, bytes) else c.encode() for c in chunks)
+
+
+def test_parquet_schema_from_declared_types(monkeypatch, loaded):
+    monkeypatch.setattr(config, 'EXPORT_BATCH_ROWS', 5)
+    # the first batches hold nothing but nulls in these columns
+    with get_engine().begin() as conn:
+        conn.execute(text('UPDATE grocery SET Supplier_Name = NULL, Revenue = NULL, Stock_Quantity = NULL '
+                          'WHERE Product_ID IN (SELECT Product_ID FROM grocery WHERE Restock = 1 LIMIT 12)'))
+    table = pq.read_table(io.BytesIO(export('parquet', [('Supplier_Name', True), ('Product_ID', True)])))
+    assert table.column_names == export_columns
+    assert table.schema.field('Supplier Name').type == pa.string()
+    assert table.schema.field('Revenue').type == pa.float64()
+    assert table.schema.field('Stock Quantity').type == pa.int64()
+    stored = query_db('SELECT Supplier_Name, Revenue FROM grocery WHERE Restock = 1 '
+                      'ORDER BY Supplier_Name, Product_ID')
+    assert table.num_rows == len(stored)
+    assert table.column('Supplier Name').to_pylist() == [v if isinstance(v, str) else None
+                                                         for v in stored['Supplier_Name']]
+    assert table.column('Revenue').null_count == 12
+
+
+def test_empty_parquet_export_keeps_schema(loaded):
+    chunks, _ = export_restock('parquet', no_filters, [('Product_Name', '=', 'none')])
+    table = pq.read_table(io.BytesIO(b''.join(chunks)))
+    assert table.num_rows == 0
+    assert table.schema.field('Revenue').type == pa.float64()
+
+
+def test_csv_and_xlsx_exports_match_the_table_rows(monkeypatch, loaded):
+    import pandas as pd
+    from data.db import query_restock_page
+    monkeypatch.setattr(config, 'EXPORT_BATCH_ROWS', 7)
+    page, total = query_restock_page(no_filters, page_size=10 ** 6)
+    csv = pd.read_csv(io.BytesIO(export('csv')), dtype={'Product Id': str, 'Supplier Id': str})
+    xlsx = pd.read_excel(io.BytesIO(export('xlsx')), dtype={'Product Id': str, 'Supplier Id': str})
+    for df in (csv, xlsx):
+        assert list(df.columns) == export_columns
+        assert len(df) == total
+        assert df['Product Id'].tolist() == page['Product_ID'].astype(str).tolist()
+        assert df['Revenue'].tolist() == pytest.approx(page['Revenue'].tolist())
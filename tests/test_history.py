@@ -0,0 +1,91 @@
+import pandas as pd
+import pytest
+from data import config
+from data.db import create_db, upsert_data, query_db
+from data.history import (record_snapshot, state_as_of, product_history, totals_history, history_table,
+                          latest_table)
+
+
+@pytest.fixture
+def history(monkeypatch, db, rows):
+    # snapshots are taken by hand on chosen days
+    monkeypatch.setattr(config, 'HISTORY_ENABLED', False)
+    create_db(rows, override=True)
+    assert record_snapshot('2024-03-01') == len(rows)
+    return rows
+
+
+def stock(df):
+    return dict(zip(df['Product_ID'].astype(str), df['Stock_Quantity']))
+
+
+def test_only_changes_recorded(history):
+    rows = history
+    assert record_snapshot('2024-03-02') == 0
+    changed = rows.head(5).assign(Stock_Quantity=rows['Stock_Quantity'].head(5) + 7)
+    upsert_data(changed)
+    assert record_snapshot('2024-03-03') == 5
+    # a later write the same day replaces that day's rows
+    upsert_data(changed.assign(Stock_Quantity=1))
+    assert record_snapshot('2024-03-03') == 5
+    assert query_db(f'SELECT COUNT(*) AS n FROM "{history_table}"')['n'][0] == len(rows) + 5
+
+    create_db(rows.iloc[10:], override=True)
+    assert record_snapshot('2024-03-04') == 10
+
+    ids = rows['Product_ID'].head(12).tolist()
+    assert stock(state_as_of('2024-03-02', ids=ids)) == stock(rows.head(12))
+    assert stock(state_as_of('2024-03-03', ids=ids)) == {**stock(rows.head(12)), **stock(changed.assign(Stock_Quantity=1))}
+    # deleted products drop out, the rest are back to their loaded values
+    assert stock(state_as_of('2024-03-04', ids=ids)) == stock(rows.iloc[10:12])
+    assert state_as_of('2024-02-28').empty
+    assert len(state_as_of('2024-03-04')) == len(rows) - 10
+
+
+def test_product_history_and_totals(history):
+    rows = history
+    product = rows['Product_Name'].iloc[0]
+    ids = rows.loc[rows['Product_Name'] == product, 'Product_ID']
+    upsert_data(rows.loc[ids.index[:1]].assign(Stock_Quantity=0))
+    record_snapshot('2024-03-05')
+
+    trend = product_history([product], '2024-03-01', '2024-03-10', ['Stock_Quantity'])
+    total = rows.loc[ids.index, 'Stock_Quantity'].sum()
+    assert trend['Snapshot_Date'].tolist() == ['2024-03-01', '2024-03-05']
+    assert trend['Stock_Quantity'].tolist() == [total, total - rows.loc[ids.index[0], 'Stock_Quantity']]
+    assert product_history(['missing'], '2024-03-01', '2024-03-10').empty
+
+    totals = totals_history('2024-03-02', '2024-03-10', ['Dairy'])
+    dairy = rows.loc[rows['Category'] == 'Dairy']
+    # the opening state is the last snapshot on or before the start
+    assert totals['Snapshot_Date'].tolist() == ['2024-03-02', '2024-03-05']
+    assert totals['Rows'].tolist() == [len(dairy)] * 2
+    assert totals['Revenue'].iloc[0] == pytest.approx(dairy['Revenue'].sum())
+
+
+def test_writes_recorded_as_they_happen(monkeypatch, history):
+    monkeypatch.setattr(config, 'HISTORY_ENABLED', True)
+    changed = history.head(3).assign(Reorder_Level=1000, Stock_Quantity=5)
+    upsert_data(changed)
+    latest = query_db(f'SELECT Product_ID, Stock_Quantity, Snapshot_Date FROM "{latest_table}" '
+                      f'WHERE Snapshot_Date != \'2024-03-01\'')
+    assert stock(latest) == stock(changed)
+    assert (latest['Snapshot_Date'] == pd.Timestamp.today().strftime('%Y-%m-%d')).all()
+
+
+def test_totals_follow_updates_deletes_and_category_moves(history):
+    rows = history
+    moved = rows.head(6).assign(Category='Dairy', Revenue=rows['Revenue'].head(6) * 2, Stock_Quantity=3)
+    upsert_data(moved)
+    record_snapshot('2024-03-06')
+    create_db(pd.concat([moved, rows.iloc[6:]]).iloc[4:], override=True)
+    record_snapshot('2024-03-06')
+    record_snapshot('2024-03-07')
+    current = query_db('SELECT * FROM grocery')
+    for day in ('2024-03-06', '2024-03-07'):
+        totals = totals_history(day, day).set_index('Category').sort_index()
+        expected = current.groupby('Category').agg(Rows=('Product_ID', 'size'), Stock_Quantity=('Stock_Quantity', 'sum'),
+                                                   Revenue=('Revenue', 'sum'), Restock=('Restock', 'sum'))
+        assert totals['Rows'].tolist() == expected['Rows'].tolist()
+        for measure in ('Stock_Quantity', 'Revenue', 'Restock'):
+            assert totals[measure].tolist() == pytest.approx(expected[measure].astype(float).tolist())
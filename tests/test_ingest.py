@@ -0,0 +1,38 @@
+from data.db import query_db
+from data.ingest import ingest_files, discover
+from benchmarks.synthetic import make_raw_frame
+
+
+def test_overlapping_ids_written_in_input_order(db, tmp_path):
+    # the first input takes longest to parse, the later ones repeat some of its ids
+    inputs = tmp_path / 'incoming'
+    inputs.mkdir()
+    make_raw_frame(20000, seed=1).to_csv(inputs / 'a.csv', index=False)
+    make_raw_frame(400, seed=2).to_csv(inputs / 'b.csv', index=False)
+    make_raw_frame(200, seed=3, start=100).to_json(inputs / 'c.jsonl', orient='records', lines=True)
+    paths = discover([str(inputs)])
+    assert [p.rsplit('/', 1)[1] for p in paths] == ['a.csv', 'b.csv', 'c.jsonl']
+
+    results = ingest_files(paths, workers=3, progress=None)
+    assert [r['path'] for r in results] == paths
+    assert [r['status'] for r in results] == ['loaded'] * 3
+    assert (results[1]['inserted'], results[1]['updated']) == (0, 400)
+
+    stored = query_db('SELECT Product_ID, Product_Name, Stock_Quantity FROM grocery ORDER BY Product_ID')
+    assert len(stored) == 20000
+    # ids 0-99 last come from b, 100-299 from c, the rest from a
+    expected = make_raw_frame(20000, seed=1)
+    expected.iloc[:400] = make_raw_frame(400, seed=2)
+    expected.iloc[100:300] = make_raw_frame(200, seed=3, start=100).set_index(expected.index[100:300])
+    expected['Product_ID'] = expected['Product_ID'].astype(int)
+    expected = expected.sort_values('Product_ID').reset_index(drop=True)
+    assert stored['Product_Name'].tolist() == expected['Product_Name'].tolist()
+    assert stored['Stock_Quantity'].tolist() == expected['Stock_Quantity'].tolist()
+
+
+def test_already_ingested_inputs_skipped(db, tmp_path):
+    path = tmp_path / 'a.csv'
+    make_raw_frame(300, seed=1).to_csv(path, index=False)
+    assert ingest_files([str(path)], workers=1, progress=None)[0]['status'] == 'loaded'
+    assert ingest_files([str(path)], workers=1, progress=None)[0]['status'] == 'skipped'
+    assert ingest_files([str(path)], workers=1, force=True, progress=None)[0]['updated'] == 0
@@ -0,0 +1,176 @@
+import threading
+import time
+import pytest
+from dash import no_update
+from data import config
+from data.db import query_restock_page
+from data.loader import data_ready
+from layout import layout
+from layout.layout import update_data_table, update_dashboard
+
+no_filters = (None,) * 8
+
+
+@pytest.fixture
+def ready(loaded):
+    data_ready.set()
+    yield loaded
+    data_ready.clear()
+
+
+def test_table_page_moved_back_when_result_shrinks(ready):
+    _, total = query_restock_page(no_filters)
+    last = -(-total // 10) - 1
+    data, page_count, page_current = update_data_table(0, 10, [], '', *no_filters, 1)
+    assert (len(data), page_count, page_current) == (10, last + 1, 0)
+
+    data, page_count, page_current = update_data_table(last + 5, 10, [], '', *no_filters, 1)
+    assert (page_count, page_current) == (last + 1, last)
+    assert len(data) == total - last * 10
+
+    # no rows left at all
+    data, page_count, page_current = update_data_table(3, 10, [], '{Product Name} = "none"', *no_filters, 1)
+    assert (data, page_count, page_current) == ([], 1, 0)
+
+
+def dashboard(categories, session):
+    return update_dashboard(None, None, None, None, categories, None, None, None, 1, None, session)
+
+
+def test_superseded_dashboard_update_skips_queries(monkeypatch, ready):
+    # waits by default, longer here so the test isn't timing sensitive
+    assert config.DASHBOARD_DEBOUNCE_MS > 0
+    monkeypatch.setattr(config, 'DASHBOARD_DEBOUNCE_MS', 300)
+    calls = []
+    compute_dashboard = layout.compute_dashboard
+    monkeypatch.setattr(layout, 'compute_dashboard', lambda *f: calls.append(f[4]) or compute_dashboard(*f))
+    first = []
+    thread = threading.Thread(target=lambda: first.append(dashboard(['Dairy'], 'page')))
+    thread.start()
+    time.sleep(0.1)
+    latest = dashboard(['Bakery'], 'page')
+    thread.join()
+    assert first == [(no_update,) * 6]
+    assert latest[0] is not no_update
+    assert calls == [['Bakery']]
+
+
+def test_cached_dashboard_update_not_delayed(monkeypatch, ready):
+    monkeypatch.setattr(config, 'DASHBOARD_DEBOUNCE_MS', 0)
+    computed = dashboard(['Dairy'], 'a')
+    monkeypatch.setattr(config, 'DASHBOARD_DEBOUNCE_MS', 5000)
+    start = time.perf_counter()
+    cached = dashboard(['Dairy'], 'b')
+    assert (cached[:3], cached[5]) == (computed[:3], computed[5])
+    assert time.perf_counter() - start < 1
+
+
+def patched(patch):
+    return {tuple(op['location']): op['params']['value'] for op in patch.to_plotly_json()['operations']}
+
+
+def test_dashboard_sends_only_changed_outputs(ready):
+    from data.rollup import ensure_rollup
+    ensure_rollup()
+    first = dashboard(['Dairy'], None)
+    kpis, charts, digests = first[:3], first[3:5], first[5]
+    assert all(isinstance(k, str) for k in kpis)
+    sales = patched(charts[0])
+    assert set(sales) == {('data', 0, 'x'), ('data', 0, 'y'), ('data', 0, 'text')}
+    assert sales[('data', 0, 'x')] == ['Dairy']
+
+    # the page already shows these, nothing is resent
+    again = update_dashboard(None, None, None, None, ['Dairy'], None, None, None, 1, digests, None)
+    assert again == (no_update,) * 6
+
+    # only the outputs whose digest moved go out
+    stale = {**digests, 'total-sales': 'old', 'top-products': 'old'}
+    partial = update_dashboard(None, None, None, None, ['Dairy'], None, None, None, 1, stale, None)
+    assert partial[0] == kpis[0]
+    assert partial[1:4] == (no_update,) * 3
+    assert patched(partial[4]) == patched(charts[1])
+    assert partial[5] == digests
+
+
+def find(component, id):
+    if getattr(component, 'id', None) == id:
+        return component
+    children = getattr(component, 'children', None)
+    for child in children if isinstance(children, (list, tuple)) else [children]:
+        if hasattr(child, 'to_plotly_json'):
+            found = find(child, id)
+            if found is not None:
+                return found
+    return None
+
+
+def test_layout_builds_before_and_after_the_data_load(loaded):
+    from layout.layout import create_layout
+    assert find(create_layout(), 'category-dropdown').options == []
+    data_ready.set()
+    try:
+        page = create_layout()
+    finally:
+        data_ready.clear()
+    dropdown = find(page, 'category-dropdown')
+    assert sorted(o['value'] for o in dropdown.options) == sorted(loaded['Category'].unique())
+    assert 'debounce' not in dropdown.to_plotly_json()['props']
+    assert find(page, 'data-table') is not None
+
+
+@pytest.mark.parametrize('supported', [True, False])
+def test_dropdown_debounce_only_where_supported(monkeypatch, db, supported):
+    from layout.layout import create_layout
+    monkeypatch.setattr(config, 'FILTER_DEBOUNCE', True)
+    if not supported:
+        # Dropdown props of dash 2.14
+        monkeypatch.setattr(layout, 'dropdown_props', layout.dropdown_props - {'debounce', 'closeOnSelect'})
+    props = find(create_layout(), 'product-dropdown').to_plotly_json()['props']
+    assert (props.get('debounce'), props.get('closeOnSelect')) == ((True, False) if supported else (None, None))
+
+
+def test_filter_query_keeps_text_values():
+    from layout.layout import split_filter_query
+    assert split_filter_query('{Product Id} contains 29 && {Supplier Id} = 123 && {Revenue} > 10 '
+                              '&& {Stock Quantity} scontains 5 && {Product Name} scontains Milk') == [
+        ('Product_ID', 'contains', '29'), ('Supplier_ID', '=', '123'), ('Revenue', '>', 10.0),
+        ('Stock_Quantity', 'scontains', '5'), ('Product_Name', 'scontains', 'Milk')]
+
+
+def table_rows(ready, filter_query):
+    data, _, _ = update_data_table(0, 1000, [], filter_query, *no_filters, 1)
+    return data
+
+
+def test_table_filters_on_text_columns(ready):
+    restock = ready.loc[ready['Restock']]
+    row = restock.iloc[0]
+    assert [r['Product Id'] for r in table_rows(ready, f'{{Product Id}} = {row["Product_ID"]}')] == [row['Product_ID']]
+    contains = table_rows(ready, '{Product Id} contains 29')
+    assert sorted(r['Product Id'] for r in contains) == sorted(i for i in restock['Product_ID'] if '29' in i)
+    assert len(contains)
+    supplier = table_rows(ready, f'{{Supplier Id}} = "{row["Supplier_ID"]}"')
+    assert len(supplier) == (restock['Supplier_ID'] == row['Supplier_ID']).sum()
+
+
+def test_case_sensitive_contains(ready):
+    name = ready.loc[ready['Restock'], 'Product_Name'].iloc[0]
+    expected = ready.loc[ready['Restock'] & ready['Product_Name'].str.contains(name.lower(), case=False)]
+    assert len(table_rows(ready, f'{{Product Name}} icontains {name.lower()}')) == len(expected)
+    assert len(table_rows(ready, f'{{Product Name}} contains {name.upper()}')) == len(expected)
+    assert table_rows(ready, f'{{Product Name}} scontains {name.lower()}') == []
+    assert len(table_rows(ready, f'{{Product Name}} scontains {name}')) == \
+        ready.loc[ready['Restock'], 'Product_Name'].str.contains(name, regex=False).sum()
+
+
+def test_filter_options_read_once_per_data_version(monkeypatch, ready):
+    from data.db import upsert_data
+    calls = []
+    get_distinct_values = layout.get_distinct_values
+    monkeypatch.setattr(layout, 'get_distinct_values', lambda column: calls.append(column) or get_distinct_values(column))
+    first = layout.get_filter_options()
+    assert layout.get_filter_options() is first
+    assert len(calls) == 4
+    upsert_data(ready.head(1).assign(Product_ID='new-1', Category='Frozen Novelties'))
+    assert 'Frozen Novelties' in layout.get_filter_options()['categories']
+    assert len(calls) == 8
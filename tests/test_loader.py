@@ -0,0 +1,35 @@
+import json
+import threading
+import pytest
+from dash import no_update
+from data import config, loader
+from layout.layout import get_filter_options, update_data_table
+
+
+@pytest.fixture
+def not_ready(monkeypatch, tmp_path):
+    monkeypatch.setattr(loader, 'data_ready', threading.Event())
+    monkeypatch.setattr(loader, 'load_error', None)
+    monkeypatch.setattr(loader, 'timings', {})
+    monkeypatch.setattr(loader.refresher, 'interval', 0)
+    monkeypatch.setattr(config, 'STARTUP_REPORT_PATH', str(tmp_path / 'startup.json'))
+
+
+def test_page_served_before_data_then_filled(not_ready, loaded):
+    assert get_filter_options()['categories'] == []
+    assert update_data_table(0, 10, [], '', *(None,) * 8, 1) == (no_update,) * 3
+    loader.load_data()
+    assert loader.is_data_ready() and loader.load_error is None
+    assert sorted(get_filter_options()['categories']) == sorted(loaded['Category'].unique())
+    with open(config.STARTUP_REPORT_PATH) as f:
+        report = json.load(f)
+    assert report['data_ready'] and {'data_load.setup_db', 'data_load.rollup', 'data_load'} <= set(report['timings'])
+
+
+def test_load_error_reported(monkeypatch, not_ready, db):
+    def fail():
+        raise RuntimeError('no dataset')
+    monkeypatch.setattr(loader, 'setup_db', fail)
+    loader.load_data()
+    assert not loader.is_data_ready()
+    assert 'no dataset' in loader.startup_report()['error']
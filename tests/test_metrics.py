@@ -0,0 +1,59 @@
+import pytest
+from dash import Dash, html, Input, Output
+from data import config, metrics
+from data.metrics import registry, instrument
+from layout.routes import register_routes
+
+
+def dash_update(client):
+    body = {'output': 'out.children', 'outputs': {'id': 'out', 'property': 'children'},
+            'inputs': [{'id': 'in', 'property': 'children', 'value': 'x'}], 'changedPropIds': ['in.children']}
+    response = client.post('/_dash-update-component', json=body)
+    assert response.status_code == 200
+    return response
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(config, 'METRICS_ENABLED', True)
+    registry.clear()
+    app = Dash(__name__)
+    app.layout = html.Div([html.Div('x', id='in'), html.Div(id='out')])
+    register_routes(app.server)
+
+    @app.callback(Output('out', 'children'), Input('in', 'children'))
+    @instrument('echo')
+    def echo(value):
+        return value * 5000
+
+    yield app.server.test_client()
+    registry.clear()
+
+
+def test_payload_taken_from_encoded_response(monkeypatch, client):
+    monkeypatch.setattr(metrics, 'payload_size', lambda value: pytest.fail('re-serialized the output'))
+    response = dash_update(client)
+    sizes = registry.snapshot()
+    assert sizes['callback.echo.payload']['count'] == 1
+    assert sizes['callback.echo.payload']['sum'] == len(response.data)
+    # Dash's own encoding is timed without serializing the outputs again
+    assert sizes['callback.echo.encode']['count'] == 1
+    assert sizes['callback.echo.encode']['sum'] > 0
+
+
+def test_outputs_measured_on_sampled_calls(monkeypatch, client):
+    monkeypatch.setattr(config, 'METRICS_PAYLOAD_SAMPLE', 2)
+    for i in range(4):
+        dash_update(client)
+    sizes = registry.snapshot()
+    assert sizes['callback.echo.payload']['count'] == 4
+    assert sizes['callback.echo.payload.0']['count'] == 2
+
+
+def test_cache_stats_exported(monkeypatch, client):
+    monkeypatch.setitem(registry.sources, 'cache.test', lambda: {'hits': 3, 'misses': 1})
+    stats = client.get('/metrics.json').get_json()['stats']
+    assert stats['cache.test'] == {'hits': 3, 'misses': 1}
+    assert 'cache.dashboard' in stats
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'grocery_stat{name="cache.test",stat="misses"} 1' in text
@@ -0,0 +1,40 @@
+from datetime import datetime
+import pytest
+from data.db import query_db
+from data.refresh import recompute_flags
+
+
+def expected_flags(df, now):
+    expired = df['Expiration_Date'] <= now
+    low = df['Stock_Quantity'] < df['Reorder_Level']
+    return {'Discontinued': (df['Status'] == 'Discontinued').astype(int).tolist(),
+            'Low_Stock': low.astype(int).tolist(),
+            'Expired': expired.astype(int).tolist(),
+            'Restock': ((low | expired) & (df['Status'] == 'Active')).astype(int).tolist()}
+
+
+def stored():
+    df = query_db('SELECT * FROM grocery ORDER BY Product_ID')
+    df['Expiration_Date'] = df['Expiration_Date'].astype('datetime64[ns]')
+    return df
+
+
+@pytest.mark.parametrize('now', ['2024-03-01', '2024-08-15'])
+def test_flags_follow_the_date(loaded, now):
+    now = datetime.fromisoformat(now)
+    assert recompute_flags(now) > 0
+    df = stored()
+    assert {c: df[c].astype(int).tolist() for c in expected_flags(df, now)} == expected_flags(df, now)
+    # once per day unless forced, and nothing left to change
+    assert recompute_flags(now) is None
+    assert recompute_flags(now, force=True) == 0
+
+
+def test_flag_changes_move_the_data_version(loaded):
+    from data.db import get_data_version, query_restock_page
+    version = get_data_version()
+    now = datetime(2024, 8, 15)
+    recompute_flags(now)
+    assert get_data_version() != version
+    _, total = query_restock_page((None,) * 8)
+    assert total == sum(expected_flags(stored(), now)['Restock'])
@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+from data.db import query_filtered, query_db, upsert_data
+from data.rollup import ensure_rollup, build_rollup, rollup_kpis, rollup_sales_per_category, rollup_table
+from conftest import filter_cases
+
+rollup_cases = [f for f in filter_cases if not f[5]]
+columns = ['Category', 'Revenue', 'Inventory_Value', 'Inventory_Turnover_Rate']
+
+
+def check_matches_rows(filters):
+    rows = query_filtered(*filters, columns=columns)
+    rollup_filters = filters[:5] + filters[6:]
+    revenue, inventory, turnover = rollup_kpis(*rollup_filters)
+    assert revenue == pytest.approx(rows['Revenue'].sum())
+    assert inventory == pytest.approx(rows['Inventory_Value'].sum())
+    if len(rows):
+        assert turnover == pytest.approx(rows['Inventory_Turnover_Rate'].mean())
+    per_category = rollup_sales_per_category(*rollup_filters).set_index('Category')['Revenue']
+    expected = rows.groupby('Category', observed=True)['Revenue'].sum()
+    assert per_category.to_dict() == pytest.approx(expected.to_dict())
+
+
+@pytest.mark.parametrize('filters', rollup_cases)
+def test_rollup_matches_filtered_rows(loaded, filters):
+    ensure_rollup()
+    check_matches_rows(filters)
+
+
+def test_rollup_kept_in_step_with_upserts(loaded):
+    ensure_rollup()
+    df = loaded.sample(40, random_state=2).copy()
+    df['Revenue'] += 500
+    df.loc[df.index[:10], 'Category'] = 'Dairy'
+    df.loc[df.index[10:20], 'Date_Received'] += pd.Timedelta(days=30)
+    upsert_data(df)
+    for filters in rollup_cases:
+        check_matches_rows(filters)
+    incremental = query_db(f'SELECT * FROM "{rollup_table}" ORDER BY 1, 2, 3, 4')
+    build_rollup()
+    rebuilt = query_db(f'SELECT * FROM "{rollup_table}" ORDER BY 1, 2, 3, 4')
+    assert incremental.drop(columns=['Revenue_Sum']).equals(rebuilt.drop(columns=['Revenue_Sum']))
+    assert incremental['Revenue_Sum'].tolist() == pytest.approx(rebuilt['Revenue_Sum'].tolist())
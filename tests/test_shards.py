@@ -0,0 +1,175 @@
+import os
+import pandas as pd
+import pytest
+from data import config
+from data.db import query_db, query_filtered, is_view, has_table
+from data.shards import ensure_shards, stored_shard_count, shard_path, shard_of, each_shard
+from conftest import reset_state, filter_cases, filter_frame
+
+filters = ('2024-02-01', '2024-11-30', '2024-03-01', '2025-01-31', ['Dairy', 'Bakery'], None, ['Active'])
+
+
+def summary():
+    return query_db('SELECT COUNT(*) AS n, SUM(Revenue) AS revenue, MIN(Date_Received) AS first, '
+                    'MAX(Last_Order_Date) AS last FROM grocery').round(4).iloc[0].to_dict()
+
+
+def filtered():
+    df = query_filtered(*filters, columns=['Product_Name', 'Category', 'Revenue', 'Date_Received'])
+    return df.astype({'Category': str}).sort_values(['Product_Name', 'Revenue']).reset_index(drop=True)
+
+
+def switch(monkeypatch, shards, storage='wide'):
+    monkeypatch.setattr(config, 'SHARDS', shards)
+    monkeypatch.setattr(config, 'STORAGE', storage)
+    reset_state()
+    ensure_shards()
+    reset_state()
+
+
+@pytest.mark.parametrize('storage', ['wide', 'normalized'])
+def test_switch_shards_on_and_off(monkeypatch, db, rows, storage):
+    monkeypatch.setattr(config, 'STORAGE', storage)
+    from data.db import create_db
+    create_db(rows, override=True)
+    before, before_rows = summary(), filtered()
+    assert is_view('grocery') == (storage == 'normalized')
+
+    switch(monkeypatch, 3)
+    assert stored_shard_count() == 3
+    assert all(os.path.exists(shard_path(i)) for i in range(3))
+    assert summary() == before
+    assert filtered().equals(before_rows)
+    placed = each_shard(lambda i: query_db('SELECT Warehouse_Location FROM grocery'))
+    assert sum(len(p) for p in placed.values()) == len(rows)
+    assert all((p['Warehouse_Location'].map(shard_of) == i).all() for i, p in placed.items())
+
+    switch(monkeypatch, 2)
+    assert stored_shard_count() == 2
+    assert not os.path.exists(shard_path(2))
+    assert summary() == before
+
+    switch(monkeypatch, 0, storage)
+    assert stored_shard_count() == 0
+    assert is_view('grocery') == (storage == 'normalized')
+    assert summary() == before
+    assert filtered().equals(before_rows)
+
+
+def test_normalized_shards_rejected(monkeypatch, db, loaded):
+    monkeypatch.setattr(config, 'SHARDS', 2)
+    monkeypatch.setattr(config, 'STORAGE', 'normalized')
+    reset_state()
+    with pytest.raises(ValueError, match='GROCERY_STORAGE=wide'):
+        ensure_shards()
+    monkeypatch.setattr(config, 'SHARDS', 0)
+    reset_state()
+    assert stored_shard_count() == 0
+    assert has_table('grocery') and query_db('SELECT COUNT(*) AS n FROM grocery')['n'][0] == len(loaded)
+
+
+@pytest.fixture
+def sharded(monkeypatch, db, rows):
+    monkeypatch.setattr(config, 'SHARDS', 3)
+    reset_state()
+    ensure_shards()
+    from data.db import create_db
+    create_db(rows, override=True)
+    return rows
+
+
+def other_shard_warehouse(warehouse, warehouses):
+    return next(w for w in warehouses if shard_of(w) != shard_of(warehouse))
+
+
+def stored_rows():
+    return query_db('SELECT * FROM grocery').set_index('Product_ID').sort_index()
+
+
+def test_upsert_moves_products_between_shards(monkeypatch, sharded):
+    from data import shards
+    from data.db import upsert_data
+    calls = []
+    remove_rows = shards.remove_rows
+    monkeypatch.setattr(shards, 'remove_rows', lambda ids, name: calls.append(sorted(ids)) or remove_rows(ids, name))
+    warehouses = sharded['Warehouse_Location'].unique().tolist()
+    df = sharded.head(6).copy()
+    for i in range(3):
+        df.loc[df.index[i], 'Warehouse_Location'] = other_shard_warehouse(df['Warehouse_Location'].iloc[i], warehouses)
+    df.loc[df.index[3:], 'Revenue'] += 1000
+    new = sharded.head(2).assign(Product_ID=['new-1', 'new-2'])
+    counts = upsert_data(pd.concat([df, new]))
+    assert counts == {'inserted': 2, 'updated': 6, 'unchanged': 0}
+    assert sorted(i for ids in calls for i in ids) == sorted(df['Product_ID'].iloc[:3])
+
+    stored = stored_rows()
+    assert len(stored) == len(sharded) + 2
+    assert stored.loc[df['Product_ID'], 'Warehouse_Location'].tolist() == df['Warehouse_Location'].tolist()
+    assert stored.loc[df['Product_ID'], 'Revenue'].tolist() == pytest.approx(df['Revenue'].tolist())
+    placed = each_shard(lambda i: query_db('SELECT Warehouse_Location FROM grocery'))
+    assert all((p['Warehouse_Location'].map(shard_of) == i).all() for i, p in placed.items())
+
+
+def test_upsert_without_moves_deletes_nothing(monkeypatch, sharded):
+    from data import shards
+    from data.db import upsert_data
+    monkeypatch.setattr(shards, 'remove_rows', lambda ids, name: pytest.fail('nothing moved'))
+    df = sharded.sample(50, random_state=0).assign(Stock_Quantity=7)
+    assert upsert_data(df)['inserted'] == 0
+    # rows without the warehouse column stay in their product's shard
+    partial = sharded.head(20)[['Product_ID', 'Reorder_Level']].assign(Reorder_Level=1000)
+    assert upsert_data(partial) == {'inserted': 0, 'updated': 20, 'unchanged': 0}
+    stored = stored_rows()
+    assert len(stored) == len(sharded)
+    assert (stored.loc[partial['Product_ID'], 'Reorder_Level'] == 1000).all()
+    placed = each_shard(lambda i: query_db('SELECT Warehouse_Location FROM grocery'))
+    assert all((p['Warehouse_Location'].map(shard_of) == i).all() for i, p in placed.items())
+
+
+@pytest.mark.parametrize('filters', filter_cases)
+@pytest.mark.parametrize('warehouses', [None, ['Warehouse 3', 'Warehouse 11']])
+def test_query_shards_matches_rows(sharded, filters, warehouses):
+    from data.shards import query_shards
+    (revenue, inventory, turnover), per_category, top = query_shards(*filters, warehouses, k=5)
+    rows = filter_frame(sharded, *filters, warehouses)
+    assert revenue == pytest.approx(rows['Revenue'].sum())
+    assert inventory == pytest.approx(rows['Inventory_Value'].sum())
+    if len(rows):
+        assert turnover == pytest.approx(rows['Inventory_Turnover_Rate'].mean())
+    expected = rows.groupby('Category', observed=True)['Revenue'].sum()
+    assert per_category.set_index('Category')['Revenue'].to_dict() == pytest.approx(expected.to_dict())
+    expected_top = rows.groupby('Product_Name')['Revenue'].sum().nlargest(5)
+    assert [p for p, _ in top] == list(expected_top.index)
+    assert [r for _, r in top] == pytest.approx(list(expected_top.values))
+
+
+def test_sharded_dashboard_matches_unsharded(monkeypatch, sharded):
+    from data.rollup import ensure_rollup
+    from layout.layout import compute_dashboard
+    ensure_rollup()
+    cases = [f + (w,) for f in filter_cases for w in (None, ['Warehouse 3'])]
+    results = [compute_dashboard(*case)[:3] for case in cases]
+    switch(monkeypatch, 0)
+    ensure_rollup()
+    assert [compute_dashboard(*case)[:3] for case in cases] == results
+
+
+def test_shard_top_fetches_deeper_only_when_needed(monkeypatch, sharded):
+    from data import shards
+    from data.db import upsert_data
+    depths = []
+    shard_products = shards.shard_products
+    monkeypatch.setattr(shards, 'shard_products', lambda *args, depth=None, names=None:
+                        depths.append(depth) or shard_products(*args, depth=depth, names=names))
+    by_shard = sharded.assign(Shard=sharded['Warehouse_Location'].map(shard_of)).groupby('Shard')
+    spread = by_shard.nth(0).assign(Product_Name='Spread', Revenue=100.0)
+    peaks = by_shard.nth(1).assign(Revenue=150.0)
+    peaks['Product_Name'] = [f'Peak {i}' for i in range(len(peaks))]
+    rest = sharded.drop(spread.index.union(peaks.index)).assign(Revenue=1.0)
+    upsert_data(pd.concat([spread, peaks, rest]).drop(columns='Shard'))
+    # every shard's own top product is a peak, the spread product only wins once they're merged
+    assert shards.query_shards(k=1)[2] == [('Spread', 300.0)]
+    assert [d for d in depths if d] == [1, 1, 1, 2, 2, 2]
+    depths.clear()
+    assert shards.query_shards(k=4)[2][:2] == [('Spread', 300.0), ('Peak 0', 150.0)]
+    assert [d for d in depths if d] == [4, 4, 4]
@@ -0,0 +1,61 @@
+import glob
+import os
+import time
+import pandas as pd
+import pytest
+from data import config, shared as shared_module
+from data.db import query_filtered, upsert_data
+from data.shared import shared_dataset, publish, publish_if_stale, filter_shared, read_pointer
+from conftest import filter_cases
+
+columns = ['Product_Name', 'Category', 'Revenue']
+
+
+@pytest.fixture
+def shared(monkeypatch, loaded):
+    monkeypatch.setattr(config, 'SHARED_DATASET', True)
+    for name, value in [('directory', config.SHARED_DIR), ('pointer_stat', None), ('generation', None),
+                        ('version', None), ('frame', None)]:
+        monkeypatch.setattr(shared_dataset, name, value)
+    return loaded
+
+
+def sorted_rows(df):
+    return df[columns].astype({'Category': str, 'Product_Name': str}).sort_values(columns).reset_index(drop=True)
+
+
+def test_nothing_published(shared):
+    assert filter_shared() is None
+
+
+@pytest.mark.parametrize('filters', filter_cases)
+def test_shared_matches_query_filtered(shared, filters):
+    publish()
+    result = filter_shared(*filters, columns=columns)
+    pd.testing.assert_frame_equal(sorted_rows(result), sorted_rows(query_filtered(*filters, columns=columns)),
+                                  check_dtype=False)
+
+
+def test_writes_publish_a_new_generation_in_the_background(monkeypatch, shared):
+    monkeypatch.setattr(config, 'SHARED_KEEP_GENERATIONS', 2)
+    monkeypatch.setattr(config, 'SHARED_DELAY', 0.3)
+    first = publish_if_stale()
+    assert publish_if_stale() == first
+    frame = shared_dataset.get_frame()
+    publishes = []
+    publish_if_stale_now = shared_module.publish_if_stale
+    monkeypatch.setattr(shared_module, 'publish_if_stale', lambda: publishes.append(1) or publish_if_stale_now())
+    changed = query_filtered(categories=['Dairy'], columns=['Product_ID', 'Revenue']).head(4)
+    for i in range(3):
+        upsert_data(changed.assign(Revenue=changed['Revenue'] + i + 1))
+    # nothing published on the writer's thread, readers fall back to the table meanwhile
+    assert read_pointer() == first
+    assert filter_shared(categories=['Dairy']) is None
+    deadline = time.time() + 10
+    while read_pointer() == first and time.time() < deadline:
+        time.sleep(0.05)
+    assert publishes == [1]
+    assert len(glob.glob(os.path.join(config.SHARED_DIR, 'gen-*.arrow'))) == 2
+    revenue = filter_shared(categories=['Dairy'])['Revenue'].sum()
+    assert shared_dataset.get_frame() is not frame
+    assert revenue == pytest.approx(query_filtered(categories=['Dairy'])['Revenue'].sum())
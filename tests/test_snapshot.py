@@ -0,0 +1,75 @@
+import os
+import time
+import pandas as pd
+import pytest
+from data import config, snapshot
+from data.db import upsert_data, query_db, dispose_engine
+from data.snapshot import (ensure_snapshot, snapshot_is_current, load_frame, read_table_frame,
+                           restore_from_snapshot)
+from data.shared import read_shared_source, shared_columns
+
+
+@pytest.fixture
+def snapshots(monkeypatch, loaded):
+    monkeypatch.setattr(config, 'SNAPSHOT_ENABLED', True)
+    monkeypatch.setattr(config, 'SNAPSHOT_DELAY', 0)
+    ensure_snapshot()
+    return loaded
+
+
+def changed_rows(rows):
+    df = rows.head(5).copy()
+    df['Stock_Quantity'] = df['Stock_Quantity'] + 1000
+    return df
+
+
+def test_load_frame_matches_table(snapshots):
+    assert snapshot_is_current()
+    expected = read_table_frame()
+    pd.testing.assert_frame_equal(load_frame(), expected, check_dtype=False, check_categorical=False)
+    pd.testing.assert_frame_equal(load_frame(['Product_ID', 'Revenue']), expected[['Product_ID', 'Revenue']],
+                                  check_dtype=False)
+
+
+def test_full_readers_use_current_snapshot(monkeypatch, snapshots):
+    def no_sql():
+        raise AssertionError('read the table instead of the snapshot')
+    monkeypatch.setattr(snapshot, 'read_table_frame', no_sql)
+    monkeypatch.setattr(snapshot, 'query_db', no_sql)
+    df = read_shared_source()
+    assert list(df.columns) == shared_columns
+    assert len(df) == len(snapshots)
+
+
+def test_write_leaves_rewrite_to_next_read(snapshots):
+    mtime = os.stat(config.SNAPSHOT_PATH).st_mtime_ns
+    upsert_data(changed_rows(snapshots))
+    assert os.stat(config.SNAPSHOT_PATH).st_mtime_ns == mtime
+    assert not snapshot_is_current()
+    df = load_frame(['Product_ID', 'Stock_Quantity'])
+    stored = query_db('SELECT Product_ID, Stock_Quantity FROM grocery')
+    assert df.sort_values('Product_ID')['Stock_Quantity'].tolist() == \
+        stored.sort_values('Product_ID')['Stock_Quantity'].tolist()
+    assert snapshot_is_current()
+
+
+def test_writes_batched_into_one_background_rewrite(monkeypatch, snapshots):
+    monkeypatch.setattr(config, 'SNAPSHOT_DELAY', 0.2)
+    writes = []
+    write_snapshot = snapshot.write_snapshot
+    monkeypatch.setattr(snapshot, 'write_snapshot', lambda *a, **k: writes.append(1) or write_snapshot(*a, **k))
+    for i in range(3):
+        upsert_data(changed_rows(snapshots).assign(Reorder_Level=i))
+    assert writes == []
+    deadline = time.time() + 10
+    while not snapshot_is_current() and time.time() < deadline:
+        time.sleep(0.05)
+    assert snapshot_is_current()
+    assert writes == [1]
+
+
+def test_restore_from_snapshot(snapshots):
+    dispose_engine()
+    os.remove(config.DB_PATH)
+    assert restore_from_snapshot()
+    assert query_db('SELECT COUNT(*) AS n FROM grocery')['n'][0] == len(snapshots)
@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+from data.db import query_db
+from data.stream import stream_ingest, prepare_chunk
+from benchmarks.synthetic import make_raw_frame
+
+writers = {'csv': lambda df, path: df.to_csv(path, index=False),
+           'jsonl': lambda df, path: df.to_json(path, orient='records', lines=True),
+           'json': lambda df, path: df.to_json(path, orient='records'),
+           'xlsx': lambda df, path: df.to_excel(path, index=False)}
+compared = ['Product_ID', 'Product_Name', 'Category', 'Stock_Quantity', 'Unit_Price', 'Revenue', 'Restock']
+
+
+def stored():
+    df = query_db(f'SELECT {", ".join(compared)} FROM grocery')
+    return df.astype({'Product_ID': int}).sort_values('Product_ID').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('ext', list(writers))
+def test_chunked_ingest_matches_whole_file(db, tmp_path, ext):
+    raw = make_raw_frame(250, seed=4)
+    path = tmp_path / f'grocery.{ext}'
+    writers[ext](raw, path)
+    stats = stream_ingest(str(path), chunksize=60, progress=None)
+    assert (stats['rows'], stats['chunks']) == (250, 5)
+    expected = prepare_chunk(raw)[compared].astype({'Product_ID': int, 'Category': str, 'Restock': int})
+    result = stored()
+    assert result['Product_ID'].tolist() == expected['Product_ID'].tolist()
+    assert result['Product_Name'].tolist() == expected['Product_Name'].tolist()
+    assert result['Category'].tolist() == expected['Category'].tolist()
+    assert result['Stock_Quantity'].tolist() == expected['Stock_Quantity'].tolist()
+    assert result['Revenue'].tolist() == pytest.approx(expected['Revenue'].tolist())
+    assert result['Restock'].tolist() == expected['Restock'].tolist()
+
+
+def test_replace_keeps_last_duplicate_and_append_adds(db, tmp_path):
+    path = tmp_path / 'grocery.csv'
+    pd.concat([make_raw_frame(100, seed=1), make_raw_frame(50, seed=2)]).to_csv(path, index=False)
+    stream_ingest(str(path), chunksize=40, progress=None)
+    result = stored()
+    assert len(result) == 100
+    assert result['Product_Name'].head(50).tolist() == make_raw_frame(50, seed=2)['Product_Name'].tolist()
+
+    more = tmp_path / 'more.csv'
+    make_raw_frame(30, seed=3, start=100).to_csv(more, index=False)
+    stream_ingest(str(more), replace=False, progress=None)
+    assert len(stored()) == 130
@@ -0,0 +1,59 @@
+import pytest
+from data import config
+from data.db import query_filtered, upsert_data
+from data.topk import top_products
+from conftest import filter_cases
+
+# (received start, end, last order start, end, categories, statuses) the rankings answer
+topk_cases = [
+    (None, None, None, None, None, None),
+    (None, None, None, None, ['Dairy'], None),
+    (None, None, None, None, ['Dairy', 'Seafood', 'Bakery'], ['Active', 'Backordered']),
+    ('2023-01-01', '2030-01-01', None, '2030-01-01', None, ['Discontinued']),
+]
+
+
+def grouped_top(filters, k):
+    rows = query_filtered(*filters[:5], None, filters[5], columns=['Product_Name', 'Revenue'])
+    top = rows.groupby('Product_Name')['Revenue'].sum().nlargest(k)
+    return list(top.index), list(top.values)
+
+
+def check_top(filters, k=10):
+    top = top_products.top(*filters, k=k)
+    products, revenue = grouped_top(filters, k)
+    assert [p for p, _ in top] == products
+    assert [r for _, r in top] == pytest.approx(revenue)
+
+
+@pytest.mark.parametrize('filters', topk_cases)
+def test_top_products_match_groupby(loaded, filters):
+    check_top(filters)
+    check_top(filters, k=1)
+
+
+def test_row_level_dates_not_answered(loaded):
+    rec_start, rec_end = filter_cases[1][:2]
+    assert top_products.top(rec_start, rec_end) is None
+
+
+def test_top_products_maintained_across_upserts(loaded):
+    top_products.ensure_current()
+    cells = top_products.cells
+    # move some revenue into products outside the top, and products across categories
+    df = loaded.sample(60, random_state=3).copy()
+    df['Revenue'] = df['Revenue'] * 3
+    df.loc[df.index[:20], 'Category'] = 'Dairy'
+    df.loc[df.index[20:30], 'Status'] = 'Active'
+    upsert_data(df)
+    assert top_products.cells is cells and not top_products.pending
+    for filters in topk_cases:
+        check_top(filters)
+    incremental = [top_products.top(*filters, k=config.TOP_PRODUCTS) for filters in topk_cases]
+    top_products.version = None
+    top_products.ensure_current()
+    assert top_products.cells is not cells
+    for filters, before in zip(topk_cases, incremental):
+        rebuilt = top_products.top(*filters, k=config.TOP_PRODUCTS)
+        assert [p for p, _ in rebuilt] == [p for p, _ in before]
+        assert [r for _, r in rebuilt] == pytest.approx([r for _, r in before])